@@ -0,0 +1,257 @@
+"""Renderização de PDFs (orçamentos e relatório geral) com reportlab.
+
+Fica fora do server.py para que os workers do ProcessPoolExecutor importem apenas este
+módulo: as funções recebem dicionários simples e devolvem os bytes do PDF, sem acesso
+ao banco nem ao event loop.
+"""
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Any, Dict, List
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+AZUL = colors.HexColor("#1e3a5f")
+LARANJA = colors.HexColor("#f97316")
+CINZA_CLARO = colors.HexColor("#f8fafc")
+CINZA_BORDA = colors.HexColor("#e2e8f0")
+
+FRETE_OPCOES = {
+    "destinatario": "Por conta do destinatário",
+    "remetente": "Por conta do remetente (CIF)",
+    "incluso": "Frete incluso",
+}
+
+SEGMENTOS_LABELS = {
+    "licitacao": "Licitação",
+    "consumidor_final": "Consumidor Final",
+    "revenda": "Revenda",
+    "brindeiros": "Brindeiros",
+}
+
+_estilos = getSampleStyleSheet()
+TEXTO = ParagraphStyle("texto", parent=_estilos["Normal"], fontSize=9, leading=12)
+PEQUENO = ParagraphStyle("pequeno", parent=TEXTO, fontSize=8, leading=10, textColor=colors.HexColor("#666666"))
+SECAO = ParagraphStyle("secao", parent=TEXTO, fontSize=11, leading=14, textColor=AZUL,
+                       fontName="Helvetica-Bold", spaceBefore=8, spaceAfter=4)
+TITULO = ParagraphStyle("titulo", parent=TEXTO, fontSize=18, leading=22, textColor=AZUL, fontName="Helvetica-Bold")
+
+
+def moeda(valor: Any) -> str:
+    """R$ 1.234,56"""
+    texto = f"{float(valor or 0):,.2f}"
+    return "R$ " + texto.replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def data_br(valor: Any) -> str:
+    if isinstance(valor, str) and valor:
+        try:
+            valor = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+        except ValueError:
+            return valor
+    if isinstance(valor, datetime):
+        return valor.strftime("%d/%m/%Y")
+    return "-"
+
+
+def _esc(texto: Any) -> str:
+    """Escapa o texto para a marcação mini-HTML do Paragraph"""
+    return str(texto if texto is not None else "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _p(texto: Any, estilo: ParagraphStyle = TEXTO) -> Paragraph:
+    return Paragraph(_esc(texto), estilo)
+
+
+def _tabela(linhas: List[List[Any]], larguras: List[float], alinhar_direita: List[int] = ()) -> Table:
+    tabela = Table(linhas, colWidths=larguras, repeatRows=1)
+    estilo = [
+        ("BACKGROUND", (0, 0), (-1, 0), AZUL),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("LINEBELOW", (0, 1), (-1, -1), 0.5, CINZA_BORDA),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, CINZA_CLARO]),
+    ]
+    for coluna in alinhar_direita:
+        estilo.append(("ALIGN", (coluna, 0), (coluna, -1), "RIGHT"))
+    tabela.setStyle(TableStyle(estilo))
+    return tabela
+
+
+def _cabecalho(titulo: str, linhas_info: List[str], largura: float) -> Table:
+    logo = Paragraph('<font color="#1e3a5f"><b>XSELL</b></font> <font color="#f97316"><b>SOLUÇÕES</b></font>',
+                     ParagraphStyle("logo", parent=TEXTO, fontSize=18, leading=22))
+    info = [Paragraph(f"<b>{titulo}</b>", ParagraphStyle("doc", parent=TITULO, alignment=2))]
+    info += [_p(linha, ParagraphStyle("info", parent=PEQUENO, alignment=2)) for linha in linhas_info]
+    tabela = Table([[logo, info]], colWidths=[largura * 0.5, largura * 0.5])
+    tabela.setStyle(TableStyle([
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("LINEBELOW", (0, 0), (-1, 0), 2, AZUL),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
+    ]))
+    return tabela
+
+
+def render_orcamento(orc: Dict[str, Any]) -> bytes:
+    """PDF do orçamento com o mesmo conteúdo da antiga versão impressa pelo navegador"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=15 * mm, rightMargin=15 * mm,
+                            topMargin=15 * mm, bottomMargin=15 * mm, title=f"Orçamento {orc.get('numero', '')}")
+    largura = doc.width
+
+    data = orc.get("data")
+    if isinstance(data, str):
+        data = datetime.fromisoformat(data.replace("Z", "+00:00"))
+    validade = data_br(data + timedelta(days=int(orc.get("validade_dias") or 0))) if isinstance(data, datetime) else "-"
+
+    elementos = [_cabecalho("ORÇAMENTO", [
+        f"Nº: {orc.get('numero', '')}",
+        f"Data: {data_br(data)}",
+        f"Validade: {validade}",
+    ], largura), Spacer(1, 6 * mm)]
+
+    cliente = [_p("CLIENTE", PEQUENO), Paragraph(f"<b>{_esc(orc.get('cliente_nome', ''))}</b>", TEXTO)]
+    for rotulo, campo in (("CNPJ: ", "cliente_cnpj"), ("", "cliente_endereco"), ("Tel: ", "cliente_telefone"), ("Email: ", "cliente_email")):
+        if orc.get(campo):
+            cliente.append(_p(f"{rotulo}{orc[campo]}"))
+    condicoes = [
+        _p("CONDIÇÕES COMERCIAIS", PEQUENO),
+        _p(f"Forma de Pagamento: {orc.get('forma_pagamento') or '-'}"),
+        _p(f"Prazo de Entrega: {orc.get('prazo_entrega') or '-'}"),
+        _p(f"Frete: {FRETE_OPCOES.get(orc.get('frete_por_conta'), orc.get('frete_por_conta') or '-')}"),
+    ]
+    if orc.get("vendedor"):
+        condicoes.append(_p(f"Vendedor: {orc['vendedor']}"))
+    caixas = Table([[cliente, condicoes]], colWidths=[largura / 2 - 3 * mm, largura / 2 - 3 * mm], hAlign="LEFT")
+    caixas.setStyle(TableStyle([("BACKGROUND", (0, 0), (-1, -1), CINZA_CLARO), ("VALIGN", (0, 0), (-1, -1), "TOP")]))
+    elementos += [caixas, Spacer(1, 6 * mm), _p("Itens do Orçamento", SECAO)]
+
+    linhas = [["Descrição", "Qtd", "Un", "Preço Unit.", "Total"]]
+    for item in orc.get("itens") or []:
+        descricao = f"<b>{_esc(item.get('descricao', ''))}</b>"
+        if item.get("produto_codigo"):
+            descricao += f"<br/><font size=7 color='#666666'>Cód: {_esc(item['produto_codigo'])}</font>"
+        if item.get("personalizado"):
+            descricao += (f"<br/><font size=7 color='#f97316'><i>{_esc(item.get('tipo_personalizacao') or '')} "
+                          f"(+{moeda(item.get('valor_personalizacao'))}/un)</i></font>")
+        linhas.append([
+            Paragraph(descricao, TEXTO),
+            f"{item.get('quantidade', 0):g}",
+            item.get("unidade") or "UN",
+            moeda((item.get("preco_unitario") or 0) + (item.get("valor_personalizacao") or 0)),
+            moeda(item.get("preco_total")),
+        ])
+    elementos.append(_tabela(linhas, [largura - 95 * mm, 15 * mm, 12 * mm, 34 * mm, 34 * mm], [1, 3, 4]))
+
+    totais = [["Subtotal:", moeda(orc.get("valor_total"))]]
+    if orc.get("repassar_frete") and (orc.get("valor_frete") or 0) > 0:
+        totais.append(["Frete:", moeda(orc["valor_frete"])])
+    if orc.get("repassar_outras_despesas") and (orc.get("outras_despesas") or 0) > 0:
+        rotulo = "Outras Despesas"
+        if orc.get("descricao_outras_despesas"):
+            rotulo += f" ({orc['descricao_outras_despesas']})"
+        totais.append([f"{rotulo}:", moeda(orc["outras_despesas"])])
+    if (orc.get("desconto") or 0) > 0:
+        totais.append(["Desconto:", "- " + moeda(orc["desconto"])])
+    totais.append(["VALOR TOTAL:", moeda(orc.get("valor_final") or orc.get("valor_total"))])
+    tabela_totais = Table(totais, colWidths=[45 * mm, 35 * mm], hAlign="RIGHT")
+    tabela_totais.setStyle(TableStyle([
+        ("ALIGN", (1, 0), (1, -1), "RIGHT"),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("LINEBELOW", (0, 0), (-1, -2), 0.5, CINZA_BORDA),
+        ("BACKGROUND", (0, -1), (-1, -1), AZUL),
+        ("TEXTCOLOR", (0, -1), (-1, -1), colors.white),
+        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+        ("FONTSIZE", (0, -1), (-1, -1), 11),
+    ]))
+    elementos += [Spacer(1, 4 * mm), tabela_totais]
+
+    if orc.get("observacoes"):
+        elementos += [_p("Observações", SECAO), _p(orc["observacoes"])]
+
+    elementos += [_p("Condições Gerais", SECAO)] + [_p(f"• {linha}", PEQUENO) for linha in (
+        f"Este orçamento é válido por {orc.get('validade_dias', 15)} dias a partir da data de emissão.",
+        "Os preços podem sofrer alterações sem aviso prévio após o vencimento.",
+        "Produto sujeito à disponibilidade de estoque no momento do fechamento do pedido.",
+        "Imagens meramente ilustrativas.",
+    )]
+    elementos += [Spacer(1, 8 * mm), _p("XSELL Soluções Corporativas LTDA", ParagraphStyle("rodape", parent=PEQUENO, alignment=1))]
+
+    doc.build(elementos)
+    return buffer.getvalue()
+
+
+def _tabela_agrupamento(titulo: str, grupos: Dict[str, Dict[str, Any]], largura: float, rotulos: Dict[str, str] = None) -> List[Any]:
+    if not grupos:
+        return []
+    linhas = [[titulo, "Qtd", "Faturamento", "Lucro"]]
+    for chave, valores in sorted(grupos.items(), key=lambda kv: -(kv[1].get("faturamento") or 0)):
+        linhas.append([
+            _p((rotulos or {}).get(chave, chave) or "-"),
+            valores.get("quantidade", 0),
+            moeda(valores.get("faturamento")),
+            moeda(valores.get("lucro")),
+        ])
+    return [_p(titulo, SECAO), _tabela(linhas, [largura - 95 * mm, 15 * mm, 40 * mm, 40 * mm], [1, 2, 3])]
+
+
+def render_relatorio_geral(relatorio: Dict[str, Any], filtros: Dict[str, Any]) -> bytes:
+    """PDF do /relatorios/geral: totais, agrupamentos e pedidos detalhados"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), leftMargin=12 * mm, rightMargin=12 * mm,
+                            topMargin=12 * mm, bottomMargin=12 * mm, title="Relatório Geral XSELL")
+    largura = doc.width
+
+    periodo = f"Período: {data_br(filtros.get('data_inicio'))} a {data_br(filtros.get('data_fim'))}"
+    aplicados = []
+    if filtros.get("segmento") and filtros["segmento"] != "todos":
+        aplicados.append(f"Segmento: {SEGMENTOS_LABELS.get(filtros['segmento'], filtros['segmento'])}")
+    for campo, rotulo in (("vendedor", "Vendedor"), ("cidade", "Cidade"), ("status", "Status")):
+        if filtros.get(campo) and filtros[campo] != "todos":
+            aplicados.append(f"{rotulo}: {filtros[campo]}")
+    elementos = [_cabecalho("RELATÓRIO GERAL", [periodo] + aplicados, largura), Spacer(1, 5 * mm)]
+
+    resumo = [
+        ["Total Faturado", "Custo Total", "Lucro Bruto", "Despesas Operacionais", "Lucro Líquido"],
+        [moeda(relatorio.get("total_faturado")), moeda(relatorio.get("total_custo")), moeda(relatorio.get("lucro_total")),
+         moeda(relatorio.get("total_despesas_operacionais")), moeda(relatorio.get("lucro_liquido"))],
+    ]
+    elementos.append(_tabela(resumo, [largura / 5] * 5, [0, 1, 2, 3, 4]))
+    quantidades = (f"Pedidos: {relatorio.get('quantidade_pedidos', 0)}  |  "
+                   f"Licitações: {relatorio.get('quantidade_licitacoes', 0)}  |  "
+                   f"Frete interno: {moeda(relatorio.get('total_frete_interno'))}  |  "
+                   f"Despesas internas: {moeda(relatorio.get('total_despesas_internas'))}")
+    elementos += [Spacer(1, 2 * mm), _p(quantidades, PEQUENO)]
+
+    elementos += _tabela_agrupamento("Segmento", relatorio.get("por_segmento") or {}, largura, SEGMENTOS_LABELS)
+    elementos += _tabela_agrupamento("Vendedor", relatorio.get("por_vendedor") or {}, largura)
+    elementos += _tabela_agrupamento("Cidade", relatorio.get("por_cidade") or {}, largura)
+    elementos += _tabela_agrupamento("Status", relatorio.get("por_status") or {}, largura)
+
+    por_mes = relatorio.get("por_mes") or {}
+    if por_mes:
+        linhas = [["Mês", "Qtd", "Faturamento", "Lucro"]]
+        for mes, valores in por_mes.items():
+            linhas.append([mes, valores.get("quantidade", 0), moeda(valores.get("faturamento")), moeda(valores.get("lucro"))])
+        elementos += [_p("Evolução mensal", SECAO), _tabela(linhas, [largura - 95 * mm, 15 * mm, 40 * mm, 40 * mm], [1, 2, 3])]
+
+    detalhados = relatorio.get("pedidos_detalhados") or []
+    if detalhados:
+        linhas = [["Número", "Data", "Cliente", "Cidade", "Vendedor", "Segmento", "Status", "Venda", "Custo", "Lucro"]]
+        for p in detalhados:
+            linhas.append([
+                p.get("numero", ""), data_br(p.get("data")), _p(p.get("cliente_nome", "")), _p(p.get("cliente_cidade", "")),
+                _p(p.get("vendedor", "")), SEGMENTOS_LABELS.get(p.get("tipo_venda"), p.get("tipo_venda") or "-"),
+                p.get("status", ""), moeda(p.get("valor_venda")), moeda(p.get("custo_total")), moeda(p.get("lucro")),
+            ])
+        larguras = [28 * mm, 20 * mm, 50 * mm, 30 * mm, 28 * mm, 28 * mm, 22 * mm]
+        larguras += [(largura - sum(larguras)) / 3] * 3
+        elementos += [_p(f"Pedidos detalhados ({len(detalhados)})", SECAO), _tabela(linhas, larguras, [7, 8, 9])]
+
+    doc.build(elementos)
+    return buffer.getvalue()
@@ -1,18 +1,38 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile, Query, Response, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter
+from typing import List, Optional, Dict, Any, Tuple, Set, Type, Union
+from datetime import datetime, timezone, timedelta, date, time as dt_time
+from zoneinfo import ZoneInfo
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import os
 import logging
 import asyncio
 import uuid
+import json
+import base64
+import csv
+import io
+import time
+import hashlib
+import heapq
+import re
+import shutil
+import unicodedata
+import zlib
+from collections import OrderedDict, Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import quote
+import multiprocessing
 
 # Try to import resend for email notifications
 try:
@@ -21,6 +41,20 @@ try:
 except ImportError:
     RESEND_AVAILABLE = False
 
+# orjson acelera a serialização das respostas; sem ele fica o json padrão
+try:
+    import orjson  # noqa: F401
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# brotli é opcional: sem ele as respostas são negociadas só com gzip
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -29,9 +63,30 @@ UPLOAD_DIR = "/app/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Datas BSON voltam como datetime UTC com fuso, para a API continuar enviando o offset (+00:00)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, tzinfo=timezone.utc)
 db = client[os.environ['DB_NAME']]
 
+
+def _como_datetime(valor: Any) -> Any:
+    """Datas são gravadas como BSON date; strings ISO só aparecem em documentos ainda não migrados"""
+    if isinstance(valor, str) and valor:
+        try:
+            valor = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if isinstance(valor, datetime) and valor.tzinfo is None:
+        # Strings legadas sem offset foram gravadas em UTC
+        return valor.replace(tzinfo=timezone.utc)
+    return valor
+
+
+def _chave_data(valor: Any) -> str:
+    """Chave de ordenação que aceita datas BSON e strings ISO legadas"""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor or ""
+
 # Email configuration
 RESEND_API_KEY = os.environ.get("RESEND_API_KEY", "")
 SENDER_EMAIL = os.environ.get("SENDER_EMAIL", "onboarding@resend.dev")
@@ -40,10 +95,12 @@ NOTIFICATION_EMAIL = os.environ.get("NOTIFICATION_EMAIL", "pauloconsultordenegoc
 if RESEND_AVAILABLE and RESEND_API_KEY and not RESEND_API_KEY.startswith("re_test"):
     resend.api_key = RESEND_API_KEY
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse)
 api_router = APIRouter(prefix="/api")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Alterar BCRYPT_ROUNDS faz os hashes antigos serem regravados no próximo login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 security = HTTPBearer()
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "xsell-secret-key-change-in-production")
@@ -100,7 +157,8 @@ class Cliente(BaseModel):
     email: Optional[str] = None
     telefone: Optional[str] = None
     whatsapp: Optional[str] = None
-    historico: Optional[List[Dict[str, Any]]] = None
+    # quantidade_pedidos, valor_total, ultimo_pedido (ver aplicar_resumo_cliente)
+    resumo_compras: Optional[Dict[str, Any]] = None
     ocorrencias: Optional[List[Dict[str, Any]]] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -219,6 +277,28 @@ class Pedido(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class PedidoResumo(BaseModel):
+    """Linha da listagem de pedidos (view=summary): sem itens nem despesas detalhadas"""
+    id: str
+    numero: str
+    data: datetime
+    cliente_id: str
+    cliente_nome: str
+    frete: float = 0.0
+    repassar_frete: bool = False
+    prazo_entrega: str = ""
+    forma_pagamento: str = ""
+    tipo_venda: str = ""
+    vendedor: Optional[str] = None
+    custo_total: float = 0.0
+    valor_total_venda: float = 0.0
+    despesas_totais: float = 0.0
+    lucro_total: float = 0.0
+    status: str = "pendente"
+    quantidade_itens: int = 0
+    created_at: Optional[datetime] = None
+
+
 class PedidoCreate(BaseModel):
     cliente_id: str
     itens: List[Dict[str, Any]]
@@ -279,6 +359,29 @@ class Orcamento(BaseModel):
     data_cobrar_resposta: Optional[datetime] = None
     cliente_cobrado: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+
+
+class OrcamentoResumo(BaseModel):
+    """Linha da listagem de orçamentos (view=summary): sem itens"""
+    id: str
+    numero: str
+    data: datetime
+    cliente_id: str
+    cliente_nome: str
+    vendedor: Optional[str] = None
+    valor_total: float
+    desconto: float = 0.0
+    valor_final: float = 0.0
+    validade_dias: int = 15
+    forma_pagamento: str = ""
+    prazo_entrega: str = ""
+    status: str = "aberto"
+    data_cobrar_resposta: Optional[datetime] = None
+    cliente_cobrado: bool = False
+    quantidade_itens: int = 0
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
 
 class OrcamentoCreate(BaseModel):
@@ -377,12 +480,42 @@ class Licitacao(BaseModel):
     quantidade_total_fornecida: float = 0.0
     quantidade_total_restante: float = 0.0
     percentual_executado: float = 0.0
+    quantidade_fornecimentos: int = 0
     
     status_pagamento: str = "pendente"
     alertas: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class LicitacaoResumo(BaseModel):
+    """Linha da listagem de licitações (view=summary): sem produtos nem fornecimentos"""
+    id: str
+    contrato: Optional[Dict[str, Any]] = None
+    numero_licitacao: str
+    cidade: str
+    estado: str
+    orgao_publico: str
+    numero_empenho: str
+    data_empenho: datetime
+    numero_nota_empenho: str
+    previsao_fornecimento: Optional[datetime] = None
+    fornecimento_efetivo: Optional[datetime] = None
+    previsao_pagamento: Optional[datetime] = None
+    valor_total_venda: float = 0.0
+    valor_total_compra: float = 0.0
+    despesas_totais: float = 0.0
+    lucro_total: float = 0.0
+    quantidade_total_contratada: float = 0.0
+    quantidade_total_fornecida: float = 0.0
+    quantidade_total_restante: float = 0.0
+    percentual_executado: float = 0.0
+    quantidade_fornecimentos: int = 0
+    quantidade_produtos: int = 0
+    status_pagamento: str = "pendente"
+    alertas: List[str] = []
+    created_at: Optional[datetime] = None
+
+
 class LicitacaoCreate(BaseModel):
     # Contrato
     numero_contrato: str
@@ -534,14 +667,95 @@ class MovimentacaoCaixa(BaseModel):
     referencia_id: Optional[str] = None
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
 def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+# ==================== HASH DE SENHAS ====================
+# Cada chamada de bcrypt leva dezenas a centenas de ms de CPU. Elas rodam num pool de threads
+# próprio (o bcrypt libera o GIL) e a admissão é limitada: com o pool saturado, login e
+# cadastro respondem 429 em vez de enfileirar sem limite e atrasar o resto do worker.
+
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", "2"))
+HASH_FILA_MAX = int(os.environ.get("HASH_FILA_MAX", str(HASH_WORKERS * 8)))
+
+
+class PoolHash:
+    """Executor limitado para bcrypt com contadores de fila"""
+    
+    def __init__(self, workers: int, limite: int):
+        self.workers = workers
+        self.limite = limite
+        self.pendentes = 0
+        self.pico = 0
+        self.executados = 0
+        self.recusados = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+    
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash")
+        return self._executor
+    
+    def _concluido(self, _futuro):
+        self.pendentes -= 1
+        self.executados += 1
+    
+    async def executar(self, funcao, *args):
+        if self.pendentes >= self.limite:
+            self.recusados += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Muitas autenticações simultâneas, tente novamente em instantes",
+                headers={"Retry-After": "1"}
+            )
+        loop = asyncio.get_running_loop()
+        self.pendentes += 1
+        self.pico = max(self.pico, self.pendentes)
+        futuro = self._pool().submit(funcao, *args)
+        # A contagem só baixa quando a thread termina, mesmo que o cliente desista antes
+        futuro.add_done_callback(lambda f: loop.call_soon_threadsafe(self._concluido, f))
+        return await asyncio.wrap_future(futuro)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "limite": self.limite,
+            "pendentes": self.pendentes,
+            "fila": max(0, self.pendentes - self.workers),
+            "pico": self.pico,
+            "executados": self.executados,
+            "recusados": self.recusados
+        }
+
+
+pool_hash = PoolHash(HASH_WORKERS, HASH_FILA_MAX)
+
+
+def _custo_bcrypt(hashed_password: str) -> Optional[int]:
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _verificar_e_atualizar(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifica a senha e, se o hash foi gerado com outro custo, devolve um hash novo"""
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, None
+    if pwd_context.needs_update(hashed_password) or _custo_bcrypt(hashed_password) != BCRYPT_ROUNDS:
+        return True, pwd_context.hash(plain_password)
+    return True, None
+
+
+async def verificar_senha(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await pool_hash.executar(_verificar_e_atualizar, plain_password, hashed_password)
+
+
+async def gerar_hash_senha(password: str) -> str:
+    return await pool_hash.executar(get_password_hash, password)
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -550,6 +764,61 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
+class CacheTTL:
+    """Cache LRU em memória com expiração por TTL e contadores de acertos/falhas"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._dados: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def get(self, chave: str) -> Any:
+        item = self._dados.get(chave)
+        if item is None:
+            self.misses += 1
+            return None
+        valor, expira_em = item
+        if expira_em < time.monotonic():
+            del self._dados[chave]
+            self.misses += 1
+            return None
+        self._dados.move_to_end(chave)
+        self.hits += 1
+        return valor
+    
+    def set(self, chave: str, valor: Any):
+        self._dados[chave] = (valor, time.monotonic() + self.ttl)
+        self._dados.move_to_end(chave)
+        while len(self._dados) > self.maxsize:
+            self._dados.popitem(last=False)
+    
+    def invalidar(self, chave: str):
+        self._dados.pop(chave, None)
+    
+    def limpar(self):
+        self._dados.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "tamanho": len(self._dados),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0
+        }
+
+
+# Usuários autenticados, indexados pelo "sub" do token (email)
+user_cache = CacheTTL(
+    maxsize=int(os.environ.get("USER_CACHE_MAXSIZE", "1000")),
+    ttl=float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+)
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
@@ -560,10 +829,115 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
+    cached = user_cache.get(email)
+    if cached is not None:
+        return cached
+    
     user = await db.users.find_one({"email": email}, {"_id": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    
+    current_user = User(**user)
+    user_cache.set(email, current_user)
+    return current_user
+
+
+class PerfilAcesso(BaseModel):
+    """Vendedor vinculado ao usuário logado e seu nível de acesso"""
+    vendedor: Optional[Dict[str, Any]] = None
+    nivel_acesso: str = ""
+    
+    @property
+    def is_presidente(self) -> bool:
+        return self.nivel_acesso.lower() == "presidente"
+
+
+# Perfis por email; create/update/delete de vendedor limpam o cache do processo e o TTL cobre os demais workers
+perfil_cache = CacheTTL(
+    maxsize=int(os.environ.get("USER_CACHE_MAXSIZE", "1000")),
+    ttl=float(os.environ.get("PERFIL_CACHE_TTL_SECONDS", "60"))
+)
+
+
+async def obter_perfil(current_user: User = Depends(get_current_user)) -> PerfilAcesso:
+    """Dependência: resolve o vendedor/nível do usuário uma vez por janela de TTL"""
+    perfil = perfil_cache.get(current_user.email)
+    if perfil is not None:
+        return perfil
+    
+    vendedor = await db.vendedores.find_one({"email": current_user.email}, {"_id": 0})
+    perfil = PerfilAcesso(vendedor=vendedor, nivel_acesso=(vendedor or {}).get("nivel_acesso") or "")
+    perfil_cache.set(current_user.email, perfil)
+    return perfil
+
+
+async def verificar_nivel_presidente(perfil: PerfilAcesso = Depends(obter_perfil)) -> PerfilAcesso:
+    """Dependência: exige um vendedor com nível Presidente"""
+    if not perfil.vendedor:
+        raise HTTPException(
+            status_code=403, 
+            detail="Acesso negado. Você precisa ser um vendedor com nível Presidente para realizar esta ação."
+        )
+    
+    if not perfil.is_presidente:
+        raise HTTPException(
+            status_code=403, 
+            detail=f"Acesso negado. Apenas usuários com nível 'Presidente' podem realizar esta ação. Seu nível atual: {perfil.nivel_acesso or 'Não definido'}"
+        )
+    
+    return perfil
+
+
+class AlocadorSequencia:
+    """Aloca números sequenciais atômicos (coleção counters), reservando blocos por escopo.
+
+    Cada reserva é um único find_one_and_update com $inc; os números do bloco são
+    entregues em memória. Números reservados e não usados (ex.: reinício) viram lacunas.
+    """
+    
+    def __init__(self, bloco: int = 1):
+        self.bloco = max(1, bloco)
+        self._faixas: Dict[str, List[int]] = {}  # escopo -> [próximo, último reservado]
+        self._locks: Dict[str, asyncio.Lock] = {}
+    
+    async def _semear(self, escopo: str, semente):
+        # Na primeira vez que um escopo é usado, parte do maior número já existente
+        if await db.counters.find_one({"_id": escopo}) is None:
+            valor_inicial = await semente()
+            await db.counters.update_one({"_id": escopo}, {"$max": {"valor": valor_inicial}}, upsert=True)
+    
+    async def proximo(self, escopo: str, semente) -> int:
+        lock = self._locks.setdefault(escopo, asyncio.Lock())
+        async with lock:
+            faixa = self._faixas.get(escopo)
+            if faixa is None or faixa[0] > faixa[1]:
+                if faixa is None:
+                    await self._semear(escopo, semente)
+                counter = await db.counters.find_one_and_update(
+                    {"_id": escopo},
+                    {"$inc": {"valor": self.bloco}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                faixa = [counter["valor"] - self.bloco + 1, counter["valor"]]
+                self._faixas[escopo] = faixa
+            numero = faixa[0]
+            faixa[0] += 1
+            return numero
+
+
+sequencias = AlocadorSequencia(bloco=int(os.environ.get("SEQUENCE_BLOCK_SIZE", "10")))
+
+
+async def proximo_numero(colecao: str, campo: str, prefixo: str, largura: int) -> str:
+    """Próximo número no formato PREFIXO-000123 (ex.: PED, ORC-2026, CLI)"""
+    async def maior_existente() -> int:
+        padrao = f"^{prefixo}-\\d{{{largura}}}$"
+        doc = await db[colecao].find({campo: {"$regex": padrao}}, {"_id": 0, campo: 1}).sort(campo, -1).limit(1).to_list(1)
+        return int(doc[0][campo].rsplit("-", 1)[1]) if doc else 0
+    
+    n = await sequencias.proximo(prefixo, maior_existente)
+    return f"{prefixo}-{n:0{largura}d}"
 
 
 @api_router.post("/auth/register", response_model=Token)
@@ -574,24 +948,20 @@ async def register(user_data: UserCreate):
     
     import uuid
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await gerar_hash_senha(user_data.password)
     
     user_doc = {
         "id": user_id,
         "email": user_data.email,
         "name": user_data.name,
         "hashed_password": hashed_password,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.users.insert_one(user_doc)
+    user_cache.invalidar(user_data.email)
     
-    caixa_doc = {
-        "id": str(uuid.uuid4()),
-        "saldo": 0.0,
-        "updated_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.caixa.insert_one(caixa_doc)
+    await obter_caixa()
     
     access_token = create_access_token(data={"sub": user_data.email})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -599,9 +969,18 @@ async def register(user_data: UserCreate):
 
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_data: UserLogin):
-    user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user["hashed_password"]):
+    user = await db.users.find_one({"email": user_data.email}, {"_id": 0, "hashed_password": 1})
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    valida, novo_hash = await verificar_senha(user_data.password, user["hashed_password"])
+    if not valida:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
+    if novo_hash:
+        # Custo do bcrypt mudou: regrava, desde que a senha não tenha sido trocada no meio tempo
+        await db.users.update_one(
+            {"email": user_data.email, "hashed_password": user["hashed_password"]},
+            {"$set": {"hashed_password": novo_hash}}
+        )
     
     access_token = create_access_token(data={"sub": user_data.email})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -617,10 +996,68 @@ async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 
+# ==================== SERIALIZAÇÃO DE LISTAGENS ====================
+# Com response_model, o FastAPI revalidava a lista inteira, convertia cada documento em dicts
+# "jsonáveis" em Python e só então gerava o corpo com json.dumps. As listagens agora passam por um
+# TypeAdapter compilado por modelo: a lista é lida e escrita em JSON de uma vez pelo pydantic-core,
+# sem a etapa em Python. model_construct foi medido e sai mais lento (monta cada instância em Python).
+# O response_model continua declarado nas rotas e documenta o OpenAPI.
+
+_adaptadores_lista: Dict[type, TypeAdapter] = {}
+
+
+def resposta_lista(modelo: Type[BaseModel], docs: List[Dict[str, Any]], response: Optional[Response] = None) -> Response:
+    """Serializa a listagem direto em JSON, repassando os headers já definidos em response"""
+    adaptador = _adaptadores_lista.get(modelo)
+    if adaptador is None:
+        adaptador = _adaptadores_lista[modelo] = TypeAdapter(List[modelo])
+    corpo = adaptador.dump_json(adaptador.validate_python(docs))
+    cabecalhos = None
+    if response is not None:
+        cabecalhos = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return Response(content=corpo, media_type="application/json", headers=cabecalhos)
+
+
+# ==================== VERSÕES DE COLEÇÃO ====================
+# Os cadastros de referência mudam pouco e são baixados inteiros a cada tela de pedido/orçamento.
+# Toda escrita neles incrementa um contador por coleção (coleção "versoes", depois de gravar);
+# a listagem devolve esse contador como ETag e responde 304 a If-None-Match sem ler os documentos.
+
+COLECOES_VERSIONADAS = {"clientes", "produtos", "vendedores", "dados_pagamento", "fornecedores"}
+# Mudanças no formato das listagens devem incrementar a versão para invalidar os ETags já emitidos
+LISTA_ETAG_VERSAO = 1
+
+
+async def incrementar_versao(colecao: str):
+    # A época muda se a coleção versoes for recriada, para o contador reiniciado não repetir ETags
+    await db.versoes.update_one(
+        {"_id": colecao},
+        {"$inc": {"versao": 1}, "$setOnInsert": {"epoca": uuid.uuid4().hex[:8]}},
+        upsert=True
+    )
+
+
+async def lista_nao_modificada(request: Request, response: Response, colecao: str, *variantes: Any) -> Optional[Response]:
+    """Define ETag da listagem; devolve um 304 pronto quando o cliente já tem a versão atual"""
+    doc = await db.versoes.find_one({"_id": colecao}) or {}
+    bruto = json.dumps([LISTA_ETAG_VERSAO, doc.get("epoca"), doc.get("versao", 0), *variantes], separators=(",", ":"))
+    etag = f'W/"{colecao}-{doc.get("versao", 0)}-{hashlib.sha256(bruto.encode()).hexdigest()[:12]}"'
+    cabecalhos = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_casa(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabecalhos)
+    response.headers.update(cabecalhos)
+    return None
+
+
 @api_router.get("/clientes", response_model=List[Cliente])
-async def get_clientes(current_user: User = Depends(get_current_user)):
-    clientes = await db.clientes.find({}, {"_id": 0}).to_list(1000)
-    return clientes
+async def get_clientes(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    nao_modificada = await lista_nao_modificada(request, response, "clientes")
+    if nao_modificada:
+        return nao_modificada
+    # historico legado (antes de migrar_historico_clientes) fica de fora da listagem, assim como
+    # resumo_compras: ele muda a cada pedido e invalidaria o ETag da lista (ver GET /clientes/{id})
+    clientes = await db.clientes.find({}, {"_id": 0, "historico": 0, "resumo_compras": 0}).to_list(1000)
+    return resposta_lista(Cliente, clientes, response)
 
 
 @api_router.post("/clientes", response_model=Cliente)
@@ -629,61 +1066,88 @@ async def create_cliente(cliente_data: ClienteCreate, current_user: User = Depen
     cliente_id = str(uuid.uuid4())
     
     # Gerar código sequencial automático
-    count = await db.clientes.count_documents({})
-    codigo = f"CLI-{count + 1:06d}"
+    codigo = await proximo_numero("clientes", "codigo", "CLI", 6)
     
     cliente_doc = cliente_data.model_dump()
     cliente_doc["id"] = cliente_id
     cliente_doc["codigo"] = codigo
-    cliente_doc["created_at"] = datetime.now(timezone.utc).isoformat()
+    cliente_doc["resumo_compras"] = {"quantidade_pedidos": 0, "valor_total": 0, "ultimo_pedido": None}
+    cliente_doc["created_at"] = datetime.now(timezone.utc)
     
     await db.clientes.insert_one(cliente_doc)
+    await incrementar_versao("clientes")
+    indexar_busca("clientes", cliente_doc)
     return Cliente(**cliente_doc)
 
 
+async def congelar_cidade_pedidos(cliente_id: str):
+    """Grava a cidade atual do cliente nos pedidos antigos que ainda não têm cliente_cidade.
+    
+    Pedidos são contados na cidade gravada neles (rollups e relatórios); os antigos usam a
+    cidade atual do cliente, então ela é fixada antes de o cliente mudar de cidade ou sair.
+    """
+    cliente = await db.clientes.find_one({"id": cliente_id}, {"_id": 0, "cidade": 1})
+    if cliente is None:
+        return
+    await db.pedidos.update_many(
+        {"cliente_id": cliente_id, "cliente_cidade": {"$exists": False}},
+        {"$set": {"cliente_cidade": cliente.get("cidade")}}
+    )
+
+
 @api_router.put("/clientes/{cliente_id}", response_model=Cliente)
 async def update_cliente(cliente_id: str, cliente_data: ClienteCreate, current_user: User = Depends(get_current_user)):
+    await congelar_cidade_pedidos(cliente_id)
     result = await db.clientes.update_one(
         {"id": cliente_id},
         {"$set": cliente_data.model_dump()}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cliente not found")
+    await incrementar_versao("clientes")
     
-    cliente = await db.clientes.find_one({"id": cliente_id}, {"_id": 0})
+    cliente = await db.clientes.find_one({"id": cliente_id}, {"_id": 0, "historico": 0})
+    indexar_busca("clientes", cliente)
     return Cliente(**cliente)
 
 
 @api_router.delete("/clientes/{cliente_id}")
 async def delete_cliente(cliente_id: str, current_user: User = Depends(get_current_user)):
+    await congelar_cidade_pedidos(cliente_id)
     result = await db.clientes.delete_one({"id": cliente_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cliente not found")
+    await incrementar_versao("clientes")
+    remover_busca("clientes", cliente_id)
     return {"message": "Cliente deleted"}
 
 
 @api_router.post("/clientes/{cliente_id}/ocorrencias")
 async def add_ocorrencia(cliente_id: str, ocorrencia: Dict[str, Any], current_user: User = Depends(get_current_user)):
-    cliente = await db.clientes.find_one({"id": cliente_id}, {"_id": 0})
+    cliente = await db.clientes.find_one({"id": cliente_id}, {"_id": 1})
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente not found")
     
     ocorrencia["id"] = str(uuid.uuid4())
-    ocorrencia["data"] = datetime.now(timezone.utc).isoformat()
+    ocorrencia["data"] = datetime.now(timezone.utc)
     ocorrencia["usuario"] = current_user.email
     
     await db.clientes.update_one(
         {"id": cliente_id},
         {"$push": {"ocorrencias": ocorrencia}}
     )
+    await incrementar_versao("clientes")
     return {"message": "Ocorrência adicionada"}
 
 
 # Dados de Pagamento
 @api_router.get("/dados-pagamento", response_model=List[DadosPagamento])
-async def get_dados_pagamento(current_user: User = Depends(get_current_user)):
+async def get_dados_pagamento(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    nao_modificada = await lista_nao_modificada(request, response, "dados_pagamento")
+    if nao_modificada:
+        return nao_modificada
     dados = await db.dados_pagamento.find({}, {"_id": 0}).to_list(100)
-    return dados
+    return resposta_lista(DadosPagamento, dados, response)
 
 
 @api_router.post("/dados-pagamento", response_model=DadosPagamento)
@@ -692,9 +1156,10 @@ async def create_dados_pagamento(dados: DadosPagamentoCreate, current_user: User
     dados_doc = dados.model_dump()
     dados_doc["id"] = dados_id
     dados_doc["ativo"] = True
-    dados_doc["created_at"] = datetime.now(timezone.utc).isoformat()
+    dados_doc["created_at"] = datetime.now(timezone.utc)
     
     await db.dados_pagamento.insert_one(dados_doc)
+    await incrementar_versao("dados_pagamento")
     return DadosPagamento(**dados_doc)
 
 
@@ -706,6 +1171,7 @@ async def update_dados_pagamento(dados_id: str, dados: DadosPagamentoCreate, cur
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Dados de pagamento not found")
+    await incrementar_versao("dados_pagamento")
     
     dados_doc = await db.dados_pagamento.find_one({"id": dados_id}, {"_id": 0})
     return DadosPagamento(**dados_doc)
@@ -716,13 +1182,17 @@ async def delete_dados_pagamento(dados_id: str, current_user: User = Depends(get
     result = await db.dados_pagamento.delete_one({"id": dados_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Dados de pagamento not found")
+    await incrementar_versao("dados_pagamento")
     return {"message": "Dados de pagamento deleted"}
 
 
 @api_router.get("/produtos", response_model=List[Produto])
-async def get_produtos(current_user: User = Depends(get_current_user)):
+async def get_produtos(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    nao_modificada = await lista_nao_modificada(request, response, "produtos")
+    if nao_modificada:
+        return nao_modificada
     produtos = await db.produtos.find({}, {"_id": 0}).to_list(1000)
-    return produtos
+    return resposta_lista(Produto, produtos, response)
 
 
 @api_router.post("/produtos", response_model=Produto)
@@ -736,9 +1206,11 @@ async def create_produto(produto_data: ProdutoCreate, current_user: User = Depen
         produto_dict["preco_venda"] = produto_dict["preco_compra"] * (1 + margem / 100)
     
     produto_dict["id"] = produto_id
-    produto_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    produto_dict["created_at"] = datetime.now(timezone.utc)
     
     await db.produtos.insert_one(produto_dict)
+    await incrementar_versao("produtos")
+    indexar_busca("produtos", produto_dict)
     return Produto(**produto_dict)
 
 
@@ -755,8 +1227,10 @@ async def update_produto(produto_id: str, produto_data: ProdutoCreate, current_u
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Produto not found")
+    await incrementar_versao("produtos")
     
     produto = await db.produtos.find_one({"id": produto_id}, {"_id": 0})
+    indexar_busca("produtos", produto)
     return Produto(**produto)
 
 
@@ -765,6 +1239,8 @@ async def delete_produto(produto_id: str, current_user: User = Depends(get_curre
     result = await db.produtos.delete_one({"id": produto_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Produto not found")
+    await incrementar_versao("produtos")
+    remover_busca("produtos", produto_id)
     return {"message": "Produto deleted"}
 
 
@@ -773,33 +1249,138 @@ async def get_produto_by_codigo(codigo: str, current_user: User = Depends(get_cu
     produto = await db.produtos.find_one({"codigo": codigo}, {"_id": 0})
     if not produto:
         raise HTTPException(status_code=404, detail="Produto not found")
-    if isinstance(produto.get("created_at"), str):
-        produto["created_at"] = datetime.fromisoformat(produto["created_at"])
     return Produto(**produto)
 
 
-@api_router.get("/pedidos", response_model=List[Pedido])
-async def get_pedidos(current_user: User = Depends(get_current_user)):
-    pedidos = await db.pedidos.find({}, {"_id": 0}).sort("data", -1).to_list(1000)
+def _codificar_cursor(valores: Dict[str, Any]) -> str:
+    """Gera um cursor opaco (base64) a partir das chaves de ordenação"""
+    data = valores["data"]
+    raw = json.dumps({
+        "data": data.isoformat() if isinstance(data, datetime) else data,
+        "bson_date": isinstance(data, datetime),
+        "id": valores["id"]
+    }, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decodificar_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if not isinstance(valores, dict) or "data" not in valores or "id" not in valores:
+            raise ValueError("cursor incompleto")
+        if valores.pop("bson_date", False):
+            valores["data"] = datetime.fromisoformat(valores["data"])
+        return valores
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+# view=summary nas listagens: projeção explícita no Mongo + modelo enxuto; os detalhes continuam completos
+VIEW_LISTAGEM = "^(summary|full)$"
+
+
+def projecao_resumo(modelo: Type[BaseModel], contagens: Optional[Dict[str, str]] = None, **extras) -> Dict[str, Any]:
+    """Projeção com só os campos do modelo resumido; contagens de arrays calculadas pelo servidor via $size"""
+    contagens = contagens or {}
+    projecao: Dict[str, Any] = {"_id": 0}
+    for campo in modelo.model_fields:
+        if campo in contagens:
+            projecao[campo] = {"$size": {"$ifNull": [f"${contagens[campo]}", []]}}
+        else:
+            projecao[campo] = 1
+    projecao.update(extras)
+    return projecao
+
+
+async def completar_legados(colecao: str, docs: List[Dict[str, Any]], contagens: Optional[Dict[str, str]] = None) -> None:
+    """Documentos que o migrador ainda não alcançou precisam do documento inteiro para normalizar; relê só esses"""
+    alvo = SCHEMA_VERSION[colecao]
+    legados = [doc["id"] for doc in docs if doc.get("schema_version", 0) < alvo]
+    if not legados:
+        return
+    completos = {doc["id"]: doc async for doc in db[colecao].find({"id": {"$in": legados}}, {"_id": 0})}
+    for i, doc in enumerate(docs):
+        completo = completos.get(doc["id"])
+        if completo is None:
+            continue
+        normalizar_leitura(colecao, completo)
+        for campo, origem in (contagens or {}).items():
+            completo[campo] = len(completo.get(origem) or [])
+        docs[i] = completo
+
+
+def filtro_periodo(data_inicio: Optional[date], data_fim: Optional[date]) -> Dict[str, datetime]:
+    """Intervalo [início do primeiro dia, início do dia seguinte ao último) em UTC"""
+    intervalo = {}
+    if data_inicio:
+        intervalo["$gte"] = datetime.combine(data_inicio, dt_time.min, tzinfo=timezone.utc)
+    if data_fim:
+        intervalo["$lt"] = datetime.combine(data_fim + timedelta(days=1), dt_time.min, tzinfo=timezone.utc)
+    return intervalo
+
+
+PEDIDO_CONTAGENS = {"quantidade_itens": "itens"}
+# Sem cursor nem limit a listagem devolve o mesmo teto de antes da paginação
+PEDIDOS_LIMITE_PADRAO = 1000
+PEDIDOS_PAGINA = 50
+
+
+@api_router.get("/pedidos", response_model=Union[List[Pedido], List[PedidoResumo]])
+async def get_pedidos(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PEDIDOS_LIMITE_PADRAO),
+    view: str = Query("full", pattern=VIEW_LISTAGEM),
+    status: Optional[str] = None,
+    vendedor: Optional[str] = None,
+    cliente_id: Optional[str] = None,
+    tipo_venda: Optional[str] = None,
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Lista pedidos com paginação por cursor (keyset em data/id, mais recentes primeiro).
+
+    O cursor da próxima página é devolvido no header X-Next-Cursor (ausente na última página).
+    Sem limit, a primeira página traz até 1000 pedidos (como antes da paginação) e as seguintes 50.
+    Com view=summary cada linha vem como PedidoResumo (sem itens); o detalhe fica em /pedidos/{id}.
+    """
+    if limit is None:
+        limit = PEDIDOS_PAGINA if cursor else PEDIDOS_LIMITE_PADRAO
+    filtros = []
+    if status and status != "todos":
+        filtros.append({"status": status})
+    if vendedor:
+        filtros.append({"vendedor": vendedor})
+    if cliente_id:
+        filtros.append({"cliente_id": cliente_id})
+    if tipo_venda and tipo_venda != "todos":
+        filtros.append({"tipo_venda": tipo_venda})
+    if data_inicio or data_fim:
+        filtros.append({"data": filtro_periodo(data_inicio, data_fim)})
+    if cursor:
+        ultimo = _decodificar_cursor(cursor)
+        filtros.append({"$or": [
+            {"data": {"$lt": ultimo["data"]}},
+            {"data": ultimo["data"], "id": {"$lt": ultimo["id"]}}
+        ]})
+    
+    query = {"$and": filtros} if filtros else {}
+    resumo = view == "summary"
+    projecao = projecao_resumo(PedidoResumo, PEDIDO_CONTAGENS, schema_version=1) if resumo else {"_id": 0}
+    pedidos = await db.pedidos.find(query, projecao).sort([("data", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    
+    if len(pedidos) > limit:
+        pedidos = pedidos[:limit]
+        response.headers["X-Next-Cursor"] = _codificar_cursor({"data": pedidos[-1]["data"], "id": pedidos[-1]["id"]})
+    
+    if resumo:
+        await completar_legados("pedidos", pedidos, PEDIDO_CONTAGENS)
+        return resposta_lista(PedidoResumo, pedidos, response)
     for pedido in pedidos:
-        if isinstance(pedido.get("data"), str):
-            pedido["data"] = datetime.fromisoformat(pedido["data"])
-        if isinstance(pedido.get("created_at"), str):
-            pedido["created_at"] = datetime.fromisoformat(pedido["created_at"])
-        # Normalizar campos que podem estar faltando em pedidos antigos
-        if "despesas_totais" not in pedido:
-            pedido["despesas_totais"] = pedido.get("frete", 0) + pedido.get("outras_despesas", 0)
-        if "vendedor" not in pedido or pedido["vendedor"] is None:
-            pedido["vendedor"] = ""
-        if "repassar_frete" not in pedido:
-            pedido["repassar_frete"] = False
-        # Normalizar itens
-        for item in pedido.get("itens", []):
-            if "lucro_item" not in item:
-                item["lucro_item"] = 0.0
-            if "despesas" not in item:
-                item["despesas"] = 0.0
-    return pedidos
+        normalizar_leitura("pedidos", pedido)
+    return resposta_lista(Pedido, pedidos, response)
 
 
 @api_router.get("/pedidos/{pedido_id}", response_model=Pedido)
@@ -808,22 +1389,7 @@ async def get_pedido(pedido_id: str, current_user: User = Depends(get_current_us
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido not found")
     
-    if isinstance(pedido.get("data"), str):
-        pedido["data"] = datetime.fromisoformat(pedido["data"])
-    if isinstance(pedido.get("created_at"), str):
-        pedido["created_at"] = datetime.fromisoformat(pedido["created_at"])
-    # Normalizar campos
-    if "despesas_totais" not in pedido:
-        pedido["despesas_totais"] = pedido.get("frete", 0) + pedido.get("outras_despesas", 0)
-    if "vendedor" not in pedido or pedido["vendedor"] is None:
-        pedido["vendedor"] = ""
-    if "repassar_frete" not in pedido:
-        pedido["repassar_frete"] = False
-    for item in pedido.get("itens", []):
-        if "lucro_item" not in item:
-            item["lucro_item"] = 0.0
-        if "despesas" not in item:
-            item["despesas"] = 0.0
+    normalizar_leitura("pedidos", pedido)
     
     return Pedido(**pedido)
 
@@ -833,10 +1399,9 @@ async def create_pedido(pedido_data: PedidoCreate, current_user: User = Depends(
     import uuid
     pedido_id = str(uuid.uuid4())
     
-    count = await db.pedidos.count_documents({})
-    numero = f"PED-{count + 1:06d}"
+    numero = await proximo_numero("pedidos", "numero", "PED", 6)
     
-    cliente = await db.clientes.find_one({"id": pedido_data.cliente_id}, {"_id": 0})
+    cliente = await db.clientes.find_one({"id": pedido_data.cliente_id}, {"_id": 0, "nome": 1, "cidade": 1})
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente not found")
     
@@ -880,7 +1445,7 @@ async def create_pedido(pedido_data: PedidoCreate, current_user: User = Depends(
     pedido_doc = {
         "id": pedido_id,
         "numero": numero,
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "cliente_id": pedido_data.cliente_id,
         "cliente_nome": cliente["nome"],
         "itens": itens,
@@ -898,36 +1463,21 @@ async def create_pedido(pedido_data: PedidoCreate, current_user: User = Depends(
         "despesas_totais": despesas_totais,
         "lucro_total": lucro_total,
         "status": "pendente",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "cliente_cidade": cliente.get("cidade"),
+        "created_at": datetime.now(timezone.utc)
     }
     
+    aplicar_schema("pedidos", pedido_doc)
     await db.pedidos.insert_one(pedido_doc)
+    await aplicar_rollup_pedido(pedido_doc)
+    await aplicar_resumo_cliente(pedido_doc)
     
-    # Atualizar histórico do cliente
-    historico_entry = {
-        "pedido_id": pedido_id,
-        "numero": numero,
-        "data": datetime.now(timezone.utc).isoformat(),
-        "valor": valor_total_venda,
-        "vendedor": pedido_data.vendedor
-    }
-    await db.clientes.update_one(
-        {"id": pedido_data.cliente_id},
-        {"$push": {"historico": historico_entry}}
-    )
-    
-    pedido_doc["data"] = datetime.fromisoformat(pedido_doc["data"])
-    pedido_doc["created_at"] = datetime.fromisoformat(pedido_doc["created_at"])
     return Pedido(**pedido_doc)
 
 
 @api_router.put("/pedidos/{pedido_id}", response_model=Pedido)
 async def update_pedido(pedido_id: str, pedido_data: PedidoCreate, current_user: User = Depends(get_current_user)):
-    pedido = await db.pedidos.find_one({"id": pedido_id}, {"_id": 0})
-    if not pedido:
-        raise HTTPException(status_code=404, detail="Pedido not found")
-    
-    cliente = await db.clientes.find_one({"id": pedido_data.cliente_id}, {"_id": 0})
+    cliente = await db.clientes.find_one({"id": pedido_data.cliente_id}, {"_id": 0, "nome": 1, "cidade": 1})
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente not found")
     
@@ -983,74 +1533,73 @@ async def update_pedido(pedido_id: str, pedido_data: PedidoCreate, current_user:
         "custo_total": custo_total,
         "valor_total_venda": valor_total_venda,
         "despesas_totais": despesas_totais,
-        "lucro_total": lucro_total
+        "lucro_total": lucro_total,
+        "cliente_cidade": cliente.get("cidade")
     }
     
-    await db.pedidos.update_one({"id": pedido_id}, {"$set": update_doc})
+    # O documento anterior vem da própria escrita: o -antigo/+novo dos rollups não usa uma leitura velha
+    pedido = await db.pedidos.find_one_and_update(
+        {"id": pedido_id}, {"$set": update_doc}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if not pedido:
+        raise HTTPException(status_code=404, detail="Pedido not found")
     
-    updated_pedido = await db.pedidos.find_one({"id": pedido_id}, {"_id": 0})
-    if isinstance(updated_pedido.get("data"), str):
-        updated_pedido["data"] = datetime.fromisoformat(updated_pedido["data"])
-    if isinstance(updated_pedido.get("created_at"), str):
-        updated_pedido["created_at"] = datetime.fromisoformat(updated_pedido["created_at"])
+    updated_pedido = {**pedido, **update_doc}
+    await aplicar_rollup_pedido(pedido, -1)
+    await aplicar_rollup_pedido(updated_pedido)
+    await aplicar_resumo_cliente(pedido, -1)
+    await aplicar_resumo_cliente(updated_pedido)
     
     return Pedido(**updated_pedido)
 
 
 @api_router.put("/pedidos/{pedido_id}/status")
 async def update_pedido_status(pedido_id: str, status: str, current_user: User = Depends(get_current_user)):
-    pedido = await db.pedidos.find_one({"id": pedido_id}, {"_id": 0})
+    pedido = await db.pedidos.find_one_and_update(
+        {"id": pedido_id}, {"$set": {"status": status}}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido not found")
     
-    await db.pedidos.update_one({"id": pedido_id}, {"$set": {"status": status}})
+    await aplicar_rollup_pedido(pedido, -1)
+    await aplicar_rollup_pedido({**pedido, "status": status})
     
     if status == "pago" and pedido.get("status") != "pago":
-        caixa = await db.caixa.find_one({}, {"_id": 0})
-        if caixa:
-            novo_saldo = caixa["saldo"] + pedido["valor_total_venda"]
-            await db.caixa.update_one(
-                {"id": caixa["id"]},
-                {"$set": {"saldo": novo_saldo, "updated_at": datetime.now(timezone.utc).isoformat()}}
-            )
+        await registrar_movimento_caixa(
+            "credito", pedido["valor_total_venda"], f"Pedido {pedido.get('numero', '')} pago", pedido_id, "pedido"
+        )
     
     return {"message": "Status updated"}
 
 
 @api_router.delete("/pedidos/{pedido_id}")
 async def delete_pedido(pedido_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.pedidos.delete_one({"id": pedido_id})
-    if result.deleted_count == 0:
+    pedido = await db.pedidos.find_one_and_delete({"id": pedido_id}, {"_id": 0})
+    if not pedido:
         raise HTTPException(status_code=404, detail="Pedido not found")
+    await aplicar_rollup_pedido(pedido, -1)
+    await aplicar_resumo_cliente(pedido, -1)
     return {"message": "Pedido deleted"}
 
 
-@api_router.get("/orcamentos", response_model=List[Orcamento])
-async def get_orcamentos(current_user: User = Depends(get_current_user)):
+ORCAMENTO_CONTAGENS = {"quantidade_itens": "itens"}
+
+
+@api_router.get("/orcamentos", response_model=Union[List[Orcamento], List[OrcamentoResumo]])
+async def get_orcamentos(
+    view: str = Query("full", pattern=VIEW_LISTAGEM),
+    current_user: User = Depends(get_current_user)
+):
+    if view == "summary":
+        projecao = projecao_resumo(OrcamentoResumo, ORCAMENTO_CONTAGENS, schema_version=1)
+        orcamentos = await db.orcamentos.find({}, projecao).sort("data", -1).to_list(1000)
+        await completar_legados("orcamentos", orcamentos, ORCAMENTO_CONTAGENS)
+        return resposta_lista(OrcamentoResumo, orcamentos)
+    
     orcamentos = await db.orcamentos.find({}, {"_id": 0}).sort("data", -1).to_list(1000)
     for orc in orcamentos:
-        if isinstance(orc.get("data"), str):
-            orc["data"] = datetime.fromisoformat(orc["data"])
-        if orc.get("data_cobrar_resposta") and isinstance(orc["data_cobrar_resposta"], str):
-            orc["data_cobrar_resposta"] = datetime.fromisoformat(orc["data_cobrar_resposta"])
-        if isinstance(orc.get("created_at"), str):
-            orc["created_at"] = datetime.fromisoformat(orc["created_at"])
-        # Handle legacy data
-        if "valor_final" not in orc:
-            orc["valor_final"] = orc.get("valor_total", 0) - orc.get("desconto", 0)
-        if "desconto" not in orc:
-            orc["desconto"] = 0.0
-        if "valor_frete" not in orc:
-            orc["valor_frete"] = 0.0
-        if "repassar_frete" not in orc:
-            orc["repassar_frete"] = True
-        if "outras_despesas" not in orc:
-            orc["outras_despesas"] = 0.0
-        if "repassar_outras_despesas" not in orc:
-            orc["repassar_outras_despesas"] = False
-        if "cliente_cobrado" not in orc:
-            orc["cliente_cobrado"] = False
-    return orcamentos
+        normalizar_leitura("orcamentos", orc)
+    return resposta_lista(Orcamento, orcamentos)
 
 
 @api_router.get("/orcamentos/{orcamento_id}", response_model=Orcamento)
@@ -1059,28 +1608,7 @@ async def get_orcamento(orcamento_id: str, current_user: User = Depends(get_curr
     if not orcamento:
         raise HTTPException(status_code=404, detail="Orçamento not found")
     
-    if isinstance(orcamento.get("data"), str):
-        orcamento["data"] = datetime.fromisoformat(orcamento["data"])
-    if orcamento.get("data_cobrar_resposta") and isinstance(orcamento["data_cobrar_resposta"], str):
-        orcamento["data_cobrar_resposta"] = datetime.fromisoformat(orcamento["data_cobrar_resposta"])
-    if isinstance(orcamento.get("created_at"), str):
-        orcamento["created_at"] = datetime.fromisoformat(orcamento["created_at"])
-    
-    # Handle legacy data
-    if "valor_final" not in orcamento:
-        orcamento["valor_final"] = orcamento.get("valor_total", 0) - orcamento.get("desconto", 0)
-    if "desconto" not in orcamento:
-        orcamento["desconto"] = 0.0
-    if "valor_frete" not in orcamento:
-        orcamento["valor_frete"] = 0.0
-    if "repassar_frete" not in orcamento:
-        orcamento["repassar_frete"] = True
-    if "outras_despesas" not in orcamento:
-        orcamento["outras_despesas"] = 0.0
-    if "repassar_outras_despesas" not in orcamento:
-        orcamento["repassar_outras_despesas"] = False
-    if "cliente_cobrado" not in orcamento:
-        orcamento["cliente_cobrado"] = False
+    normalizar_leitura("orcamentos", orcamento)
     
     return Orcamento(**orcamento)
 
@@ -1092,10 +1620,9 @@ async def create_orcamento(orc_data: OrcamentoCreate, current_user: User = Depen
     
     # Get next number based on year
     ano_atual = datetime.now().year
-    count = await db.orcamentos.count_documents({"numero": {"$regex": f"^ORC-{ano_atual}"}})
-    numero = f"ORC-{ano_atual}-{count + 1:04d}"
+    numero = await proximo_numero("orcamentos", "numero", f"ORC-{ano_atual}", 4)
     
-    cliente = await db.clientes.find_one({"id": orc_data.cliente_id}, {"_id": 0})
+    cliente = await db.clientes.find_one({"id": orc_data.cliente_id}, {"_id": 0, "historico": 0})
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente not found")
     
@@ -1115,12 +1642,12 @@ async def create_orcamento(orc_data: OrcamentoCreate, current_user: User = Depen
     # Calculate data_cobrar_resposta if dias_cobrar_resposta is set
     data_cobrar = None
     if orc_data.dias_cobrar_resposta:
-        data_cobrar = (datetime.now(timezone.utc) + timedelta(days=orc_data.dias_cobrar_resposta)).isoformat()
+        data_cobrar = datetime.now(timezone.utc) + timedelta(days=orc_data.dias_cobrar_resposta)
     
     orc_doc = {
         "id": orc_id,
         "numero": numero,
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "cliente_id": orc_data.cliente_id,
         "cliente_nome": cliente.get("nome") or cliente.get("razao_social", ""),
         "cliente_cnpj": cliente.get("cnpj", ""),
@@ -1146,14 +1673,12 @@ async def create_orcamento(orc_data: OrcamentoCreate, current_user: User = Depen
         "dias_cobrar_resposta": orc_data.dias_cobrar_resposta,
         "data_cobrar_resposta": data_cobrar,
         "cliente_cobrado": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
+    orc_doc["updated_at"] = orc_doc["created_at"]
     
+    aplicar_schema("orcamentos", orc_doc)
     await db.orcamentos.insert_one(orc_doc)
-    orc_doc["data"] = datetime.fromisoformat(orc_doc["data"])
-    if orc_doc.get("data_cobrar_resposta"):
-        orc_doc["data_cobrar_resposta"] = datetime.fromisoformat(orc_doc["data_cobrar_resposta"])
-    orc_doc["created_at"] = datetime.fromisoformat(orc_doc["created_at"])
     return Orcamento(**orc_doc)
 
 
@@ -1163,7 +1688,7 @@ async def update_orcamento(orcamento_id: str, orc_data: OrcamentoCreate, current
     if not existing:
         raise HTTPException(status_code=404, detail="Orçamento not found")
     
-    cliente = await db.clientes.find_one({"id": orc_data.cliente_id}, {"_id": 0})
+    cliente = await db.clientes.find_one({"id": orc_data.cliente_id}, {"_id": 0, "historico": 0})
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente not found")
     
@@ -1183,7 +1708,7 @@ async def update_orcamento(orcamento_id: str, orc_data: OrcamentoCreate, current
     # Calculate data_cobrar_resposta if dias_cobrar_resposta is set
     data_cobrar = existing.get("data_cobrar_resposta")
     if orc_data.dias_cobrar_resposta and orc_data.dias_cobrar_resposta != existing.get("dias_cobrar_resposta"):
-        data_cobrar = (datetime.now(timezone.utc) + timedelta(days=orc_data.dias_cobrar_resposta)).isoformat()
+        data_cobrar = datetime.now(timezone.utc) + timedelta(days=orc_data.dias_cobrar_resposta)
     
     update_doc = {
         "cliente_id": orc_data.cliente_id,
@@ -1208,18 +1733,13 @@ async def update_orcamento(orcamento_id: str, orc_data: OrcamentoCreate, current
         "frete_por_conta": orc_data.frete_por_conta,
         "observacoes": orc_data.observacoes,
         "dias_cobrar_resposta": orc_data.dias_cobrar_resposta,
-        "data_cobrar_resposta": data_cobrar
+        "data_cobrar_resposta": data_cobrar,
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.orcamentos.update_one({"id": orcamento_id}, {"$set": update_doc})
     
     orc = await db.orcamentos.find_one({"id": orcamento_id}, {"_id": 0})
-    if isinstance(orc.get("data"), str):
-        orc["data"] = datetime.fromisoformat(orc["data"])
-    if orc.get("data_cobrar_resposta") and isinstance(orc["data_cobrar_resposta"], str):
-        orc["data_cobrar_resposta"] = datetime.fromisoformat(orc["data_cobrar_resposta"])
-    if isinstance(orc.get("created_at"), str):
-        orc["created_at"] = datetime.fromisoformat(orc["created_at"])
     
     return Orcamento(**orc)
 
@@ -1230,7 +1750,7 @@ async def marcar_cliente_cobrado(orcamento_id: str, cobrado: bool = True, curren
     if not orc:
         raise HTTPException(status_code=404, detail="Orçamento not found")
     
-    await db.orcamentos.update_one({"id": orcamento_id}, {"$set": {"cliente_cobrado": cobrado}})
+    await db.orcamentos.update_one({"id": orcamento_id}, {"$set": {"cliente_cobrado": cobrado, "updated_at": datetime.now(timezone.utc)}})
     return {"message": f"Cliente {'cobrado' if cobrado else 'não cobrado'}", "cliente_cobrado": cobrado}
 
 
@@ -1248,8 +1768,7 @@ async def convert_orcamento_to_pedido(orcamento_id: str, vendedor: Optional[str]
     
     # Get next pedido number
     ano_atual = datetime.now().year
-    count = await db.pedidos.count_documents({"numero": {"$regex": f"^PED-{ano_atual}"}})
-    numero_pedido = f"PED-{ano_atual}-{count + 1:04d}"
+    numero_pedido = await proximo_numero("pedidos", "numero", f"PED-{ano_atual}", 4)
     
     # Convert items to pedido format
     itens_pedido = []
@@ -1270,7 +1789,7 @@ async def convert_orcamento_to_pedido(orcamento_id: str, vendedor: Optional[str]
     pedido_doc = {
         "id": pedido_id,
         "numero": numero_pedido,
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "cliente_id": orc["cliente_id"],
         "cliente_nome": orc.get("cliente_nome", ""),
         "vendedor": vendedor or orc.get("vendedor", ""),
@@ -1286,12 +1805,17 @@ async def convert_orcamento_to_pedido(orcamento_id: str, vendedor: Optional[str]
         "valor_total_venda": orc.get("valor_final", orc.get("valor_total", 0)),
         "lucro_total": 0,
         "status": "pedido_feito",
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "orcamento_origem": orcamento_id
     }
+    cliente = await db.clientes.find_one({"id": orc["cliente_id"]}, {"_id": 0, "cidade": 1})
+    pedido_doc["cliente_cidade"] = (cliente or {}).get("cidade")
     
+    aplicar_schema("pedidos", pedido_doc)
     await db.pedidos.insert_one(pedido_doc)
-    await db.orcamentos.update_one({"id": orcamento_id}, {"$set": {"status": "convertido"}})
+    await aplicar_rollup_pedido(pedido_doc)
+    await aplicar_resumo_cliente(pedido_doc)
+    await db.orcamentos.update_one({"id": orcamento_id}, {"$set": {"status": "convertido", "updated_at": datetime.now(timezone.utc)}})
     
     return {"message": "Orçamento convertido em pedido com sucesso", "pedido_id": pedido_id, "pedido_numero": numero_pedido}
 
@@ -1304,147 +1828,175 @@ async def delete_orcamento(orcamento_id: str, current_user: User = Depends(get_c
     return {"message": "Orçamento deleted"}
 
 
-@api_router.get("/licitacoes", response_model=List[Licitacao])
-async def get_licitacoes(current_user: User = Depends(get_current_user)):
-    licitacoes = await db.licitacoes.find({}, {"_id": 0}).sort("data_empenho", -1).to_list(1000)
-    for lic in licitacoes:
-        if isinstance(lic.get("data_empenho"), str):
-            lic["data_empenho"] = datetime.fromisoformat(lic["data_empenho"])
-        if lic.get("previsao_fornecimento") and isinstance(lic["previsao_fornecimento"], str):
-            lic["previsao_fornecimento"] = datetime.fromisoformat(lic["previsao_fornecimento"])
-        if lic.get("fornecimento_efetivo") and isinstance(lic["fornecimento_efetivo"], str):
-            lic["fornecimento_efetivo"] = datetime.fromisoformat(lic["fornecimento_efetivo"])
-        if lic.get("previsao_pagamento") and isinstance(lic["previsao_pagamento"], str):
-            lic["previsao_pagamento"] = datetime.fromisoformat(lic["previsao_pagamento"])
-        if isinstance(lic.get("created_at"), str):
-            lic["created_at"] = datetime.fromisoformat(lic["created_at"])
-        
-        # Handle legacy data without new fields
-        if "status_pagamento" not in lic:
-            lic["status_pagamento"] = lic.get("status", "pendente")
-        
-        # Calcular quantidades totais
-        qtd_contratada = 0
-        qtd_fornecida = 0
-        for p in lic.get("produtos", []):
-            qtd_contratada += p.get("quantidade_contratada", p.get("quantidade_empenhada", 0))
-            qtd_fornecida += p.get("quantidade_fornecida", 0)
-        
-        lic["quantidade_total_contratada"] = qtd_contratada
-        lic["quantidade_total_fornecida"] = qtd_fornecida
-        lic["quantidade_total_restante"] = qtd_contratada - qtd_fornecida
-        lic["percentual_executado"] = (qtd_fornecida / qtd_contratada * 100) if qtd_contratada > 0 else 0
-        
-        # Verificar alertas
-        alertas = []
-        if lic.get("contrato"):
-            contrato = lic["contrato"]
-            if isinstance(contrato.get("data_fim"), str):
-                data_fim = datetime.fromisoformat(contrato["data_fim"])
-            else:
-                data_fim = contrato.get("data_fim")
-            
-            if data_fim:
-                # Ensure both datetimes have the same timezone awareness
-                if data_fim.tzinfo is None:
-                    data_fim = data_fim.replace(tzinfo=timezone.utc)
-                
-                dias_restantes = (data_fim - datetime.now(timezone.utc)).days
-                if dias_restantes < 0:
-                    alertas.append("⚠️ Contrato VENCIDO")
-                elif dias_restantes <= 30:
-                    alertas.append(f"⚠️ Contrato vence em {dias_restantes} dias")
-        
-        if qtd_contratada > 0 and qtd_fornecida >= qtd_contratada:
-            alertas.append("✅ Contrato totalmente executado")
-        elif qtd_contratada > 0 and (qtd_fornecida / qtd_contratada) >= 0.9:
-            alertas.append(f"⚠️ {((qtd_fornecida / qtd_contratada) * 100):.1f}% do contrato executado")
-        
-        lic["alertas"] = alertas
-        
-        # Handle legacy fields
-        if "valor_total_venda" not in lic:
-            lic["valor_total_venda"] = sum(p.get("preco_venda", 0) * p.get("quantidade_contratada", p.get("quantidade_empenhada", 0)) for p in lic.get("produtos", []))
-        if "valor_total_compra" not in lic:
-            lic["valor_total_compra"] = sum(p.get("preco_compra", 0) * p.get("quantidade_contratada", p.get("quantidade_empenhada", 0)) for p in lic.get("produtos", []))
-        
-        # Calcular despesas totais (despesas fixas + despesas dos fornecimentos)
-        despesas_fixas = lic.get("frete", 0) + lic.get("impostos", 0) + lic.get("outras_despesas", 0)
-        despesas_fornecimentos = sum(f.get("total_despesas", 0) for f in lic.get("fornecimentos", []))
-        lic["despesas_totais"] = despesas_fixas + despesas_fornecimentos
-        
-        # Calcular lucro total (considerando apenas o fornecido)
-        total_venda_fornecido = 0
-        total_compra_fornecido = 0
-        for p in lic.get("produtos", []):
-            qtd_forn = p.get("quantidade_fornecida", 0)
-            total_venda_fornecido += qtd_forn * p.get("preco_venda", 0)
-            total_compra_fornecido += qtd_forn * p.get("preco_compra", 0)
-        
-        lic["lucro_total"] = total_venda_fornecido - total_compra_fornecido - despesas_fornecimentos
-        
-        if "frete" not in lic:
-            lic["frete"] = 0.0
-        if "impostos" not in lic:
-            lic["impostos"] = 0.0
-        if "outras_despesas" not in lic:
-            lic["outras_despesas"] = 0.0
-        if "fornecimentos" not in lic:
-            lic["fornecimentos"] = []
-    return licitacoes
+def _alertas_licitacao(data_fim: Any, qtd_contratada: float, qtd_fornecida: float) -> List[str]:
+    """Alertas de vencimento e execução do contrato (dependem da data de hoje)"""
+    alertas = []
+    data_fim = _como_datetime(data_fim)
+    if data_fim:
+        dias_restantes = (data_fim - datetime.now(timezone.utc)).days
+        if dias_restantes < 0:
+            alertas.append("⚠️ Contrato VENCIDO")
+        elif dias_restantes <= 30:
+            alertas.append(f"⚠️ Contrato vence em {dias_restantes} dias")
+    
+    if qtd_contratada > 0 and qtd_fornecida >= qtd_contratada:
+        alertas.append("✅ Contrato totalmente executado")
+    elif qtd_contratada > 0 and (qtd_fornecida / qtd_contratada) >= 0.9:
+        alertas.append(f"⚠️ {((qtd_fornecida / qtd_contratada) * 100):.1f}% do contrato executado")
+    return alertas
 
 
-@api_router.post("/licitacoes", response_model=Licitacao)
-async def create_licitacao(lic_data: LicitacaoCreate, current_user: User = Depends(get_current_user)):
-    lic_id = str(uuid.uuid4())
+def calcular_metricas_licitacao(lic: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos derivados gravados junto da licitação a cada escrita.
     
-    # Criar objeto do contrato
-    contrato = {
-        "numero_contrato": lic_data.numero_contrato,
-        "data_inicio": lic_data.data_inicio_contrato.isoformat(),
-        "data_fim": lic_data.data_fim_contrato.isoformat(),
-        "status": "vigente"
-    }
+    despesas_totais/lucro_total são do contrato inteiro (usados por relatórios e rollups);
+    despesas_realizadas/lucro_realizado consideram só o que já foi fornecido e são o que a
+    listagem mostra.
+    """
+    produtos = lic.get("produtos", [])
     
-    # Processar produtos com IDs únicos e calcular valores
-    produtos_processados = []
-    quantidade_total_contratada = 0
-    for p in lic_data.produtos:
-        prod_id = str(uuid.uuid4())
-        qtd_contratada = p.get("quantidade_contratada", p.get("quantidade_empenhada", 0))
-        qtd_fornecida = p.get("quantidade_fornecida", 0)
-        qtd_restante = qtd_contratada - qtd_fornecida
-        preco_venda = p.get("preco_venda", 0)
-        preco_compra = p.get("preco_compra", 0)
-        despesas_extras = p.get("despesas_extras", 0)
-        lucro_unitario = preco_venda - preco_compra - despesas_extras
-        valor_total = preco_venda * qtd_contratada
-        
-        quantidade_total_contratada += qtd_contratada
-        
-        produtos_processados.append({
-            "id": prod_id,
-            "produto_id": p.get("produto_id"),
-            "descricao": p.get("descricao", ""),
-            "quantidade_contratada": qtd_contratada,
-            "quantidade_fornecida": qtd_fornecida,
-            "quantidade_restante": qtd_restante,
-            "preco_compra": preco_compra,
-            "preco_venda": preco_venda,
-            "valor_total": valor_total,
-            "despesas_extras": despesas_extras,
-            "lucro_unitario": lucro_unitario
-        })
+    # Calcular quantidades totais
+    qtd_contratada = 0
+    qtd_fornecida = 0
+    for p in produtos:
+        qtd_contratada += p.get("quantidade_contratada", p.get("quantidade_empenhada", 0))
+        qtd_fornecida += p.get("quantidade_fornecida", 0)
     
-    # Calcular totais
-    valor_total_venda = sum(p["valor_total"] for p in produtos_processados)
-    valor_total_compra = sum(p["preco_compra"] * p["quantidade_contratada"] for p in produtos_processados)
-    despesas_produtos = sum(p["despesas_extras"] * p["quantidade_contratada"] for p in produtos_processados)
-    despesas_totais = despesas_produtos + lic_data.frete + lic_data.impostos + lic_data.outras_despesas
-    lucro_total = valor_total_venda - valor_total_compra - despesas_totais
+    # Despesas e lucro do contrato
+    despesas_fixas = lic.get("frete", 0) + lic.get("impostos", 0) + lic.get("outras_despesas", 0)
+    despesas_produtos = sum(p.get("despesas_extras", 0) * p.get("quantidade_contratada", p.get("quantidade_empenhada", 0)) for p in produtos)
+    despesas_totais = despesas_produtos + despesas_fixas
+    valor_total_venda = lic.get("valor_total_venda", 0)
+    valor_total_compra = lic.get("valor_total_compra", 0)
     
-    # Atualizar valor do contrato
-    contrato["valor_total_contrato"] = valor_total_venda
+    # Despesas e lucro realizados (despesas fixas + despesas dos fornecimentos)
+    despesas_fornecimentos = lic.get("despesas_fornecimentos", 0) + sum(f.get("total_despesas", 0) for f in lic.get("fornecimentos", []))
+    total_venda_fornecido = 0
+    total_compra_fornecido = 0
+    for p in produtos:
+        qtd_forn = p.get("quantidade_fornecida", 0)
+        total_venda_fornecido += qtd_forn * p.get("preco_venda", 0)
+        total_compra_fornecido += qtd_forn * p.get("preco_compra", 0)
+    
+    return {
+        "quantidade_total_contratada": qtd_contratada,
+        "quantidade_total_fornecida": qtd_fornecida,
+        "quantidade_total_restante": qtd_contratada - qtd_fornecida,
+        "percentual_executado": (qtd_fornecida / qtd_contratada * 100) if qtd_contratada > 0 else 0,
+        "alertas": _alertas_licitacao((lic.get("contrato") or {}).get("data_fim"), qtd_contratada, qtd_fornecida),
+        "despesas_totais": despesas_totais,
+        "lucro_total": valor_total_venda - valor_total_compra - despesas_totais,
+        "despesas_realizadas": despesas_fixas + despesas_fornecimentos,
+        "lucro_realizado": total_venda_fornecido - total_compra_fornecido - despesas_fornecimentos,
+    }
+
+
+def apresentar_realizado(lic: Dict[str, Any]) -> Dict[str, Any]:
+    """Na listagem, despesas_totais/lucro_total mostram o realizado (o que já foi fornecido)"""
+    if "despesas_realizadas" in lic:
+        lic["despesas_totais"] = lic.pop("despesas_realizadas")
+    if "lucro_realizado" in lic:
+        lic["lucro_total"] = lic.pop("lucro_realizado")
+    return lic
+
+
+async def atualizar_alertas_licitacoes() -> int:
+    """Recalcula os alertas que mudam com a data (vencimento do contrato); grava só os que mudaram"""
+    from pymongo import UpdateOne
+    
+    projecao = {"_id": 1, "contrato.data_fim": 1, "quantidade_total_contratada": 1, "quantidade_total_fornecida": 1, "alertas": 1}
+    lote = []
+    alterados = 0
+    async for lic in db.licitacoes.find({"contrato.data_fim": {"$ne": None}}, projecao):
+        alertas = _alertas_licitacao(
+            lic["contrato"].get("data_fim"),
+            lic.get("quantidade_total_contratada", 0),
+            lic.get("quantidade_total_fornecida", 0)
+        )
+        if alertas != lic.get("alertas"):
+            lote.append(UpdateOne({"_id": lic["_id"]}, {"$set": {"alertas": alertas}}))
+        if len(lote) >= MIGRACAO_LOTE:
+            alterados += (await db.licitacoes.bulk_write(lote, ordered=False)).modified_count
+            lote = []
+    if lote:
+        alterados += (await db.licitacoes.bulk_write(lote, ordered=False)).modified_count
+    return alterados
+
+
+LICITACAO_CONTAGENS = {"quantidade_produtos": "produtos"}
+
+
+def _campos_produto_contrato(p: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos editáveis de um produto do contrato e seus valores derivados.
+    
+    quantidade_fornecida e quantidade_restante não entram: são do servidor, mantidas
+    com $inc pelos fornecimentos.
+    """
+    qtd_contratada = p.get("quantidade_contratada", p.get("quantidade_empenhada", 0))
+    preco_venda = p.get("preco_venda", 0)
+    preco_compra = p.get("preco_compra", 0)
+    despesas_extras = p.get("despesas_extras", 0)
+    return {
+        "produto_id": p.get("produto_id"),
+        "descricao": p.get("descricao", ""),
+        "quantidade_contratada": qtd_contratada,
+        "preco_compra": preco_compra,
+        "preco_venda": preco_venda,
+        "valor_total": preco_venda * qtd_contratada,
+        "despesas_extras": despesas_extras,
+        "lucro_unitario": preco_venda - preco_compra - despesas_extras,
+    }
+
+
+@api_router.get("/licitacoes", response_model=Union[List[Licitacao], List[LicitacaoResumo]])
+async def get_licitacoes(
+    view: str = Query("full", pattern=VIEW_LISTAGEM),
+    current_user: User = Depends(get_current_user)
+):
+    if view == "summary":
+        projecao = projecao_resumo(
+            LicitacaoResumo, LICITACAO_CONTAGENS, schema_version=1, despesas_realizadas=1, lucro_realizado=1
+        )
+        licitacoes = await db.licitacoes.find({}, projecao).sort("data_empenho", -1).to_list(1000)
+        await completar_legados("licitacoes", licitacoes, LICITACAO_CONTAGENS)
+        for lic in licitacoes:
+            apresentar_realizado(lic)
+        return resposta_lista(LicitacaoResumo, licitacoes)
+    
+    licitacoes = await db.licitacoes.find({}, {"_id": 0}).sort("data_empenho", -1).to_list(1000)
+    for lic in licitacoes:
+        apresentar_realizado(normalizar_leitura("licitacoes", lic))
+    return resposta_lista(Licitacao, licitacoes)
+
+
+@api_router.post("/licitacoes", response_model=Licitacao)
+async def create_licitacao(lic_data: LicitacaoCreate, current_user: User = Depends(get_current_user)):
+    lic_id = str(uuid.uuid4())
+    
+    # Criar objeto do contrato
+    contrato = {
+        "numero_contrato": lic_data.numero_contrato,
+        "data_inicio": lic_data.data_inicio_contrato,
+        "data_fim": lic_data.data_fim_contrato,
+        "status": "vigente"
+    }
+    
+    # Processar produtos com IDs únicos e calcular valores
+    produtos_processados = []
+    for p in lic_data.produtos:
+        campos = _campos_produto_contrato(p)
+        produtos_processados.append({
+            "id": str(uuid.uuid4()),
+            **campos,
+            "quantidade_fornecida": 0,
+            "quantidade_restante": campos["quantidade_contratada"],
+        })
+    
+    # Calcular totais
+    valor_total_venda = sum(p["valor_total"] for p in produtos_processados)
+    valor_total_compra = sum(p["preco_compra"] * p["quantidade_contratada"] for p in produtos_processados)
+    # Atualizar valor do contrato
+    contrato["valor_total_contrato"] = valor_total_venda
     
     lic_doc = {
         "id": lic_id,
@@ -1454,38 +2006,25 @@ async def create_licitacao(lic_data: LicitacaoCreate, current_user: User = Depen
         "estado": lic_data.estado,
         "orgao_publico": lic_data.orgao_publico,
         "numero_empenho": lic_data.numero_empenho,
-        "data_empenho": lic_data.data_empenho.isoformat(),
+        "data_empenho": lic_data.data_empenho,
         "numero_nota_empenho": lic_data.numero_nota_empenho,
         "produtos": produtos_processados,
-        "fornecimentos": [],
-        "previsao_fornecimento": lic_data.previsao_fornecimento.isoformat() if lic_data.previsao_fornecimento else None,
-        "previsao_pagamento": lic_data.previsao_pagamento.isoformat() if lic_data.previsao_pagamento else None,
+        "previsao_fornecimento": lic_data.previsao_fornecimento,
+        "previsao_pagamento": lic_data.previsao_pagamento,
         "frete": lic_data.frete,
         "impostos": lic_data.impostos,
         "outras_despesas": lic_data.outras_despesas,
         "descricao_outras_despesas": lic_data.descricao_outras_despesas,
         "valor_total_venda": valor_total_venda,
         "valor_total_compra": valor_total_compra,
-        "despesas_totais": despesas_totais,
-        "lucro_total": lucro_total,
-        "quantidade_total_contratada": quantidade_total_contratada,
-        "quantidade_total_fornecida": 0,
-        "quantidade_total_restante": quantidade_total_contratada,
-        "percentual_executado": 0,
         "status_pagamento": "pendente",
-        "alertas": [],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
+    lic_doc.update(calcular_metricas_licitacao(lic_doc))
     
+    aplicar_schema("licitacoes", lic_doc)
     await db.licitacoes.insert_one(lic_doc)
-    
-    # Convert back for response
-    lic_doc["data_empenho"] = datetime.fromisoformat(lic_doc["data_empenho"])
-    if lic_doc.get("previsao_fornecimento"):
-        lic_doc["previsao_fornecimento"] = datetime.fromisoformat(lic_doc["previsao_fornecimento"])
-    if lic_doc.get("previsao_pagamento"):
-        lic_doc["previsao_pagamento"] = datetime.fromisoformat(lic_doc["previsao_pagamento"])
-    lic_doc["created_at"] = datetime.fromisoformat(lic_doc["created_at"])
+    await aplicar_rollup_licitacao(lic_doc)
     
     return Licitacao(**lic_doc)
 
@@ -1496,133 +2035,120 @@ async def get_licitacao(licitacao_id: str, current_user: User = Depends(get_curr
     if not lic:
         raise HTTPException(status_code=404, detail="Licitação not found")
     
-    # Convert datetime strings
-    if isinstance(lic.get("data_empenho"), str):
-        lic["data_empenho"] = datetime.fromisoformat(lic["data_empenho"])
-    if lic.get("previsao_fornecimento") and isinstance(lic["previsao_fornecimento"], str):
-        lic["previsao_fornecimento"] = datetime.fromisoformat(lic["previsao_fornecimento"])
-    if lic.get("fornecimento_efetivo") and isinstance(lic["fornecimento_efetivo"], str):
-        lic["fornecimento_efetivo"] = datetime.fromisoformat(lic["fornecimento_efetivo"])
-    if lic.get("previsao_pagamento") and isinstance(lic["previsao_pagamento"], str):
-        lic["previsao_pagamento"] = datetime.fromisoformat(lic["previsao_pagamento"])
-    if isinstance(lic.get("created_at"), str):
-        lic["created_at"] = datetime.fromisoformat(lic["created_at"])
-    
-    
-    # Calculate alerts for individual licitação (same logic as list endpoint)
-    qtd_contratada = 0
-    qtd_fornecida = 0
-    for p in lic.get("produtos", []):
-        qtd_contratada += p.get("quantidade_contratada", p.get("quantidade_empenhada", 0))
-        qtd_fornecida += p.get("quantidade_fornecida", 0)
-    
-    lic["quantidade_total_contratada"] = qtd_contratada
-    lic["quantidade_total_fornecida"] = qtd_fornecida
-    lic["quantidade_total_restante"] = qtd_contratada - qtd_fornecida
-    lic["percentual_executado"] = (qtd_fornecida / qtd_contratada * 100) if qtd_contratada > 0 else 0
-    
-    # Calculate alerts
-    alertas = []
-    if lic.get("contrato"):
-        contrato = lic["contrato"]
-        if isinstance(contrato.get("data_fim"), str):
-            data_fim = datetime.fromisoformat(contrato["data_fim"])
-        else:
-            data_fim = contrato.get("data_fim")
-        
-        if data_fim:
-            # Ensure both datetimes have the same timezone awareness
-            if data_fim.tzinfo is None:
-                data_fim = data_fim.replace(tzinfo=timezone.utc)
-            
-            dias_restantes = (data_fim - datetime.now(timezone.utc)).days
-            if dias_restantes < 0:
-                alertas.append("⚠️ Contrato VENCIDO")
-            elif dias_restantes <= 30:
-                alertas.append(f"⚠️ Contrato vence em {dias_restantes} dias")
-    
-    if qtd_contratada > 0 and qtd_fornecida >= qtd_contratada:
-        alertas.append("✅ Contrato totalmente executado")
-    elif qtd_contratada > 0 and (qtd_fornecida / qtd_contratada) >= 0.9:
-        alertas.append(f"⚠️ {((qtd_fornecida / qtd_contratada) * 100):.1f}% do contrato executado")
-    
-    lic["alertas"] = alertas
-    
-    # Calcular despesas totais (despesas fixas + despesas dos fornecimentos)
-    despesas_fixas = lic.get("frete", 0) + lic.get("impostos", 0) + lic.get("outras_despesas", 0)
-    despesas_fornecimentos = sum(f.get("total_despesas", 0) for f in lic.get("fornecimentos", []))
-    lic["despesas_totais"] = despesas_fixas + despesas_fornecimentos
-    
-    # Calcular lucro total (considerando apenas o fornecido)
-    total_venda_fornecido = 0
-    total_compra_fornecido = 0
-    for p in lic.get("produtos", []):
-        qtd_forn = p.get("quantidade_fornecida", 0)
-        total_venda_fornecido += qtd_forn * p.get("preco_venda", 0)
-        total_compra_fornecido += qtd_forn * p.get("preco_compra", 0)
+    normalizar_leitura("licitacoes", lic)
     
-    lic["lucro_total"] = total_venda_fornecido - total_compra_fornecido - despesas_fornecimentos
+    fornecimentos = await db.fornecimentos.find(
+        {"licitacao_id": licitacao_id}, {"_id": 0, "licitacao_id": 0}
+    ).sort("data_fornecimento", 1).to_list(None)
+    lic["fornecimentos"] = lic.get("fornecimentos", []) + fornecimentos
     
     return Licitacao(**lic)
 
 
 @api_router.put("/licitacoes/{licitacao_id}", response_model=Licitacao)
 async def update_licitacao(licitacao_id: str, lic_data: LicitacaoCreate, current_user: User = Depends(get_current_user)):
+    """Atualiza os dados do contrato e os campos editáveis dos produtos.
+    
+    Os produtos são casados pelo id; só os campos editáveis são gravados (arrayFilters),
+    então fornecimentos simultâneos não têm o $inc sobrescrito. O saldo de cada produto
+    acompanha a variação da quantidade contratada.
+    """
     existing = await db.licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Licitação not found")
     
-    # Calcular quantidades restantes para cada produto
-    produtos_processados = []
+    atuais = {p.get("id"): p for p in existing.get("produtos", [])}
+    editados = {}
+    novos = []
     for p in lic_data.produtos:
-        qtd_empenhada = p.get("quantidade_empenhada", 0)
-        qtd_fornecida = p.get("quantidade_fornecida", 0)
-        qtd_restante = qtd_empenhada - qtd_fornecida
-        lucro_unitario = p.get("preco_venda", 0) - p.get("preco_compra", 0) - p.get("despesas_extras", 0)
-        
-        produtos_processados.append({
-            **p,
-            "quantidade_restante": qtd_restante,
-            "lucro_unitario": lucro_unitario
-        })
-    
-    # Calcular totais
-    valor_total_venda = sum(p.get("preco_venda", 0) * p.get("quantidade_empenhada", 0) for p in lic_data.produtos)
-    valor_total_compra = sum(p.get("preco_compra", 0) * p.get("quantidade_empenhada", 0) for p in lic_data.produtos)
-    despesas_produtos = sum(p.get("despesas_extras", 0) * p.get("quantidade_empenhada", 0) for p in lic_data.produtos)
-    despesas_totais = despesas_produtos + lic_data.frete + lic_data.impostos + lic_data.outras_despesas
-    lucro_total = valor_total_venda - valor_total_compra - despesas_totais
-    
-    update_doc = lic_data.model_dump()
-    update_doc["produtos"] = produtos_processados
-    update_doc["valor_total_venda"] = valor_total_venda
-    update_doc["valor_total_compra"] = valor_total_compra
-    update_doc["despesas_totais"] = despesas_totais
-    update_doc["lucro_total"] = lucro_total
-    update_doc["data_empenho"] = update_doc["data_empenho"].isoformat()
-    if update_doc.get("previsao_fornecimento"):
-        update_doc["previsao_fornecimento"] = update_doc["previsao_fornecimento"].isoformat()
-    if update_doc.get("fornecimento_efetivo"):
-        update_doc["fornecimento_efetivo"] = update_doc["fornecimento_efetivo"].isoformat()
-    if update_doc.get("previsao_pagamento"):
-        update_doc["previsao_pagamento"] = update_doc["previsao_pagamento"].isoformat()
-    
-    await db.licitacoes.update_one(
-        {"id": licitacao_id},
-        {"$set": update_doc}
-    )
+        campos = _campos_produto_contrato(p)
+        atual = atuais.get(p.get("id"))
+        if atual is None:
+            novos.append({
+                "id": str(uuid.uuid4()),
+                **campos,
+                "quantidade_fornecida": 0,
+                "quantidade_restante": campos["quantidade_contratada"],
+            })
+            continue
+        if campos["quantidade_contratada"] < atual.get("quantidade_fornecida", 0):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Quantidade contratada de \"{campos['descricao']}\" menor que a já fornecida ({atual.get('quantidade_fornecida', 0)})"
+            )
+        editados[atual["id"]] = campos
+    removidos = [pid for pid in atuais if pid not in editados]
+    com_fornecimento = [atuais[pid].get("descricao", pid) for pid in removidos if atuais[pid].get("quantidade_fornecida", 0) > 0]
+    if com_fornecimento:
+        raise HTTPException(status_code=400, detail=f"Produtos com fornecimento não podem ser removidos: {', '.join(com_fornecimento)}")
+    
+    dados = lic_data.model_dump(exclude={"produtos", "numero_contrato", "data_inicio_contrato", "data_fim_contrato"})
+    dados["contrato.numero_contrato"] = lic_data.numero_contrato
+    dados["contrato.data_inicio"] = lic_data.data_inicio_contrato
+    dados["contrato.data_fim"] = lic_data.data_fim_contrato
+    
+    incrementos = {}
+    filtros_array = []
+    for n, (prod_id, campos) in enumerate(editados.items()):
+        atual = atuais[prod_id]
+        qtd_anterior = atual.get("quantidade_contratada", atual.get("quantidade_empenhada", 0))
+        if "quantidade_restante" not in atual:
+            # Produtos antigos sem saldo gravado: inicializa antes de aplicar a variação
+            await db.licitacoes.update_one(
+                {"id": licitacao_id, "produtos": {"$elemMatch": {"id": prod_id, "quantidade_restante": {"$exists": False}}}},
+                {"$set": {"produtos.$.quantidade_restante": qtd_anterior - atual.get("quantidade_fornecida", 0)}}
+            )
+        for campo, valor in campos.items():
+            dados[f"produtos.$[p{n}].{campo}"] = valor
+        if campos["quantidade_contratada"] != qtd_anterior:
+            incrementos[f"produtos.$[p{n}].quantidade_restante"] = campos["quantidade_contratada"] - qtd_anterior
+        filtros_array.append({f"p{n}.id": prod_id})
+    
+    operacao = {"$set": dados}
+    if incrementos:
+        operacao["$inc"] = incrementos
+    await db.licitacoes.update_one({"id": licitacao_id}, operacao, array_filters=filtros_array or None)
+    if novos:
+        await db.licitacoes.update_one({"id": licitacao_id}, {"$push": {"produtos": {"$each": novos}}})
+    if removidos:
+        await db.licitacoes.update_one(
+            {"id": licitacao_id},
+            {"$pull": {"produtos": {"id": {"$in": removidos}, "quantidade_fornecida": {"$not": {"$gt": 0}}}}}
+        )
     
+    # Totais a partir dos produtos gravados; só grava se nenhum fornecimento entrou no meio
+    for _ in range(5):
+        lic = await db.licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
+        if lic is None:
+            raise HTTPException(status_code=404, detail="Licitação not found")
+        produtos = lic.get("produtos", [])
+        totais = {
+            "valor_total_venda": sum(p.get("valor_total", 0) for p in produtos),
+            "valor_total_compra": sum(p.get("preco_compra", 0) * p.get("quantidade_contratada", p.get("quantidade_empenhada", 0)) for p in produtos),
+        }
+        totais["contrato.valor_total_contrato"] = totais["valor_total_venda"]
+        totais.update(calcular_metricas_licitacao({**lic, **totais}))
+        guarda = {"id": licitacao_id}
+        for campo in ("quantidade_total_fornecida", "despesas_fornecimentos"):
+            guarda[campo] = lic[campo] if campo in lic else {"$exists": False}
+        resultado = await db.licitacoes.update_one(guarda, {"$set": totais})
+        if resultado.matched_count:
+            break
+    else:
+        # Contrato e produtos já foram gravados; cidade, data e status podem ter mudado de
+        # bucket, então os rollups acompanham o documento como ficou antes do 409
+        await aplicar_rollup_licitacao(existing, -1)
+        await aplicar_rollup_licitacao(lic)
+        raise HTTPException(
+            status_code=409,
+            detail="Fornecimentos registrados durante a edição; salve novamente para recalcular os totais"
+        )
     lic = await db.licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
-    if isinstance(lic.get("data_empenho"), str):
-        lic["data_empenho"] = datetime.fromisoformat(lic["data_empenho"])
-    if lic.get("previsao_fornecimento") and isinstance(lic["previsao_fornecimento"], str):
-        lic["previsao_fornecimento"] = datetime.fromisoformat(lic["previsao_fornecimento"])
-    if lic.get("fornecimento_efetivo") and isinstance(lic["fornecimento_efetivo"], str):
-        lic["fornecimento_efetivo"] = datetime.fromisoformat(lic["fornecimento_efetivo"])
-    if lic.get("previsao_pagamento") and isinstance(lic["previsao_pagamento"], str):
-        lic["previsao_pagamento"] = datetime.fromisoformat(lic["previsao_pagamento"])
-    if isinstance(lic.get("created_at"), str):
-        lic["created_at"] = datetime.fromisoformat(lic["created_at"])
+    if lic is None:
+        raise HTTPException(status_code=404, detail="Licitação not found")
+    lic = normalizar_leitura("licitacoes", lic)
+    await aplicar_rollup_licitacao(existing, -1)
+    await aplicar_rollup_licitacao(lic)
     
     return Licitacao(**lic)
 
@@ -1634,18 +2160,16 @@ async def update_licitacao_status(licitacao_id: str, status: str, current_user:
         raise HTTPException(status_code=404, detail="Licitação not found")
     
     await db.licitacoes.update_one({"id": licitacao_id}, {"$set": {"status_pagamento": status}})
+    await aplicar_rollup_licitacao(lic, -1)
+    await aplicar_rollup_licitacao({**lic, "status_pagamento": status})
     
     # Se marcado como pago, creditar no caixa
     if status == "pago" and lic.get("status_pagamento") != "pago":
-        caixa = await db.caixa.find_one({}, {"_id": 0})
-        if caixa:
-            # Usar valor total de venda baseado na quantidade fornecida
-            valor_licitacao = sum(p.get("preco_venda", 0) * p.get("quantidade_fornecida", 0) for p in lic["produtos"])
-            novo_saldo = caixa["saldo"] + valor_licitacao
-            await db.caixa.update_one(
-                {"id": caixa["id"]},
-                {"$set": {"saldo": novo_saldo, "updated_at": datetime.now(timezone.utc).isoformat()}}
-            )
+        # Usar valor total de venda baseado na quantidade fornecida
+        valor_licitacao = sum(p.get("preco_venda", 0) * p.get("quantidade_fornecida", 0) for p in lic["produtos"])
+        await registrar_movimento_caixa(
+            "credito", valor_licitacao, f"Licitação {lic.get('numero_licitacao', '')} paga", licitacao_id, "licitacao"
+        )
     
     return {"message": "Status updated"}
 
@@ -1674,31 +2198,24 @@ async def registrar_fornecimento(
     current_user: User = Depends(get_current_user)
 ):
     """Registra um fornecimento para um produto do contrato"""
+    if fornecimento.quantidade <= 0:
+        raise HTTPException(status_code=400, detail="Quantidade do fornecimento deve ser maior que zero")
+    
     lic = await db.licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
     if not lic:
         raise HTTPException(status_code=404, detail="Licitação não encontrada")
     
     # Encontrar o produto no contrato
-    produto_encontrado = None
-    produto_index = -1
-    for i, p in enumerate(lic.get("produtos", [])):
-        if p.get("id") == fornecimento.produto_contrato_id:
-            produto_encontrado = p
-            produto_index = i
-            break
-    
+    produto_encontrado = next((p for p in lic.get("produtos", []) if p.get("id") == fornecimento.produto_contrato_id), None)
     if not produto_encontrado:
         raise HTTPException(status_code=404, detail="Produto não encontrado no contrato")
     
-    # Verificar se a quantidade não excede o disponível
     qtd_contratada = produto_encontrado.get("quantidade_contratada", produto_encontrado.get("quantidade_empenhada", 0))
-    qtd_fornecida_atual = produto_encontrado.get("quantidade_fornecida", 0)
-    qtd_restante = qtd_contratada - qtd_fornecida_atual
-    
-    if fornecimento.quantidade > qtd_restante:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Quantidade excede o disponível no contrato. Restante: {qtd_restante}"
+    if "quantidade_restante" not in produto_encontrado:
+        # Produtos antigos sem saldo gravado: inicializa uma única vez para servir de guarda
+        await db.licitacoes.update_one(
+            {"id": licitacao_id, "produtos": {"$elemMatch": {"id": fornecimento.produto_contrato_id, "quantidade_restante": {"$exists": False}}}},
+            {"$set": {"produtos.$.quantidade_restante": qtd_contratada - produto_encontrado.get("quantidade_fornecida", 0)}}
         )
     
     # Criar registro de fornecimento com despesas
@@ -1706,76 +2223,95 @@ async def registrar_fornecimento(
     
     fornec_doc = {
         "id": str(uuid.uuid4()),
+        "licitacao_id": licitacao_id,
         "produto_contrato_id": fornecimento.produto_contrato_id,
         "quantidade": fornecimento.quantidade,
-        "data_fornecimento": fornecimento.data_fornecimento.isoformat(),
+        "data_fornecimento": fornecimento.data_fornecimento,
         "numero_nota_fornecimento": fornecimento.numero_nota_fornecimento,
         "numero_nota_empenho": fornecimento.numero_nota_empenho,
         "observacao": fornecimento.observacao,
         "despesas": fornecimento.despesas,
         "total_despesas": total_despesas,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
-    # Atualizar quantidade fornecida do produto
-    nova_qtd_fornecida = qtd_fornecida_atual + fornecimento.quantidade
-    nova_qtd_restante = qtd_contratada - nova_qtd_fornecida
-    
-    # Atualizar no banco
-    produtos = lic.get("produtos", [])
-    produtos[produto_index]["quantidade_fornecida"] = nova_qtd_fornecida
-    produtos[produto_index]["quantidade_restante"] = nova_qtd_restante
-    
-    fornecimentos = lic.get("fornecimentos", [])
-    fornecimentos.append(fornec_doc)
+    # O registro entra primeiro; se a baixa abaixo for recusada ele é removido, então nunca
+    # fica saldo baixado sem o fornecimento correspondente
+    await db.fornecimentos.insert_one(fornec_doc)
+    
+    # Baixa atômica: só aplica se ainda houver saldo do produto, então entregas simultâneas
+    # não sobrescrevem uma à outra nem ultrapassam o contratado
+    qtd = fornecimento.quantidade
+    margem = produto_encontrado.get("preco_venda", 0) - produto_encontrado.get("preco_compra", 0)
+    lic_atualizada = await db.licitacoes.find_one_and_update(
+        {"id": licitacao_id, "produtos": {"$elemMatch": {"id": fornecimento.produto_contrato_id, "quantidade_restante": {"$gte": qtd}}}},
+        {"$inc": {
+            "produtos.$.quantidade_fornecida": qtd,
+            "produtos.$.quantidade_restante": -qtd,
+            "quantidade_total_fornecida": qtd,
+            "quantidade_total_restante": -qtd,
+            "quantidade_fornecimentos": 1,
+            "despesas_fornecimentos": total_despesas,
+            "despesas_realizadas": total_despesas,
+            "lucro_realizado": qtd * margem - total_despesas,
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not lic_atualizada:
+        await db.fornecimentos.delete_one({"id": fornec_doc["id"]})
+        atual = await db.licitacoes.find_one(
+            {"id": licitacao_id},
+            {"_id": 0, "produtos": {"$elemMatch": {"id": fornecimento.produto_contrato_id}}}
+        )
+        qtd_restante = ((atual or {}).get("produtos") or [{}])[0].get("quantidade_restante", 0)
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Quantidade excede o disponível no contrato. Restante: {qtd_restante}"
+        )
     
-    # Calcular totais atualizados
-    qtd_total_contratada = sum(p.get("quantidade_contratada", p.get("quantidade_empenhada", 0)) for p in produtos)
-    qtd_total_fornecida = sum(p.get("quantidade_fornecida", 0) for p in produtos)
-    qtd_total_restante = qtd_total_contratada - qtd_total_fornecida
-    percentual = (qtd_total_fornecida / qtd_total_contratada * 100) if qtd_total_contratada > 0 else 0
+    # Percentual e alertas derivam dos totais já incrementados
+    await db.licitacoes.update_one({"id": licitacao_id}, [{"$set": {
+        "percentual_executado": {"$cond": [
+            {"$gt": ["$quantidade_total_contratada", 0]},
+            {"$multiply": [{"$divide": ["$quantidade_total_fornecida", "$quantidade_total_contratada"]}, 100]},
+            0
+        ]}
+    }}])
+    metricas = calcular_metricas_licitacao(lic_atualizada)
+    await db.licitacoes.update_one({"id": licitacao_id}, {"$set": {"alertas": metricas["alertas"]}})
     
     # Atualizar data de fornecimento efetivo se for o primeiro
-    update_data = {
-        "produtos": produtos,
-        "fornecimentos": fornecimentos,
-        "quantidade_total_fornecida": qtd_total_fornecida,
-        "quantidade_total_restante": qtd_total_restante,
-        "percentual_executado": percentual
-    }
-    
-    if not lic.get("fornecimento_efetivo"):
-        update_data["fornecimento_efetivo"] = fornecimento.data_fornecimento.isoformat()
+    await db.licitacoes.update_one(
+        {"id": licitacao_id, "fornecimento_efetivo": None},
+        {"$set": {"fornecimento_efetivo": fornecimento.data_fornecimento}}
+    )
     
-    await db.licitacoes.update_one({"id": licitacao_id}, {"$set": update_data})
+    # Rollups não mudam: somam valores do contrato, e o fornecimento só altera o realizado
     
+    produto_atualizado = next(p for p in lic_atualizada["produtos"] if p.get("id") == fornecimento.produto_contrato_id)
     return {
         "message": "Fornecimento registrado com sucesso",
         "fornecimento_id": fornec_doc["id"],
-        "quantidade_fornecida": nova_qtd_fornecida,
-        "quantidade_restante": nova_qtd_restante,
-        "percentual_executado": percentual
+        "quantidade_fornecida": produto_atualizado.get("quantidade_fornecida", 0),
+        "quantidade_restante": produto_atualizado.get("quantidade_restante", 0),
+        "percentual_executado": metricas["percentual_executado"]
     }
 
 
 @api_router.delete("/licitacoes/{licitacao_id}")
 async def delete_licitacao(licitacao_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.licitacoes.delete_one({"id": licitacao_id})
-    if result.deleted_count == 0:
+    lic = await db.licitacoes.find_one_and_delete({"id": licitacao_id}, {"_id": 0})
+    if not lic:
         raise HTTPException(status_code=404, detail="Licitação not found")
+    await db.fornecimentos.delete_many({"licitacao_id": licitacao_id})
+    await aplicar_rollup_licitacao(lic, -1)
     return {"message": "Licitação deleted"}
 
 
 @api_router.get("/despesas", response_model=List[Despesa])
 async def get_despesas(current_user: User = Depends(get_current_user)):
     despesas = await db.despesas.find({}, {"_id": 0}).sort("data_vencimento", -1).to_list(1000)
-    for desp in despesas:
-        if isinstance(desp.get("data_despesa"), str):
-            desp["data_despesa"] = datetime.fromisoformat(desp["data_despesa"])
-        if isinstance(desp.get("data_vencimento"), str):
-            desp["data_vencimento"] = datetime.fromisoformat(desp["data_vencimento"])
-        if isinstance(desp.get("created_at"), str):
-            desp["created_at"] = datetime.fromisoformat(desp["created_at"])
     return despesas
 
 
@@ -1787,16 +2323,10 @@ async def create_despesa(desp_data: DespesaCreate, current_user: User = Depends(
     desp_doc = desp_data.model_dump()
     desp_doc["id"] = desp_id
     desp_doc["status"] = "pendente"
-    desp_doc["data_despesa"] = desp_doc["data_despesa"].isoformat()
-    desp_doc["data_vencimento"] = desp_doc["data_vencimento"].isoformat()
-    desp_doc["created_at"] = datetime.now(timezone.utc).isoformat()
+    desp_doc["created_at"] = datetime.now(timezone.utc)
     
     await db.despesas.insert_one(desp_doc)
     
-    desp_doc["data_despesa"] = datetime.fromisoformat(desp_doc["data_despesa"])
-    desp_doc["data_vencimento"] = datetime.fromisoformat(desp_doc["data_vencimento"])
-    desp_doc["created_at"] = datetime.fromisoformat(desp_doc["created_at"])
-    
     return Despesa(**desp_doc)
 
 
@@ -1809,13 +2339,9 @@ async def update_despesa_status(despesa_id: str, status: str, current_user: User
     await db.despesas.update_one({"id": despesa_id}, {"$set": {"status": status}})
     
     if status == "pago" and desp.get("status") != "pago":
-        caixa = await db.caixa.find_one({}, {"_id": 0})
-        if caixa:
-            novo_saldo = caixa["saldo"] - desp["valor"]
-            await db.caixa.update_one(
-                {"id": caixa["id"]},
-                {"$set": {"saldo": novo_saldo, "updated_at": datetime.now(timezone.utc).isoformat()}}
-            )
+        await registrar_movimento_caixa(
+            "debito", desp["valor"], f"Despesa {desp.get('descricao', '')} paga", despesa_id, "despesa"
+        )
     
     return {"message": "Status updated"}
 
@@ -1827,201 +2353,832 @@ async def update_despesa(despesa_id: str, desp_data: DespesaCreate, current_user
         raise HTTPException(status_code=404, detail="Despesa not found")
     
     update_doc = desp_data.model_dump()
-    update_doc["data_despesa"] = update_doc["data_despesa"].isoformat()
-    update_doc["data_vencimento"] = update_doc["data_vencimento"].isoformat()
     
     await db.despesas.update_one({"id": despesa_id}, {"$set": update_doc})
     
     updated_desp = await db.despesas.find_one({"id": despesa_id}, {"_id": 0})
-    if isinstance(updated_desp.get("data_despesa"), str):
-        updated_desp["data_despesa"] = datetime.fromisoformat(updated_desp["data_despesa"])
-    if isinstance(updated_desp.get("data_vencimento"), str):
-        updated_desp["data_vencimento"] = datetime.fromisoformat(updated_desp["data_vencimento"])
-    if isinstance(updated_desp.get("created_at"), str):
-        updated_desp["created_at"] = datetime.fromisoformat(updated_desp["created_at"])
     
     return Despesa(**updated_desp)
 
 
 @api_router.delete("/despesas/{despesa_id}")
 async def delete_despesa(despesa_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.despesas.delete_one({"id": despesa_id})
-    if result.deleted_count == 0:
+    desp = await db.despesas.find_one_and_delete({"id": despesa_id}, projection={"_id": 0, "boleto": 1})
+    if not desp:
         raise HTTPException(status_code=404, detail="Despesa not found")
+    await descartar_anexo(desp.get("boleto"), os.path.join(UPLOAD_DIR, "boletos"))
     return {"message": "Despesa deleted"}
 
 
-# Upload de boleto para despesa
-@api_router.post("/despesas/{despesa_id}/upload-boleto")
-async def upload_boleto_despesa(
-    despesa_id: str, 
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
-):
-    """Upload de boleto (PDF, JPG, PNG) para uma despesa"""
-    desp = await db.despesas.find_one({"id": despesa_id}, {"_id": 0})
-    if not desp:
-        raise HTTPException(status_code=404, detail="Despesa não encontrada")
-    
-    # Validar tipo de arquivo
-    allowed_types = ["application/pdf", "image/jpeg", "image/png", "image/jpg"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Tipo de arquivo não permitido. Use PDF, JPG ou PNG.")
+# ==================== UPLOADS ====================
+# Os arquivos são gravados em blocos, com a escrita (e o SHA-256) fora do event loop, e o
+# limite de tamanho é verificado enquanto os bytes chegam. Arquivos grandes (editais) podem
+# ser enviados em partes por uma sessão retomável: POST /uploads abre a sessão,
+# PUT /uploads/{id}?offset=N acrescenta uma parte (o corpo da requisição é lido em streaming),
+# GET /uploads/{id} informa quantos bytes já foram recebidos e POST /uploads/{id}/concluir
+# anexa o arquivo ao destino.
+
+MB = 1024 * 1024
+UPLOAD_BLOCO = 1 * MB
+UPLOAD_PARTE_MAX = int(os.environ.get("UPLOAD_CHUNK_MAX_MB", "16")) * MB
+UPLOAD_PARCIAIS_DIR = os.path.join(UPLOAD_DIR, "parciais")
+# Uma parte reserva o offset antes de gravar; a reserva de uma requisição que morreu no meio expira
+UPLOAD_PARTE_RESERVA = timedelta(minutes=float(os.environ.get("UPLOAD_PARTE_RESERVA_MINUTOS", "10")))
+
+UPLOAD_DESTINOS: Dict[str, Dict[str, Any]] = {
+    "boleto": {
+        "limite": int(os.environ.get("UPLOAD_MAX_BOLETO_MB", "10")) * MB,
+        "tipos": ["application/pdf", "image/jpeg", "image/png", "image/jpg"],
+        "erro_tipo": "Tipo de arquivo não permitido. Use PDF, JPG ou PNG.",
+    },
+    "edital": {
+        "limite": int(os.environ.get("UPLOAD_MAX_EDITAL_MB", "200")) * MB,
+        "tipos": ["application/pdf", "application/msword",
+                  "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                  "image/jpeg", "image/png"],
+        "erro_tipo": "Tipo de arquivo não permitido. Use PDF, DOC, DOCX, JPG ou PNG.",
+    },
+}
+
+
+def _validar_upload(destino: str, tipo: Optional[str], tamanho: Optional[int] = None):
+    regras = UPLOAD_DESTINOS[destino]
+    if tipo not in regras["tipos"]:
+        raise HTTPException(status_code=400, detail=regras["erro_tipo"])
+    if tamanho is not None and tamanho > regras["limite"]:
+        raise HTTPException(status_code=413, detail=f"Arquivo excede o limite de {regras['limite'] // MB} MB")
+
+
+def _escrever_bloco(arquivo, hasher, bloco: bytes):
+    # hashlib libera o GIL em blocos grandes: hash e escrita rodam juntos na thread
+    if hasher is not None:
+        hasher.update(bloco)
+    arquivo.write(bloco)
+
+
+async def _blocos_upload_file(file: UploadFile):
+    while True:
+        bloco = await file.read(UPLOAD_BLOCO)
+        if not bloco:
+            break
+        yield bloco
+
+
+async def gravar_blocos(blocos, arquivo, limite: int, hasher=None) -> int:
+    """Grava os blocos no arquivo aberto; interrompe com 413 assim que passar do limite"""
+    tamanho = 0
+    async for bloco in blocos:
+        tamanho += len(bloco)
+        if tamanho > limite:
+            raise HTTPException(status_code=413, detail=f"Arquivo excede o limite de {limite // MB} MB")
+        await asyncio.to_thread(_escrever_bloco, arquivo, hasher, bloco)
+    return tamanho
+
+
+# ==================== BLOBS ====================
+# Os arquivos anexados ficam num armazenamento endereçado por conteúdo: o caminho é derivado
+# do SHA-256 (BLOBS_DIR/ab/abcd...) e a coleção blobs conta quantos boletos/anexos apontam
+# para cada hash. Reenviar um arquivo já conhecido só incrementa refs; excluir um anexo só
+# decrementa. O arquivo é apagado pela coleta (coletar_blobs) depois que refs chega a zero e
+# passa o período de carência.
+#
+# Ordem que evita corrida entre upload e coleta: o upload incrementa refs ANTES de colocar o
+# arquivo no lugar; a coleta remove o documento (só se refs <= 0) ANTES de mexer no arquivo,
+# move o arquivo para fora do caminho e confere se o documento reapareceu (upload
+# concorrente) antes de apagá-lo de vez.
+
+BLOBS_DIR = os.path.join(UPLOAD_DIR, "blobs")
+BLOBS_TMP_DIR = os.path.join(BLOBS_DIR, "tmp")
+BLOB_GC_CARENCIA = timedelta(hours=float(os.environ.get("BLOB_GC_CARENCIA_HORAS", "1")))
+
+
+def _caminho_blob(sha256: str) -> str:
+    return os.path.join(BLOBS_DIR, sha256[:2], sha256)
+
+
+def _temporario_blob() -> str:
+    os.makedirs(BLOBS_TMP_DIR, exist_ok=True)
+    return os.path.join(BLOBS_TMP_DIR, f"{uuid.uuid4().hex}.tmp")
+
+
+def _mover_para_blob(temporario: str, caminho: str):
+    if os.path.exists(caminho):
+        # Conteúdo idêntico já armazenado
+        os.remove(temporario)
+        return
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    os.replace(temporario, caminho)
+
+
+async def armazenar_blob(temporario: str, sha256: str, tamanho: int, tipo: Optional[str]):
+    """Registra uma referência ao blob e move o arquivo temporário para o caminho do hash"""
+    agora = datetime.now(timezone.utc)
+    await db.blobs.update_one(
+        {"_id": sha256},
+        {
+            "$inc": {"refs": 1},
+            "$set": {"updated_at": agora},
+            "$setOnInsert": {"tamanho": tamanho, "tipo": tipo, "created_at": agora},
+        },
+        upsert=True
+    )
+    await asyncio.to_thread(_mover_para_blob, temporario, _caminho_blob(sha256))
+
+
+async def referenciar_blob(sha256: str, tamanho: int) -> bool:
+    """Reaproveita um blob já armazenado (upload instantâneo); False se não existir"""
+    blob = await db.blobs.find_one_and_update(
+        {"_id": sha256, "tamanho": tamanho},
+        {"$inc": {"refs": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+    )
+    if not blob:
+        return False
+    if not await asyncio.to_thread(os.path.exists, _caminho_blob(sha256)):
+        await liberar_blob(sha256)
+        return False
+    return True
+
+
+async def liberar_blob(sha256: str):
+    await db.blobs.update_one(
+        {"_id": sha256},
+        {"$inc": {"refs": -1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+    )
+
+
+def _caminho_anexo(anexo: Dict[str, Any], pasta_legado: str) -> str:
+    # Anexos anteriores ao armazenamento por hash guardam nome_arquivo (ver migrar_anexos_para_blobs)
+    if anexo.get("nome_arquivo"):
+        return os.path.join(pasta_legado, anexo["nome_arquivo"])
+    if anexo.get("sha256"):
+        return _caminho_blob(anexo["sha256"])
+    return ""  # anexo só com URL (POST /agenda-licitacoes/{id}/anexos)
+
+
+# Downloads: ETag forte = hash do blob, If-None-Match -> 304, Range -> 206. Anexos da agenda
+# nunca mudam de conteúdo (cache longo); o boleto de uma despesa pode ser trocado, então a
+# URL é revalidada a cada uso (barata: 304 sem tocar no arquivo).
+ANEXO_CACHE_IMUTAVEL = "private, max-age=31536000, immutable"
+ANEXO_CACHE_REVALIDAR = "private, no-cache"
+
+
+def _etag_anexo(anexo: Dict[str, Any], stat_result: os.stat_result) -> str:
+    if anexo.get("sha256"):
+        return f'"{anexo["sha256"]}"'
+    # Arquivo legado ainda sem hash
+    return f'W/"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+
+
+def _etag_casa(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match usa comparação fraca
+    alvo = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == alvo for t in if_none_match.split(","))
+
+
+def _intervalo_pedido(cabecalho: str, tamanho: int) -> Optional[Tuple[int, int]]:
+    """Interpreta "Range: bytes=a-b" (um único intervalo).
     
-    # Criar diretório para boletos
-    import os
-    import shutil
-    boletos_dir = os.path.join(UPLOAD_DIR, "boletos")
-    os.makedirs(boletos_dir, exist_ok=True)
+    None quando o cabeçalho deve ser ignorado (sintaxe inválida ou vários intervalos: responde
+    o arquivo inteiro); 416 quando o intervalo está fora do arquivo.
+    """
+    unidade, _, especificacao = cabecalho.partition("=")
+    if unidade.strip().lower() != "bytes" or "," in especificacao:
+        return None
+    inicio, separador, fim = especificacao.strip().partition("-")
+    if not separador:
+        return None
+    try:
+        if inicio == "":
+            # Sufixo: últimos N bytes
+            n = int(fim)
+            if n <= 0:
+                return None
+            inicio_int, fim_int = max(tamanho - n, 0), tamanho - 1
+        else:
+            inicio_int = int(inicio)
+            fim_int = int(fim) if fim else tamanho - 1
+    except ValueError:
+        return None
+    if inicio_int >= tamanho and (fim == "" or int(fim) >= inicio_int):
+        raise HTTPException(status_code=416, detail="Intervalo fora do arquivo",
+                            headers={"Content-Range": f"bytes */{tamanho}"})
+    if fim_int < inicio_int:
+        return None
+    return inicio_int, min(fim_int, tamanho - 1)
+
+
+async def _ler_intervalo(caminho: str, inicio: int, fim: int):
+    arquivo = await asyncio.to_thread(open, caminho, "rb")
+    try:
+        await asyncio.to_thread(arquivo.seek, inicio)
+        restante = fim - inicio + 1
+        while restante > 0:
+            bloco = await asyncio.to_thread(arquivo.read, min(UPLOAD_BLOCO, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+            yield bloco
+    finally:
+        await asyncio.to_thread(arquivo.close)
+
+
+def _content_disposition(nome: str) -> str:
+    nome_codificado = quote(nome)
+    if nome_codificado != nome:
+        return f"attachment; filename*=utf-8''{nome_codificado}"
+    return f'attachment; filename="{nome}"'
+
+
+def sem_compressao(endpoint):
+    """Marca a rota para o CompressaoMiddleware não recomprimir (anexos já comprimidos, Range, ETag forte)"""
+    endpoint.sem_compressao = True
+    return endpoint
+
+
+async def responder_anexo(request: Request, anexo: Dict[str, Any], caminho: str, cache_control: str) -> Response:
+    """Resposta de download com ETag, 304 condicional e suporte a Range"""
+    try:
+        if not caminho:
+            raise FileNotFoundError(caminho)
+        stat_result = await asyncio.to_thread(os.stat, caminho)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado no servidor")
     
-    # Gerar nome único para o arquivo
-    file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1] if file.filename else ".pdf"
-    file_name = f"{despesa_id}_{file_id}{file_ext}"
-    file_path = os.path.join(boletos_dir, file_name)
+    etag = _etag_anexo(anexo, stat_result)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if _etag_casa(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    nome = anexo.get("nome") or "anexo"
+    tipo = anexo.get("tipo") or "application/octet-stream"
+    faixa = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range: o intervalo só vale se o cliente ainda tem esta versão (comparação forte)
+    if faixa and (not if_range or (if_range.strip() == etag and not etag.startswith("W/"))):
+        intervalo = _intervalo_pedido(faixa, stat_result.st_size)
+        if intervalo:
+            inicio, fim = intervalo
+            return StreamingResponse(
+                _ler_intervalo(caminho, inicio, fim),
+                status_code=206,
+                media_type=tipo,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {inicio}-{fim}/{stat_result.st_size}",
+                    "Content-Length": str(fim - inicio + 1),
+                    "Content-Disposition": _content_disposition(nome),
+                }
+            )
     
-    # Salvar arquivo
+    return FileResponse(caminho, stat_result=stat_result, filename=nome, media_type=tipo, headers=headers)
+
+
+async def descartar_anexo(anexo: Optional[Dict[str, Any]], pasta_legado: str):
+    """Solta a referência do boleto/anexo removido (ou apaga o arquivo legado)"""
+    if not anexo:
+        return
+    if anexo.get("nome_arquivo"):
+        caminho = os.path.join(pasta_legado, anexo["nome_arquivo"])
+        if os.path.exists(caminho):
+            await asyncio.to_thread(os.remove, caminho)
+    elif anexo.get("sha256"):
+        await liberar_blob(anexo["sha256"])
+
+
+def _remover_lixo_blob(sha256: str) -> Optional[str]:
+    caminho = _caminho_blob(sha256)
+    lixo = f"{caminho}.{uuid.uuid4().hex}.lixo"
+    try:
+        os.replace(caminho, lixo)
+    except FileNotFoundError:
+        return None
+    return lixo
+
+
+def _varrer_blobs_dir(limite: float) -> Dict[str, List[str]]:
+    """Arquivos do armazenamento modificados antes de limite, por tipo"""
+    encontrados: Dict[str, List[str]] = {"blobs": [], "temporarios": []}
+    if not os.path.isdir(BLOBS_DIR):
+        return encontrados
+    for raiz, _, arquivos in os.walk(BLOBS_DIR):
+        tipo = "temporarios" if raiz == BLOBS_TMP_DIR else "blobs"
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    encontrados[tipo].append(caminho)
+            except FileNotFoundError:
+                continue
+    return encontrados
+
+
+async def coletar_blobs() -> Dict[str, int]:
+    """Apaga blobs sem referências, arquivos órfãos e temporários esquecidos"""
+    limite = datetime.now(timezone.utc) - BLOB_GC_CARENCIA
+    resultado = {"blobs": 0, "orfaos": 0, "temporarios": 0}
+    
+    async for blob in db.blobs.find({"refs": {"$lte": 0}, "updated_at": {"$lt": limite}}, {"_id": 1}):
+        sha256 = blob["_id"]
+        if not await db.blobs.find_one_and_delete({"_id": sha256, "refs": {"$lte": 0}}):
+            continue  # voltou a ser referenciado
+        lixo = await asyncio.to_thread(_remover_lixo_blob, sha256)
+        if not lixo:
+            continue
+        if await db.blobs.find_one({"_id": sha256}, {"_id": 1}):
+            # Um upload recriou o documento entre a remoção e a movimentação: devolve o arquivo
+            await asyncio.to_thread(os.replace, lixo, _caminho_blob(sha256))
+            continue
+        await asyncio.to_thread(os.remove, lixo)
+        resultado["blobs"] += 1
+    
+    # Arquivos sem documento (falha entre gravação e registro, ou .lixo de coleta interrompida)
+    encontrados = await asyncio.to_thread(_varrer_blobs_dir, limite.timestamp())
+    caminhos = encontrados["blobs"]
+    for i in range(0, len(caminhos), MIGRACAO_LOTE):
+        lote = caminhos[i:i + MIGRACAO_LOTE]
+        conhecidos = {
+            b["_id"] async for b in db.blobs.find({"_id": {"$in": [os.path.basename(c) for c in lote]}}, {"_id": 1})
+        }
+        for caminho in lote:
+            if os.path.basename(caminho) not in conhecidos:
+                await asyncio.to_thread(os.remove, caminho)
+                resultado["orfaos"] += 1
+    for caminho in encontrados["temporarios"]:
+        await asyncio.to_thread(os.remove, caminho)
+        resultado["temporarios"] += 1
+    return resultado
+
+
+async def loop_coleta_blobs():
+    intervalo = float(os.environ.get("BLOB_GC_INTERVALO_HORAS", "6")) * 3600
+    while True:
+        try:
+            resultado = await coletar_blobs()
+            if any(resultado.values()):
+                logger.info(f"Coleta de blobs: {resultado}")
+        except Exception as e:
+            logger.error(f"Falha na coleta de blobs: {e}")
+        await asyncio.sleep(intervalo)
+
+
+async def salvar_upload(file: UploadFile, destino: str) -> Dict[str, Any]:
+    """Grava o UploadFile no armazenamento por hash e devolve tamanho e SHA-256"""
+    _validar_upload(destino, file.content_type)
+    temporario = await asyncio.to_thread(_temporario_blob)
+    hasher = hashlib.sha256()
+    arquivo = await asyncio.to_thread(open, temporario, "wb")
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        tamanho = await gravar_blocos(_blocos_upload_file(file), arquivo, UPLOAD_DESTINOS[destino]["limite"], hasher)
+    except HTTPException:
+        await asyncio.to_thread(arquivo.close)
+        await asyncio.to_thread(os.remove, temporario)
+        raise
     except Exception as e:
+        await asyncio.to_thread(arquivo.close)
+        await asyncio.to_thread(os.remove, temporario)
         raise HTTPException(status_code=500, detail=f"Erro ao salvar arquivo: {str(e)}")
-    
-    # Criar registro do boleto
-    boleto_doc = {
+    await asyncio.to_thread(arquivo.close)
+    sha256 = hasher.hexdigest()
+    await armazenar_blob(temporario, sha256, tamanho, file.content_type)
+    return {"tamanho": tamanho, "sha256": sha256}
+
+
+def _sha256_arquivo(caminho: str) -> str:
+    hasher = hashlib.sha256()
+    with open(caminho, "rb") as arquivo:
+        for bloco in iter(lambda: arquivo.read(UPLOAD_BLOCO), b""):
+            hasher.update(bloco)
+    return hasher.hexdigest()
+
+
+def _doc_anexo(file_id: str, nome: Optional[str], tipo: Optional[str], tamanho: int, sha256: str) -> Dict[str, Any]:
+    return {
         "id": file_id,
-        "nome": file.filename,
-        "nome_arquivo": file_name,
-        "tipo": file.content_type,
-        "tamanho": os.path.getsize(file_path),
-        "uploaded_at": datetime.now(timezone.utc).isoformat()
+        "nome": nome,
+        "tipo": tipo,
+        "tamanho": tamanho,
+        "sha256": sha256,
+        "uploaded_at": datetime.now(timezone.utc)
     }
-    
-    await db.despesas.update_one(
+
+
+async def anexar_boleto(despesa_id: str, boleto_doc: Dict[str, Any]):
+    anterior = await db.despesas.find_one_and_update(
         {"id": despesa_id},
-        {"$set": {"boleto": boleto_doc}}
+        {"$set": {"boleto": boleto_doc}},
+        projection={"_id": 0, "boleto": 1}
     )
-    
-    return {"message": "Boleto anexado com sucesso", "boleto": boleto_doc}
+    if anterior is None:
+        # Despesa excluída durante o upload
+        await liberar_blob(boleto_doc["sha256"])
+        raise HTTPException(status_code=404, detail="Despesa não encontrada")
+    await descartar_anexo(anterior.get("boleto"), os.path.join(UPLOAD_DIR, "boletos"))
 
 
-@api_router.get("/despesas/{despesa_id}/boleto/download")
-async def download_boleto_despesa(despesa_id: str, current_user: User = Depends(get_current_user)):
-    """Download do boleto de uma despesa"""
-    from fastapi.responses import FileResponse
-    import os
-    
-    desp = await db.despesas.find_one({"id": despesa_id}, {"_id": 0})
-    if not desp:
-        raise HTTPException(status_code=404, detail="Despesa não encontrada")
-    
-    boleto = desp.get("boleto")
-    if not boleto:
-        raise HTTPException(status_code=404, detail="Esta despesa não possui boleto anexado")
-    
-    file_path = os.path.join(UPLOAD_DIR, "boletos", boleto.get("nome_arquivo", ""))
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado no servidor")
-    
-    return FileResponse(
-        file_path, 
-        filename=boleto.get("nome", "boleto"),
-        media_type=boleto.get("tipo", "application/octet-stream")
+async def anexar_edital(licitacao_id: str, anexo_doc: Dict[str, Any], usuario: str):
+    result = await db.agenda_licitacoes.update_one(
+        {"id": licitacao_id},
+        {
+            "$push": {
+                "anexos": anexo_doc,
+                "historico": {
+                    "data": datetime.now(timezone.utc),
+                    "usuario": usuario,
+                    "acao": f"Anexo adicionado: {anexo_doc['nome']}"
+                },
+            },
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+        }
     )
+    if result.matched_count == 0:
+        await liberar_blob(anexo_doc["sha256"])
+        raise HTTPException(status_code=404, detail="Licitação não encontrada")
 
 
-@api_router.delete("/despesas/{despesa_id}/boleto")
-async def delete_boleto_despesa(despesa_id: str, current_user: User = Depends(get_current_user)):
-    """Excluir boleto de uma despesa"""
-    import os
-    
-    desp = await db.despesas.find_one({"id": despesa_id}, {"_id": 0})
-    if not desp:
-        raise HTTPException(status_code=404, detail="Despesa não encontrada")
-    
-    boleto = desp.get("boleto")
-    if not boleto:
-        raise HTTPException(status_code=404, detail="Esta despesa não possui boleto anexado")
-    
-    # Remover arquivo do disco
-    file_path = os.path.join(UPLOAD_DIR, "boletos", boleto.get("nome_arquivo", ""))
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    
-    # Remover registro do banco
-    await db.despesas.update_one(
-        {"id": despesa_id},
-        {"$unset": {"boleto": ""}}
-    )
-    
-    return {"message": "Boleto excluído com sucesso"}
+# Sessões de upload em partes
+
+class UploadSessaoCreate(BaseModel):
+    destino: str  # boleto (referencia_id = despesa) ou edital (referencia_id = licitação da agenda)
+    referencia_id: str
+    nome: str
+    tipo: str
+    tamanho: int
+    sha256: Optional[str] = None  # se o conteúdo já estiver armazenado, o upload é dispensado
+
+
+async def _referencia_upload(destino: str, referencia_id: str) -> Dict[str, Any]:
+    if destino == "boleto":
+        doc = await db.despesas.find_one({"id": referencia_id}, {"_id": 0, "id": 1})
+        if not doc:
+            raise HTTPException(status_code=404, detail="Despesa não encontrada")
+    elif destino == "edital":
+        doc = await db.agenda_licitacoes.find_one({"id": referencia_id}, {"_id": 0, "id": 1})
+        if not doc:
+            raise HTTPException(status_code=404, detail="Licitação não encontrada")
+    else:
+        raise HTTPException(status_code=400, detail=f"Destino inválido. Use: {list(UPLOAD_DESTINOS)}")
+    return doc
 
 
-# ==================== NOTIFICAÇÕES ====================
+def _caminho_parcial(upload_id: str) -> str:
+    return os.path.join(UPLOAD_PARCIAIS_DIR, f"{upload_id}.part")
 
-@api_router.get("/notificacoes/despesas-vencimento")
-async def get_despesas_proximas_vencimento(current_user: User = Depends(get_current_user)):
-    """Get despesas that are due within 1 day"""
-    hoje = datetime.now(timezone.utc)
-    
-    despesas = await db.despesas.find({"status": "pendente"}, {"_id": 0}).to_list(1000)
-    
-    despesas_proximas = []
-    for d in despesas:
-        data_venc = d.get("data_vencimento")
-        if isinstance(data_venc, str):
-            data_venc = datetime.fromisoformat(data_venc.replace('Z', '+00:00'))
-        
-        if data_venc:
-            # Check if vencimento is today or tomorrow
-            dias_para_vencer = (data_venc.date() - hoje.date()).days
-            if dias_para_vencer <= 1 and dias_para_vencer >= 0:
-                despesas_proximas.append({
-                    "id": d["id"],
-                    "descricao": d["descricao"],
-                    "tipo": d["tipo"],
-                    "valor": d["valor"],
-                    "data_vencimento": data_venc.isoformat(),
-                    "dias_para_vencer": dias_para_vencer
-                })
-    
-    return {
-        "quantidade": len(despesas_proximas),
-        "despesas": despesas_proximas
-    }
 
+async def _sessao_upload(upload_id: str, current_user: User) -> Dict[str, Any]:
+    sessao = await db.uploads.find_one({"id": upload_id, "usuario": current_user.email}, {"_id": 0})
+    if not sessao:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+    return sessao
 
-@api_router.post("/notificacoes/enviar-email-vencimentos")
-async def enviar_notificacao_vencimentos(current_user: User = Depends(get_current_user)):
-    """Send email notification for expenses due within 1 day"""
+
+@api_router.post("/uploads")
+async def criar_sessao_upload(dados: UploadSessaoCreate, current_user: User = Depends(get_current_user)):
+    """Abre uma sessão de upload em partes; o cliente envia as partes com PUT /uploads/{id}.
     
-    # Get despesas próximas ao vencimento
-    hoje = datetime.now(timezone.utc)
+    Se sha256 e tamanho casarem com um blob já armazenado, o arquivo é anexado na hora e a
+    resposta traz deduplicado=True (nenhuma parte precisa ser enviada).
+    """
+    await _referencia_upload(dados.destino, dados.referencia_id)
+    _validar_upload(dados.destino, dados.tipo, dados.tamanho)
     
-    despesas = await db.despesas.find({"status": "pendente"}, {"_id": 0}).to_list(1000)
+    if dados.sha256 and await referenciar_blob(dados.sha256.lower(), dados.tamanho):
+        doc = _doc_anexo(str(uuid.uuid4()), dados.nome, dados.tipo, dados.tamanho, dados.sha256.lower())
+        if dados.destino == "boleto":
+            await anexar_boleto(dados.referencia_id, doc)
+        else:
+            await anexar_edital(dados.referencia_id, doc, current_user.email)
+        return {"deduplicado": True, "status": "concluida", "anexo": doc}
     
-    despesas_proximas = []
-    for d in despesas:
-        data_venc = d.get("data_vencimento")
-        if isinstance(data_venc, str):
-            data_venc = datetime.fromisoformat(data_venc.replace('Z', '+00:00'))
+    agora = datetime.now(timezone.utc)
+    sessao = {
+        "id": str(uuid.uuid4()),
+        **dados.model_dump(exclude={"sha256"}),
+        "recebido": 0,
+        "status": "aberta",
+        "usuario": current_user.email,
+        "created_at": agora,
+        "updated_at": agora,
+    }
+    os.makedirs(UPLOAD_PARCIAIS_DIR, exist_ok=True)
+    await asyncio.to_thread(lambda: open(_caminho_parcial(sessao["id"]), "wb").close())
+    await db.uploads.insert_one(sessao)
+    sessao.pop("_id", None)
+    return {**sessao, "deduplicado": False, "parte_max": UPLOAD_PARTE_MAX}
+
+
+@api_router.get("/uploads/{upload_id}")
+async def get_sessao_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Estado da sessão; "recebido" é o offset a partir do qual o envio deve ser retomado"""
+    return await _sessao_upload(upload_id, current_user)
+
+
+@api_router.put("/uploads/{upload_id}")
+async def enviar_parte_upload(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """Acrescenta o corpo da requisição ao arquivo parcial, a partir de offset.
+    
+    A parte reserva o offset (parte_reserva) antes de tocar no arquivo: duas requisições
+    com o mesmo offset nunca gravam ao mesmo tempo no .part.
+    """
+    sessao = await _sessao_upload(upload_id, current_user)
+    if sessao["status"] != "aberta":
+        raise HTTPException(status_code=409, detail="Sessão de upload já concluída")
+    if offset != sessao["recebido"]:
+        # O cliente deve retomar de onde o servidor parou (GET /uploads/{id})
+        raise HTTPException(status_code=409, detail=f"Offset inválido. Esperado: {sessao['recebido']}")
+    
+    agora = datetime.now(timezone.utc)
+    reserva = str(uuid.uuid4())
+    reservada = await db.uploads.update_one(
+        {
+            "id": upload_id, "recebido": offset, "status": "aberta",
+            "$or": [{"parte_desde": None}, {"parte_desde": {"$lt": agora - UPLOAD_PARTE_RESERVA}}],
+        },
+        {"$set": {"parte_reserva": reserva, "parte_desde": agora, "updated_at": agora}}
+    )
+    if not reservada.modified_count:
+        raise HTTPException(status_code=409, detail="Parte enviada em paralelo; consulte a sessão e retome")
+    
+    limite = min(UPLOAD_PARTE_MAX, sessao["tamanho"] - offset)
+    try:
+        arquivo = await asyncio.to_thread(open, _caminho_parcial(upload_id), "r+b")
+        try:
+            await asyncio.to_thread(arquivo.seek, offset)
+            tamanho = await gravar_blocos(request.stream(), arquivo, limite)
+            # Descarta bytes de uma tentativa anterior interrompida depois deste ponto
+            await asyncio.to_thread(arquivo.truncate)
+        finally:
+            await asyncio.to_thread(arquivo.close)
+    except BaseException:
+        await db.uploads.update_one({"id": upload_id, "parte_reserva": reserva}, {"$unset": {"parte_reserva": "", "parte_desde": ""}})
+        raise
+    
+    atualizada = await db.uploads.find_one_and_update(
+        {"id": upload_id, "parte_reserva": reserva},
+        {
+            "$set": {"recebido": offset + tamanho, "updated_at": datetime.now(timezone.utc)},
+            "$unset": {"parte_reserva": "", "parte_desde": ""},
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not atualizada:
+        # Reserva expirada e tomada por outra requisição (ou sessão cancelada)
+        raise HTTPException(status_code=409, detail="Parte enviada em paralelo; consulte a sessão e retome")
+    return {"recebido": atualizada["recebido"], "tamanho": atualizada["tamanho"]}
+
+
+@api_router.post("/uploads/{upload_id}/concluir")
+async def concluir_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Verifica o tamanho, calcula o SHA-256, armazena o blob e anexa à despesa ou à licitação"""
+    sessao = await _sessao_upload(upload_id, current_user)
+    if sessao["recebido"] != sessao["tamanho"]:
+        raise HTTPException(status_code=409, detail=f"Upload incompleto: {sessao['recebido']} de {sessao['tamanho']} bytes")
+    # Só uma conclusão vence; as demais recebem 409
+    agora = datetime.now(timezone.utc)
+    if not await db.uploads.find_one_and_update(
+        {
+            "id": upload_id, "status": "aberta",
+            "$or": [{"parte_desde": None}, {"parte_desde": {"$lt": agora - UPLOAD_PARTE_RESERVA}}],
+        },
+        {"$set": {"status": "concluindo", "updated_at": agora}}
+    ):
+        raise HTTPException(status_code=409, detail="Sessão de upload já concluída")
+    
+    parcial = _caminho_parcial(upload_id)
+    file_id = str(uuid.uuid4())
+    armazenado = None
+    try:
+        await _referencia_upload(sessao["destino"], sessao["referencia_id"])
+        sha256 = await asyncio.to_thread(_sha256_arquivo, parcial)
+        await armazenar_blob(parcial, sha256, sessao["tamanho"], sessao["tipo"])
+        armazenado = sha256
         
-        if data_venc:
-            dias_para_vencer = (data_venc.date() - hoje.date()).days
-            if dias_para_vencer <= 1 and dias_para_vencer >= 0:
-                despesas_proximas.append({
-                    "descricao": d["descricao"],
-                    "tipo": d["tipo"],
-                    "valor": d["valor"],
-                    "data_vencimento": data_venc.strftime("%d/%m/%Y"),
-                    "dias_para_vencer": dias_para_vencer
-                })
-    
-    if not despesas_proximas:
-        return {"message": "Nenhuma despesa próxima ao vencimento", "enviado": False}
-    
-    # Build email HTML
-    total_valor = sum(d["valor"] for d in despesas_proximas)
+        doc = _doc_anexo(file_id, sessao["nome"], sessao["tipo"], sessao["tamanho"], sha256)
+        if sessao["destino"] == "boleto":
+            await anexar_boleto(sessao["referencia_id"], doc)
+        else:
+            await anexar_edital(sessao["referencia_id"], doc, current_user.email)
+    except BaseException:
+        if armazenado:
+            # O .part já virou blob: a sessão não tem mais o que retomar
+            await liberar_blob(armazenado)
+            await db.uploads.delete_one({"id": upload_id, "status": "concluindo"})
+        else:
+            # Volta a "aberta" para o cliente tentar de novo (ou a limpeza remover o .part)
+            await db.uploads.update_one(
+                {"id": upload_id, "status": "concluindo"},
+                {"$set": {"status": "aberta", "updated_at": datetime.now(timezone.utc)}}
+            )
+        raise
+    await db.uploads.update_one({"id": upload_id}, {"$set": {"status": "concluida", "arquivo_id": file_id, "updated_at": datetime.now(timezone.utc)}})
+    return {"message": "Arquivo enviado com sucesso", "anexo": doc}
+
+
+@api_router.delete("/uploads/{upload_id}")
+async def cancelar_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    sessao = await _sessao_upload(upload_id, current_user)
+    if sessao["status"] == "aberta":
+        await db.uploads.delete_one({"id": upload_id, "status": "aberta"})
+        parcial = _caminho_parcial(upload_id)
+        if os.path.exists(parcial):
+            await asyncio.to_thread(os.remove, parcial)
+    return {"message": "Upload cancelado"}
+
+
+async def limpar_uploads_abandonados() -> int:
+    """Remove sessões sem atividade há mais de UPLOAD_SESSAO_TTL_HORAS.
+    
+    Inclui as que ficaram em "concluindo" porque o processo caiu durante a conclusão.
+    """
+    limite = datetime.now(timezone.utc) - timedelta(hours=float(os.environ.get("UPLOAD_SESSAO_TTL_HORAS", "24")))
+    pendentes = {"$in": ["aberta", "concluindo"]}
+    removidas = 0
+    async for sessao in db.uploads.find({"status": pendentes, "updated_at": {"$lt": limite}}, {"_id": 0, "id": 1}):
+        if (await db.uploads.delete_one({"id": sessao["id"], "status": pendentes, "updated_at": {"$lt": limite}})).deleted_count:
+            parcial = _caminho_parcial(sessao["id"])
+            if os.path.exists(parcial):
+                await asyncio.to_thread(os.remove, parcial)
+            removidas += 1
+    return removidas
+
+
+async def loop_limpeza_uploads():
+    while True:
+        try:
+            removidas = await limpar_uploads_abandonados()
+            if removidas:
+                logger.info(f"Sessões de upload abandonadas removidas: {removidas}")
+        except Exception as e:
+            logger.error(f"Falha ao limpar sessões de upload: {e}")
+        await asyncio.sleep(3600)
+
+
+# Upload de boleto para despesa
+@api_router.post("/despesas/{despesa_id}/upload-boleto")
+async def upload_boleto_despesa(
+    despesa_id: str, 
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Upload de boleto (PDF, JPG, PNG) para uma despesa"""
+    desp = await db.despesas.find_one({"id": despesa_id}, {"_id": 0})
+    if not desp:
+        raise HTTPException(status_code=404, detail="Despesa não encontrada")
+    
+    gravado = await salvar_upload(file, "boleto")
+    
+    # Criar registro do boleto
+    boleto_doc = _doc_anexo(str(uuid.uuid4()), file.filename, file.content_type, gravado["tamanho"], gravado["sha256"])
+    
+    await anexar_boleto(despesa_id, boleto_doc)
+    
+    return {"message": "Boleto anexado com sucesso", "boleto": boleto_doc}
+
+
+@api_router.get("/despesas/{despesa_id}/boleto/download")
+@sem_compressao
+async def download_boleto_despesa(despesa_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Download do boleto de uma despesa (ETag, 304 e Range)"""
+    desp = await db.despesas.find_one({"id": despesa_id}, {"_id": 0, "boleto": 1})
+    if not desp:
+        raise HTTPException(status_code=404, detail="Despesa não encontrada")
+    
+    boleto = desp.get("boleto")
+    if not boleto:
+        raise HTTPException(status_code=404, detail="Esta despesa não possui boleto anexado")
+    
+    caminho = _caminho_anexo(boleto, os.path.join(UPLOAD_DIR, "boletos"))
+    return await responder_anexo(request, {"nome": "boleto", **boleto}, caminho, ANEXO_CACHE_REVALIDAR)
+
+
+@api_router.delete("/despesas/{despesa_id}/boleto")
+async def delete_boleto_despesa(despesa_id: str, current_user: User = Depends(get_current_user)):
+    """Excluir boleto de uma despesa"""
+    desp = await db.despesas.find_one_and_update(
+        {"id": despesa_id},
+        {"$unset": {"boleto": ""}},
+        projection={"_id": 0, "boleto": 1}
+    )
+    if not desp:
+        raise HTTPException(status_code=404, detail="Despesa não encontrada")
+    
+    boleto = desp.get("boleto")
+    if not boleto:
+        raise HTTPException(status_code=404, detail="Esta despesa não possui boleto anexado")
+    
+    # O arquivo só sai do disco quando nenhum outro anexo aponta para o mesmo conteúdo
+    await descartar_anexo(boleto, os.path.join(UPLOAD_DIR, "boletos"))
+    
+    return {"message": "Boleto excluído com sucesso"}
+
+
+# ==================== NOTIFICAÇÕES ====================
+# O aviso de vencimentos é enviado por uma tarefa agendada (ver TAREFAS_AGENDADAS), além do
+# botão em Financeiro. A busca é um intervalo em (status, data_vencimento) e cada despesa
+# avisada fica registrada em notificacoes_enviadas, com _id por despesa, data de vencimento e
+# antecedência (véspera ou dia): cada aviso sai uma única vez, mesmo com vários workers
+# rodando a tarefa, e o aviso da véspera não impede o do dia.
+
+TAREFAS_FUSO = ZoneInfo(os.environ.get("TAREFAS_FUSO", "America/Sao_Paulo"))
+NOTIFICACAO_LOTE = int(os.environ.get("NOTIFICACAO_LOTE", "50"))  # despesas por email
+# Reserva de envio que nunca foi confirmada (processo caiu no meio do envio)
+NOTIFICACAO_RESERVA_EXPIRA = timedelta(hours=1)
+
+
+class EnviadorResend:
+    """Envia emails pelo Resend"""
+    
+    def pendencia(self) -> Optional[str]:
+        if not RESEND_AVAILABLE:
+            return "Biblioteca Resend não instalada. Execute: pip install resend"
+        if not RESEND_API_KEY or RESEND_API_KEY.startswith("re_test"):
+            return "API Key do Resend não configurada. Configure RESEND_API_KEY no arquivo .env"
+        return None
+    
+    async def enviar(self, assunto: str, html: str) -> Optional[str]:
+        params = {
+            "from": SENDER_EMAIL,
+            "to": [NOTIFICATION_EMAIL],
+            "subject": assunto,
+            "html": html
+        }
+        email_result = await asyncio.to_thread(resend.Emails.send, params)
+        return email_result.get("id")
+
+
+class EnviadorLocal:
+    """Guarda os emails em memória em vez de enviar (testes e desenvolvimento: EMAIL_BACKEND=local)"""
+    
+    def __init__(self):
+        self.enviados: List[Dict[str, Any]] = []
+    
+    def pendencia(self) -> Optional[str]:
+        return None
+    
+    async def enviar(self, assunto: str, html: str) -> Optional[str]:
+        email_id = f"local-{uuid.uuid4()}"
+        self.enviados.append({"id": email_id, "para": NOTIFICATION_EMAIL, "assunto": assunto, "html": html})
+        return email_id
+
+
+# Substituível em testes: server.email_enviador = EnviadorLocal()
+email_enviador = EnviadorLocal() if os.environ.get("EMAIL_BACKEND") == "local" else EnviadorResend()
+
+
+def _hoje_local() -> date:
+    return datetime.now(TAREFAS_FUSO).date()
+
+
+async def despesas_a_vencer(hoje: date) -> List[Dict[str, Any]]:
+    """Despesas pendentes que vencem hoje ou amanhã"""
+    # O dia do vencimento é a data (UTC) gravada em data_vencimento
+    inicio = datetime(hoje.year, hoje.month, hoje.day, tzinfo=timezone.utc)
+    despesas = await db.despesas.find(
+        {"status": "pendente", "data_vencimento": {"$gte": inicio, "$lt": inicio + timedelta(days=2)}},
+        {"_id": 0, "id": 1, "descricao": 1, "tipo": 1, "valor": 1, "data_vencimento": 1}
+    ).sort("data_vencimento", 1).to_list(None)
+    for d in despesas:
+        d["dias_para_vencer"] = (d["data_vencimento"].date() - hoje).days
+    return despesas
+
+
+def _chave_notificacao(despesa: Dict[str, Any]) -> str:
+    # Inclui a data (vencimento alterado é avisado de novo) e os dias para vencer ("Vence
+    # amanhã" e "VENCE HOJE!" são avisos distintos)
+    return f"vencimento:{despesa['id']}:{despesa['data_vencimento'].date().isoformat()}:{despesa['dias_para_vencer']}"
+
+
+async def _reservar_notificacoes(despesas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Registra as despesas ainda não avisadas; devolve só as que esta execução reservou"""
+    await db.notificacoes_enviadas.delete_many({
+        "status": "enviando",
+        "created_at": {"$lt": datetime.now(timezone.utc) - NOTIFICACAO_RESERVA_EXPIRA}
+    })
+    agora = datetime.now(timezone.utc)
+    docs = [
+        {"_id": _chave_notificacao(d), "despesa_id": d["id"], "status": "enviando", "created_at": agora}
+        for d in despesas
+    ]
+    reservadas = {doc["_id"] for doc in docs}
+    try:
+        await db.notificacoes_enviadas.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Chave duplicada: já avisada (ou sendo avisada por outro worker)
+        reservadas -= {docs[erro["index"]]["_id"] for erro in e.details.get("writeErrors", [])}
+    return [d for d in despesas if _chave_notificacao(d) in reservadas]
+
+
+def _html_vencimentos(despesas: List[Dict[str, Any]]) -> str:
+    total_valor = sum(d["valor"] for d in despesas)
     
     html_content = f"""
     <!DOCTYPE html>
@@ -2046,7 +3203,7 @@ async def enviar_notificacao_vencimentos(current_user: User = Depends(get_curren
         </div>
         <div class="content">
             <div class="alert">
-                <strong>Atenção!</strong> Você tem <strong>{len(despesas_proximas)} despesa(s)</strong> próxima(s) ao vencimento.
+                <strong>Atenção!</strong> Você tem <strong>{len(despesas)} despesa(s)</strong> próxima(s) ao vencimento.
             </div>
             
             <table>
@@ -2062,7 +3219,7 @@ async def enviar_notificacao_vencimentos(current_user: User = Depends(get_curren
                 <tbody>
     """
     
-    for d in despesas_proximas:
+    for d in despesas:
         status_text = "VENCE HOJE!" if d["dias_para_vencer"] == 0 else "Vence amanhã"
         status_color = "#dc2626" if d["dias_para_vencer"] == 0 else "#f97316"
         html_content += f"""
@@ -2070,7 +3227,7 @@ async def enviar_notificacao_vencimentos(current_user: User = Depends(get_curren
                         <td>{d["descricao"]}</td>
                         <td>{d["tipo"]}</td>
                         <td>R$ {d["valor"]:.2f}</td>
-                        <td>{d["data_vencimento"]}</td>
+                        <td>{d["data_vencimento"].strftime("%d/%m/%Y")}</td>
                         <td style="color: {status_color}; font-weight: bold;">{status_text}</td>
                     </tr>
         """
@@ -2085,55 +3242,269 @@ async def enviar_notificacao_vencimentos(current_user: User = Depends(get_curren
         </div>
         <div class="footer">
             <p>Este é um email automático do sistema XSELL Soluções Corporativas.</p>
-            <p>Gerado em: {datetime.now().strftime("%d/%m/%Y às %H:%M")}</p>
+            <p>Gerado em: {datetime.now(TAREFAS_FUSO).strftime("%d/%m/%Y às %H:%M")}</p>
         </div>
     </body>
     </html>
     """
+    return html_content
+
+
+async def notificar_vencimentos() -> Dict[str, Any]:
+    """Envia, em lotes de NOTIFICACAO_LOTE, o aviso das despesas que vencem hoje ou amanhã
+    e ainda não foram avisadas"""
+    despesas = await despesas_a_vencer(_hoje_local())
+    if not despesas:
+        return {"message": "Nenhuma despesa próxima ao vencimento", "enviado": False, "despesas_encontradas": 0}
     
-    # Check if Resend is properly configured
-    if not RESEND_AVAILABLE:
+    pendencia = email_enviador.pendencia()
+    if pendencia:
         return {
-            "message": "Biblioteca Resend não instalada. Execute: pip install resend",
+            "message": pendencia,
             "enviado": False,
-            "despesas_encontradas": len(despesas_proximas),
+            "despesas_encontradas": len(despesas),
             "email_destino": NOTIFICATION_EMAIL
         }
     
-    if not RESEND_API_KEY or RESEND_API_KEY.startswith("re_test"):
+    novas = await _reservar_notificacoes(despesas)
+    if not novas:
         return {
-            "message": "API Key do Resend não configurada. Configure RESEND_API_KEY no arquivo .env",
+            "message": "As despesas próximas ao vencimento já foram notificadas",
             "enviado": False,
-            "despesas_encontradas": len(despesas_proximas),
-            "email_destino": NOTIFICATION_EMAIL,
-            "preview_html": html_content[:500] + "..."
+            "despesas_encontradas": len(despesas),
+            "despesas_notificadas": 0
         }
     
-    # Send email using Resend
-    try:
-        params = {
-            "from": SENDER_EMAIL,
-            "to": [NOTIFICATION_EMAIL],
-            "subject": f"⚠️ XSELL - {len(despesas_proximas)} Despesa(s) Próxima(s) ao Vencimento",
-            "html": html_content
-        }
-        
-        email_result = await asyncio.to_thread(resend.Emails.send, params)
-        
-        return {
-            "message": f"Email enviado com sucesso para {NOTIFICATION_EMAIL}",
-            "enviado": True,
-            "email_id": email_result.get("id"),
-            "despesas_notificadas": len(despesas_proximas),
-            "total_valor": total_valor
-        }
-    except Exception as e:
-        logging.error(f"Erro ao enviar email: {str(e)}")
+    emails, erros, notificadas = [], [], []
+    for i in range(0, len(novas), NOTIFICACAO_LOTE):
+        lote = novas[i:i + NOTIFICACAO_LOTE]
+        chaves = [_chave_notificacao(d) for d in lote]
+        try:
+            email_id = await email_enviador.enviar(
+                f"⚠️ XSELL - {len(lote)} Despesa(s) Próxima(s) ao Vencimento",
+                _html_vencimentos(lote)
+            )
+        except Exception as e:
+            logger.error(f"Erro ao enviar email: {str(e)}")
+            # Libera a reserva: o lote é tentado de novo na próxima execução
+            await db.notificacoes_enviadas.delete_many({"_id": {"$in": chaves}})
+            erros.append(str(e))
+            continue
+        await db.notificacoes_enviadas.update_many(
+            {"_id": {"$in": chaves}},
+            {"$set": {"status": "enviada", "email_id": email_id, "enviada_em": datetime.now(timezone.utc)}}
+        )
+        emails.append(email_id)
+        notificadas.extend(lote)
+    
+    if not emails:
         return {
-            "message": f"Erro ao enviar email: {str(e)}",
+            "message": f"Erro ao enviar email: {erros[0]}",
             "enviado": False,
-            "despesas_encontradas": len(despesas_proximas)
+            "despesas_encontradas": len(despesas)
         }
+    return {
+        "message": f"Email enviado com sucesso para {NOTIFICATION_EMAIL}",
+        "enviado": True,
+        "email_id": emails[0],
+        "emails": emails,
+        "erros": erros,
+        "despesas_encontradas": len(despesas),
+        "despesas_notificadas": len(notificadas),
+        "total_valor": sum(d["valor"] for d in notificadas)
+    }
+
+
+# ==================== TAREFAS AGENDADAS ====================
+# Agendador em processo: cada tarefa roda nos horários configurados (fuso TAREFAS_FUSO).
+# O estado da última execução fica em tarefas (_id = nome); o campo horario funciona como
+# trava, então com vários workers cada horário é executado uma única vez.
+
+def _horarios(valor: str) -> List[dt_time]:
+    return sorted(dt_time.fromisoformat(h.strip()) for h in valor.split(",") if h.strip())
+
+
+TAREFAS_AGENDADAS: Dict[str, Dict[str, Any]] = {
+    "notificar_vencimentos": {
+        "funcao": notificar_vencimentos,
+        "horarios": _horarios(os.environ.get("NOTIFICACAO_HORARIOS", "08:00")),
+    },
+    # Alertas de vencimento dos contratos mudam com a data; a trava evita que cada worker reescreva tudo
+    "atualizar_alertas_licitacoes": {
+        "funcao": atualizar_alertas_licitacoes,
+        "horarios": _horarios(os.environ.get("LICITACAO_ALERTAS_HORARIOS", "00:00,06:00,12:00,18:00")),
+    },
+}
+
+
+def _proxima_execucao(horarios: List[dt_time], agora: datetime) -> Optional[datetime]:
+    for dias in range(2):
+        dia = agora.date() + timedelta(days=dias)
+        for horario in horarios:
+            candidato = datetime.combine(dia, horario, tzinfo=TAREFAS_FUSO)
+            if candidato > agora:
+                return candidato
+    return None
+
+
+def _ultima_execucao_prevista(horarios: List[dt_time], agora: datetime) -> Optional[datetime]:
+    for dias in range(2):
+        dia = agora.date() - timedelta(days=dias)
+        for horario in reversed(horarios):
+            candidato = datetime.combine(dia, horario, tzinfo=TAREFAS_FUSO)
+            if candidato <= agora:
+                return candidato
+    return None
+
+
+async def executar_tarefa(nome: str, horario: datetime, manual: bool = False) -> Optional[Dict[str, Any]]:
+    """Executa a tarefa e registra o resultado em tarefas.
+    
+    Execuções agendadas só acontecem se nenhum worker já tiver pegado o mesmo horário (None
+    nesse caso). Execuções manuais sempre rodam e propagam o erro para quem chamou.
+    """
+    agora = datetime.now(timezone.utc)
+    inicio = {"status": "executando", "inicio": agora, "origem": "manual" if manual else "agendada"}
+    if manual:
+        await db.tarefas.update_one({"_id": nome}, {"$set": inicio}, upsert=True)
+    else:
+        try:
+            await db.tarefas.update_one(
+                {"_id": nome, "$or": [{"horario": {"$lt": horario}}, {"horario": {"$exists": False}}]},
+                {"$set": {**inicio, "horario": horario}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return None
+    
+    try:
+        resultado = await TAREFAS_AGENDADAS[nome]["funcao"]()
+    except Exception as e:
+        await db.tarefas.update_one(
+            {"_id": nome},
+            {"$set": {"status": "erro", "erro": str(e), "fim": datetime.now(timezone.utc)}}
+        )
+        if manual:
+            raise
+        logger.error(f"Falha na tarefa {nome}: {e}")
+        return None
+    await db.tarefas.update_one(
+        {"_id": nome},
+        {"$set": {"status": "ok", "erro": None, "resultado": resultado, "fim": datetime.now(timezone.utc)}}
+    )
+    return resultado
+
+
+# Tarefas de startup (migrações, rebuild inicial): o mesmo documento em tarefas serve de trava,
+# com a chave no lugar do horário. Uma execução "executando" há mais de TAREFA_UNICA_EXPIRA é
+# considerada abandonada (worker morto no meio) e pode ser retomada.
+TAREFA_UNICA_EXPIRA = timedelta(minutes=int(os.environ.get("TAREFA_UNICA_EXPIRA_MINUTOS", "60")))
+
+
+async def executar_uma_vez(nome: str, chave: str, funcao) -> Optional[Any]:
+    """Executa funcao uma única vez por chave entre todos os workers.
+    
+    Retorna None se outro worker já executou (ou está executando) a mesma chave. Uma
+    execução que terminou em erro é repetida no próximo startup.
+    """
+    agora = datetime.now(timezone.utc)
+    try:
+        await db.tarefas.update_one(
+            {"_id": nome, "$or": [
+                {"chave": {"$ne": chave}},
+                {"status": "erro"},
+                {"status": "executando", "inicio": {"$lt": agora - TAREFA_UNICA_EXPIRA}},
+            ]},
+            {"$set": {"chave": chave, "status": "executando", "inicio": agora, "origem": "startup"}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return None
+    
+    try:
+        resultado = await funcao()
+    except Exception as e:
+        await db.tarefas.update_one(
+            {"_id": nome},
+            {"$set": {"status": "erro", "erro": str(e), "fim": datetime.now(timezone.utc)}}
+        )
+        logger.error(f"Falha na tarefa {nome}: {e}")
+        return None
+    await db.tarefas.update_one(
+        {"_id": nome},
+        {"$set": {"status": "ok", "erro": None, "resultado": resultado, "fim": datetime.now(timezone.utc)}}
+    )
+    return resultado
+
+
+async def loop_tarefa_agendada(nome: str):
+    horarios = TAREFAS_AGENDADAS[nome]["horarios"]
+    if not horarios:
+        return
+    
+    # Horário perdido enquanto o servidor estava parado (até um dia atrás)
+    ultima = _ultima_execucao_prevista(horarios, datetime.now(TAREFAS_FUSO))
+    estado = await db.tarefas.find_one({"_id": nome}, {"horario": 1})
+    if ultima and (not estado or not estado.get("horario")
+                   or estado["horario"] < ultima):
+        await executar_tarefa(nome, ultima)
+    
+    while True:
+        proxima = _proxima_execucao(horarios, datetime.now(TAREFAS_FUSO))
+        # Dorme em etapas curtas: mudanças no relógio do sistema não atrasam a execução
+        while (restante := (proxima - datetime.now(TAREFAS_FUSO)).total_seconds()) > 0:
+            await asyncio.sleep(min(restante, 300))
+        try:
+            await executar_tarefa(nome, proxima)
+        except Exception as e:
+            logger.error(f"Falha ao agendar a tarefa {nome}: {e}")
+
+
+@api_router.get("/tarefas")
+async def get_tarefas(current_user: User = Depends(get_current_user)):
+    """Estado das tarefas agendadas: horários, próxima execução e resultado da última"""
+    estados = {t["_id"]: t async for t in db.tarefas.find({"_id": {"$in": list(TAREFAS_AGENDADAS)}})}
+    agora = datetime.now(TAREFAS_FUSO)
+    tarefas = []
+    for nome, tarefa in TAREFAS_AGENDADAS.items():
+        estado = estados.get(nome, {})
+        estado.pop("_id", None)
+        tarefas.append({
+            "nome": nome,
+            "horarios": [h.strftime("%H:%M") for h in tarefa["horarios"]],
+            "fuso": str(TAREFAS_FUSO),
+            "proxima_execucao": _proxima_execucao(tarefa["horarios"], agora),
+            **estado,
+        })
+    return tarefas
+
+
+@api_router.post("/tarefas/{nome}/executar")
+async def executar_tarefa_agora(nome: str, current_user: User = Depends(get_current_user)):
+    if nome not in TAREFAS_AGENDADAS:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+    return await executar_tarefa(nome, datetime.now(timezone.utc), manual=True)
+
+
+@api_router.get("/notificacoes/despesas-vencimento")
+async def get_despesas_proximas_vencimento(current_user: User = Depends(get_current_user)):
+    """Get despesas that are due within 1 day"""
+    despesas = await despesas_a_vencer(_hoje_local())
+    for d in despesas:
+        d["data_vencimento"] = d["data_vencimento"].isoformat()
+    return {
+        "quantidade": len(despesas),
+        "despesas": despesas
+    }
+
+
+@api_router.post("/notificacoes/enviar-email-vencimentos")
+async def enviar_notificacao_vencimentos(current_user: User = Depends(get_current_user)):
+    """Envia agora o aviso das despesas próximas ao vencimento que ainda não foram avisadas"""
+    try:
+        return await executar_tarefa("notificar_vencimentos", datetime.now(timezone.utc), manual=True)
+    except Exception as e:
+        return {"message": f"Erro ao enviar email: {str(e)}", "enviado": False}
 
 
 @api_router.get("/notificacoes/config")
@@ -2141,63 +3512,253 @@ async def get_notificacao_config(current_user: User = Depends(get_current_user))
     """Get notification configuration status"""
     return {
         "resend_disponivel": RESEND_AVAILABLE,
-        "resend_configurado": bool(RESEND_API_KEY) and not RESEND_API_KEY.startswith("re_test"),
+        "resend_configurado": email_enviador.pendencia() is None,
         "email_remetente": SENDER_EMAIL,
-        "email_destino": NOTIFICATION_EMAIL
+        "email_destino": NOTIFICATION_EMAIL,
+        "horarios_envio": [h.strftime("%H:%M") for h in TAREFAS_AGENDADAS["notificar_vencimentos"]["horarios"]]
     }
 
 
-@api_router.get("/financeiro/caixa", response_model=Caixa)
-async def get_caixa(current_user: User = Depends(get_current_user)):
-    caixa = await db.caixa.find_one({}, {"_id": 0})
-    if not caixa:
-        import uuid
-        caixa_doc = {
-            "id": str(uuid.uuid4()),
-            "saldo": 0.0,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.caixa.insert_one(caixa_doc)
-        caixa = caixa_doc
-    
-    if isinstance(caixa.get("updated_at"), str):
-        caixa["updated_at"] = datetime.fromisoformat(caixa["updated_at"])
-    
-    return Caixa(**caixa)
+# ==================== CAIXA ====================
+# O saldo em caixa.saldo é uma visão materializada do livro caixa_movimentos (append-only).
+# Cada movimento é gravado no livro e aplicado com $inc, sem ler-modificar-gravar, então
+# movimentos simultâneos não se perdem. Snapshots periódicos guardam o saldo acumulado até
+# uma data de corte para responder saldos históricos sem somar o livro inteiro.
+# O mesmo $inc guarda o id do movimento em caixa.aplicados (os últimos CAIXA_APLICADOS), para
+# a reconciliação distinguir um movimento recente ainda em andamento de um que se perdeu.
 
+CAIXA_SNAPSHOT_MARGEM = timedelta(minutes=1)
+CAIXA_APLICADOS = 1000
 
-@api_router.post("/financeiro/caixa/movimento")
-async def add_movimento_caixa(mov: MovimentacaoCaixa, current_user: User = Depends(get_current_user)):
-    caixa = await db.caixa.find_one({}, {"_id": 0})
-    if not caixa:
-        raise HTTPException(status_code=404, detail="Caixa not found")
-    
-    if mov.tipo == "credito":
-        novo_saldo = caixa["saldo"] + mov.valor
-    elif mov.tipo == "debito":
-        novo_saldo = caixa["saldo"] - mov.valor
+
+async def obter_caixa() -> Dict[str, Any]:
+    """Retorna o caixa, criando-o se ainda não existir"""
+    caixa = await db.caixa.find_one({}, {"_id": 0, "aplicados": 0}, sort=[("_id", 1)])
+    if caixa:
+        return caixa
+    await db.caixa.update_one(
+        {},
+        {"$setOnInsert": {"id": str(uuid.uuid4()), "saldo": 0.0, "ledger_iniciado": True, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return await db.caixa.find_one({}, {"_id": 0, "aplicados": 0}, sort=[("_id", 1)])
+
+
+async def registrar_movimento_caixa(
+    tipo: str,
+    valor: float,
+    descricao: str,
+    referencia_id: Optional[str] = None,
+    origem: str = "manual"
+) -> Dict[str, Any]:
+    """Grava o movimento no livro e aplica o delta no saldo; retorna o caixa atualizado"""
+    if tipo == "credito":
+        delta = valor
+    elif tipo == "debito":
+        delta = -valor
     else:
         raise HTTPException(status_code=400, detail="Tipo inválido. Use 'credito' ou 'debito'")
     
-    await db.caixa.update_one(
+    caixa = await obter_caixa()
+    if "ledger_iniciado" not in caixa:
+        # A abertura precisa ler o saldo antes de qualquer movimento entrar no livro;
+        # senão o movimento seria contado no saldo de abertura e de novo no próprio registro
+        await iniciar_livro_caixa()
+    agora = datetime.now(timezone.utc)
+    movimento_id = str(uuid.uuid4())
+    await db.caixa_movimentos.insert_one({
+        "id": movimento_id,
+        "caixa_id": caixa["id"],
+        "tipo": tipo,
+        "valor": valor,
+        "delta": delta,
+        "descricao": descricao,
+        "referencia_id": referencia_id,
+        "origem": origem,
+        "data": agora,
+    })
+    return await db.caixa.find_one_and_update(
         {"id": caixa["id"]},
-        {"$set": {"saldo": novo_saldo, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {
+            "$inc": {"saldo": delta},
+            "$set": {"updated_at": agora},
+            "$push": {"aplicados": {"$each": [movimento_id], "$slice": -CAIXA_APLICADOS}},
+        },
+        projection={"_id": 0, "aplicados": 0},
+        return_document=ReturnDocument.AFTER
     )
+
+
+async def iniciar_livro_caixa():
+    """Registra o saldo existente como movimento de abertura (uma única vez por caixa).
     
-    return {"message": "Movimento registrado", "novo_saldo": novo_saldo}
+    Chamada no startup e, antes do primeiro movimento, por registrar_movimento_caixa:
+    o saldo lido aqui nunca inclui um movimento que também esteja no livro.
+    """
+    async for caixa in db.caixa.find({"ledger_iniciado": {"$exists": False}}, {"_id": 0}):
+        # A marcação e a leitura do saldo acontecem na mesma operação atômica; a abertura já
+        # está no saldo, então entra em aplicados junto
+        abertura_id = str(uuid.uuid4())
+        anterior = await db.caixa.find_one_and_update(
+            {"id": caixa["id"], "ledger_iniciado": {"$exists": False}},
+            {"$set": {"ledger_iniciado": True}, "$push": {"aplicados": {"$each": [abertura_id], "$slice": -CAIXA_APLICADOS}}},
+            projection={"_id": 0, "aplicados": 0}
+        )
+        if not anterior:
+            continue
+        saldo = anterior.get("saldo", 0.0)
+        await db.caixa_movimentos.insert_one({
+            "id": abertura_id,
+            "caixa_id": caixa["id"],
+            "tipo": "credito" if saldo >= 0 else "debito",
+            "valor": abs(saldo),
+            "delta": saldo,
+            "descricao": "Saldo de abertura do livro caixa",
+            "referencia_id": None,
+            "origem": "abertura",
+            "data": anterior.get("updated_at") or datetime.now(timezone.utc),
+        })
+
+
+async def _somar_movimentos(caixa_id: str, depois_de: Optional[datetime], ate: datetime) -> Dict[str, Any]:
+    filtro: Dict[str, Any] = {"caixa_id": caixa_id, "data": {"$lte": ate}}
+    if depois_de is not None:
+        filtro["data"]["$gt"] = depois_de
+    resultado = await db.caixa_movimentos.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": None, "delta": {"$sum": "$delta"}, "quantidade": {"$sum": 1}}}
+    ]).to_list(1)
+    return resultado[0] if resultado else {"delta": 0.0, "quantidade": 0}
+
+
+async def saldo_caixa_em(caixa_id: str, data: datetime) -> float:
+    """Saldo na data: último snapshot até a data + movimentos desde o snapshot"""
+    snapshot = await db.caixa_snapshots.find_one(
+        {"caixa_id": caixa_id, "data": {"$lte": data}}, {"_id": 0}, sort=[("data", -1)]
+    )
+    base = snapshot["saldo"] if snapshot else 0.0
+    desde = snapshot["data"] if snapshot else None
+    return base + (await _somar_movimentos(caixa_id, desde, data))["delta"]
+
+
+async def gerar_snapshot_caixa() -> Optional[Dict[str, Any]]:
+    """Acumula o livro até agora (menos uma margem para inserções em andamento) num novo snapshot"""
+    caixa = await obter_caixa()
+    corte = datetime.now(timezone.utc) - CAIXA_SNAPSHOT_MARGEM
+    ultimo = await db.caixa_snapshots.find_one({"caixa_id": caixa["id"]}, {"_id": 0}, sort=[("data", -1)])
+    if ultimo and _como_datetime(ultimo["data"]) >= corte:
+        return None
+    
+    soma = await _somar_movimentos(caixa["id"], ultimo["data"] if ultimo else None, corte)
+    if ultimo and not soma["quantidade"]:
+        return None
+    snapshot = {
+        "caixa_id": caixa["id"],
+        "data": corte,
+        "saldo": (ultimo["saldo"] if ultimo else 0.0) + soma["delta"],
+        "movimentos": (ultimo["movimentos"] if ultimo else 0) + soma["quantidade"],
+    }
+    await db.caixa_snapshots.update_one(
+        {"caixa_id": caixa["id"], "data": corte}, {"$setOnInsert": snapshot}, upsert=True
+    )
+    return snapshot
+
+
+async def loop_snapshots_caixa():
+    intervalo = float(os.environ.get("CAIXA_SNAPSHOT_INTERVALO_HORAS", "24")) * 3600
+    while True:
+        try:
+            await gerar_snapshot_caixa()
+        except Exception as e:
+            logger.error(f"Falha ao gerar snapshot do caixa: {e}")
+        await asyncio.sleep(intervalo)
+
+
+async def reconciliar_caixa(corrigir: bool = False) -> Dict[str, Any]:
+    """Refaz o saldo somando o livro e compara com o saldo materializado.
+    
+    Um movimento já gravado no livro pode ainda não ter feito o $inc no saldo. Movimentos
+    até o corte (agora - CAIXA_SNAPSHOT_MARGEM) contam sempre; os mais recentes só contam
+    se o id já estiver em caixa.aplicados, lido junto com o saldo. Assim a diferença não
+    inclui movimentos em andamento e a correção não os soma duas vezes.
+    """
+    caixa = await obter_caixa()
+    estado = await db.caixa.find_one({"id": caixa["id"]}, {"_id": 0, "saldo": 1, "aplicados": 1})
+    corte = datetime.now(timezone.utc) - CAIXA_SNAPSHOT_MARGEM
+    antigos = await _somar_movimentos(caixa["id"], None, corte)
+    recentes = await db.caixa_movimentos.aggregate([
+        {"$match": {"caixa_id": caixa["id"], "data": {"$gt": corte}}},
+        {"$group": {
+            "_id": {"$in": ["$id", estado.get("aplicados") or []]},
+            "delta": {"$sum": "$delta"},
+            "quantidade": {"$sum": 1},
+        }}
+    ]).to_list(2)
+    aplicados = next((r for r in recentes if r["_id"]), {"delta": 0.0, "quantidade": 0})
+    em_andamento = next((r for r in recentes if not r["_id"]), {"quantidade": 0})
+    
+    saldo = estado.get("saldo", 0.0)
+    saldo_livro = antigos["delta"] + aplicados["delta"]
+    diferenca = round(saldo_livro - saldo, 2)
+    resultado = {
+        "caixa_id": caixa["id"],
+        "saldo_materializado": saldo,
+        "saldo_livro": saldo_livro,
+        "movimentos": antigos["quantidade"] + aplicados["quantidade"],
+        "em_andamento": em_andamento["quantidade"],
+        "diferenca": diferenca,
+        "corrigido": False,
+    }
+    if diferenca and corrigir:
+        # $inc da diferença (e não $set): movimentos aplicados depois da leitura continuam somados
+        await db.caixa.update_one({"id": caixa["id"]}, {"$inc": {"saldo": diferenca}})
+        resultado["corrigido"] = True
+    return resultado
+
+
+@api_router.get("/financeiro/caixa", response_model=Caixa)
+async def get_caixa(current_user: User = Depends(get_current_user)):
+    return Caixa(**await obter_caixa())
+
+
+@api_router.post("/financeiro/caixa/movimento")
+async def add_movimento_caixa(mov: MovimentacaoCaixa, current_user: User = Depends(get_current_user)):
+    caixa = await registrar_movimento_caixa(mov.tipo, mov.valor, mov.descricao, mov.referencia_id)
+    return {"message": "Movimento registrado", "novo_saldo": caixa["saldo"]}
+
+
+@api_router.get("/financeiro/caixa/movimentos")
+async def get_movimentos_caixa(
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user)
+):
+    caixa = await obter_caixa()
+    return await db.caixa_movimentos.find(
+        {"caixa_id": caixa["id"]}, {"_id": 0}
+    ).sort("data", -1).limit(limit).to_list(limit)
+
+
+@api_router.get("/financeiro/caixa/saldo")
+async def get_saldo_caixa_em(data: datetime, current_user: User = Depends(get_current_user)):
+    """Saldo histórico do caixa na data informada"""
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    caixa = await obter_caixa()
+    return {"data": data, "saldo": await saldo_caixa_em(caixa["id"], data)}
 
 
 @api_router.get("/fornecedores", response_model=List[Fornecedor])
-async def get_fornecedores(categoria: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_fornecedores(request: Request, response: Response, categoria: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    nao_modificada = await lista_nao_modificada(request, response, "fornecedores", categoria)
+    if nao_modificada:
+        return nao_modificada
+    
     filter_query = {}
     if categoria and categoria != "todos":
         filter_query["categoria"] = categoria
     
     fornecedores = await db.fornecedores.find(filter_query, {"_id": 0}).to_list(1000)
-    for forn in fornecedores:
-        if isinstance(forn.get("created_at"), str):
-            forn["created_at"] = datetime.fromisoformat(forn["created_at"])
-    return fornecedores
+    return resposta_lista(Fornecedor, fornecedores, response)
 
 
 @api_router.post("/fornecedores", response_model=Fornecedor)
@@ -2205,16 +3766,16 @@ async def create_fornecedor(forn_data: FornecedorCreate, current_user: User = De
     import uuid
     forn_id = str(uuid.uuid4())
     
-    count = await db.fornecedores.count_documents({})
-    codigo = f"FORN-{count + 1:06d}"
+    codigo = await proximo_numero("fornecedores", "codigo", "FORN", 6)
     
     forn_doc = forn_data.model_dump()
     forn_doc["id"] = forn_id
     forn_doc["codigo"] = codigo
-    forn_doc["created_at"] = datetime.now(timezone.utc).isoformat()
+    forn_doc["created_at"] = datetime.now(timezone.utc)
     
     await db.fornecedores.insert_one(forn_doc)
-    forn_doc["created_at"] = datetime.fromisoformat(forn_doc["created_at"])
+    await incrementar_versao("fornecedores")
+    indexar_busca("fornecedores", forn_doc)
     return Fornecedor(**forn_doc)
 
 
@@ -2226,10 +3787,10 @@ async def update_fornecedor(fornecedor_id: str, forn_data: FornecedorCreate, cur
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Fornecedor not found")
+    await incrementar_versao("fornecedores")
     
     forn = await db.fornecedores.find_one({"id": fornecedor_id}, {"_id": 0})
-    if isinstance(forn.get("created_at"), str):
-        forn["created_at"] = datetime.fromisoformat(forn["created_at"])
+    indexar_busca("fornecedores", forn)
     return Fornecedor(**forn)
 
 
@@ -2238,354 +3799,845 @@ async def delete_fornecedor(fornecedor_id: str, current_user: User = Depends(get
     result = await db.fornecedores.delete_one({"id": fornecedor_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Fornecedor not found")
+    await incrementar_versao("fornecedores")
+    remover_busca("fornecedores", fornecedor_id)
     return {"message": "Fornecedor deleted"}
 
 
 @api_router.get("/vendedores", response_model=List[Vendedor])
-async def get_vendedores(current_user: User = Depends(get_current_user)):
+async def get_vendedores(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    nao_modificada = await lista_nao_modificada(request, response, "vendedores")
+    if nao_modificada:
+        return nao_modificada
     vendedores = await db.vendedores.find({}, {"_id": 0}).to_list(1000)
-    for vend in vendedores:
-        if isinstance(vend.get("created_at"), str):
-            vend["created_at"] = datetime.fromisoformat(vend["created_at"])
-    return vendedores
-
-
-async def verificar_nivel_presidente(current_user: User):
-    """Verifica se o usuário atual tem nível Presidente"""
-    # Buscar o vendedor pelo email do usuário logado
-    vendedor = await db.vendedores.find_one({"email": current_user.email}, {"_id": 0})
-    
-    if not vendedor:
-        # Se não for vendedor cadastrado, verificar se é o admin/primeiro usuário
-        # ou simplesmente negar acesso
-        raise HTTPException(
-            status_code=403, 
-            detail="Acesso negado. Você precisa ser um vendedor com nível Presidente para realizar esta ação."
-        )
-    
-    if vendedor.get("nivel_acesso", "").lower() != "presidente":
-        raise HTTPException(
-            status_code=403, 
-            detail=f"Acesso negado. Apenas usuários com nível 'Presidente' podem realizar esta ação. Seu nível atual: {vendedor.get('nivel_acesso', 'Não definido')}"
-        )
-    
-    return vendedor
+    return resposta_lista(Vendedor, vendedores, response)
 
 
 @api_router.get("/vendedores/me")
-async def get_current_vendedor(current_user: User = Depends(get_current_user)):
+async def get_current_vendedor(perfil: PerfilAcesso = Depends(obter_perfil)):
     """Retorna informações do vendedor atual logado"""
-    vendedor = await db.vendedores.find_one({"email": current_user.email}, {"_id": 0})
-    if vendedor:
-        if isinstance(vendedor.get("created_at"), str):
-            vendedor["created_at"] = datetime.fromisoformat(vendedor["created_at"])
-        return {"vendedor": vendedor, "is_presidente": vendedor.get("nivel_acesso", "").lower() == "presidente"}
-    return {"vendedor": None, "is_presidente": False}
+    return {"vendedor": perfil.vendedor, "is_presidente": perfil.is_presidente}
 
 
 @api_router.post("/vendedores", response_model=Vendedor)
-async def create_vendedor(vend_data: VendedorCreate, current_user: User = Depends(get_current_user)):
-    # Verificar se é Presidente (apenas Presidente pode criar vendedores)
-    await verificar_nivel_presidente(current_user)
-    
+async def create_vendedor(vend_data: VendedorCreate, perfil: PerfilAcesso = Depends(verificar_nivel_presidente)):
+    # Apenas Presidente pode criar vendedores
     import uuid
     vend_id = str(uuid.uuid4())
     
-    count = await db.vendedores.count_documents({})
-    codigo = f"VEND-{count + 1:06d}"
+    codigo = await proximo_numero("vendedores", "codigo", "VEND", 6)
     
     vend_doc = vend_data.model_dump()
     vend_doc["id"] = vend_id
     vend_doc["codigo"] = codigo
-    vend_doc["created_at"] = datetime.now(timezone.utc).isoformat()
+    vend_doc["created_at"] = datetime.now(timezone.utc)
     
     await db.vendedores.insert_one(vend_doc)
-    vend_doc["created_at"] = datetime.fromisoformat(vend_doc["created_at"])
+    await incrementar_versao("vendedores")
+    perfil_cache.limpar()
     return Vendedor(**vend_doc)
 
 
 @api_router.put("/vendedores/{vendedor_id}", response_model=Vendedor)
-async def update_vendedor(vendedor_id: str, vend_data: VendedorCreate, current_user: User = Depends(get_current_user)):
-    # Verificar se é Presidente (apenas Presidente pode alterar vendedores/níveis)
-    await verificar_nivel_presidente(current_user)
-    
+async def update_vendedor(vendedor_id: str, vend_data: VendedorCreate, perfil: PerfilAcesso = Depends(verificar_nivel_presidente)):
+    # Apenas Presidente pode alterar vendedores/níveis
     result = await db.vendedores.update_one(
         {"id": vendedor_id},
         {"$set": vend_data.model_dump()}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Vendedor not found")
+    await incrementar_versao("vendedores")
+    # Email e nível podem ter mudado; o antigo dono do email também precisa ser reavaliado
+    perfil_cache.limpar()
     
     vend = await db.vendedores.find_one({"id": vendedor_id}, {"_id": 0})
-    if isinstance(vend.get("created_at"), str):
-        vend["created_at"] = datetime.fromisoformat(vend["created_at"])
     return Vendedor(**vend)
 
 
 @api_router.delete("/vendedores/{vendedor_id}")
-async def delete_vendedor(vendedor_id: str, current_user: User = Depends(get_current_user)):
-    # Verificar se é Presidente (apenas Presidente pode excluir vendedores)
-    await verificar_nivel_presidente(current_user)
-    
+async def delete_vendedor(vendedor_id: str, perfil: PerfilAcesso = Depends(verificar_nivel_presidente)):
+    # Apenas Presidente pode excluir vendedores
     result = await db.vendedores.delete_one({"id": vendedor_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Vendedor not found")
+    await incrementar_versao("vendedores")
+    perfil_cache.limpar()
     return {"message": "Vendedor deleted"}
 
 
+@api_router.get("/clientes/{cliente_id}", response_model=Cliente)
+async def get_cliente(cliente_id: str, current_user: User = Depends(get_current_user)):
+    """Cliente completo, com o resumo_compras que a listagem não traz"""
+    cliente = await db.clientes.find_one({"id": cliente_id}, {"_id": 0, "historico": 0})
+    if not cliente:
+        raise HTTPException(status_code=404, detail="Cliente not found")
+    return Cliente(**cliente)
+
+
 @api_router.get("/clientes/codigo/{codigo}", response_model=Cliente)
 async def get_cliente_by_codigo(codigo: str, current_user: User = Depends(get_current_user)):
-    cliente = await db.clientes.find_one({"codigo": codigo}, {"_id": 0})
+    cliente = await db.clientes.find_one({"codigo": codigo}, {"_id": 0, "historico": 0})
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente not found")
-    if isinstance(cliente.get("created_at"), str):
-        cliente["created_at"] = datetime.fromisoformat(cliente["created_at"])
     return Cliente(**cliente)
 
 
-@api_router.get("/relatorios/geral")
-async def get_relatorio_geral(
-    data_inicio: Optional[str] = None,
-    data_fim: Optional[str] = None,
+# ==================== HISTÓRICO DE COMPRAS ====================
+# O histórico de compras do cliente é lido de pedidos (índice cliente_id, data, id) e paginado
+# em /clientes/{id}/historico. O cliente guarda só resumo_compras, mantido com $inc/$max a
+# cada pedido criado, alterado ou excluído, em vez de um array historico que crescia sem limite.
+# O resumo fica fora de GET /clientes, então escrever pedidos não muda a versão da lista.
+
+RESUMO_COMPRAS_VAZIO = {"quantidade_pedidos": 0, "valor_total": 0, "ultimo_pedido": None}
+
+
+async def aplicar_resumo_cliente(pedido: Dict[str, Any], sinal: int = 1):
+    """Soma (sinal=1) ou remove (sinal=-1) um pedido do resumo_compras do cliente"""
+    cliente_id = pedido.get("cliente_id")
+    if not cliente_id:
+        return
+    atualizacao: Dict[str, Any] = {"$inc": {
+        "resumo_compras.quantidade_pedidos": sinal,
+        "resumo_compras.valor_total": sinal * (pedido.get("valor_total_venda") or 0),
+    }}
+    if sinal > 0 and pedido.get("data"):
+        atualizacao["$max"] = {"resumo_compras.ultimo_pedido": pedido["data"]}
+    cliente = await db.clientes.find_one_and_update(
+        {"id": cliente_id},
+        atualizacao,
+        projection={"_id": 0, "resumo_compras": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if cliente is None:
+        return
+    ultimo = (cliente.get("resumo_compras") or {}).get("ultimo_pedido")
+    if sinal < 0 and ultimo is not None and ultimo == pedido.get("data"):
+        # Saiu o pedido mais recente: o anterior vem do índice. A guarda em ultimo_pedido
+        # evita sobrescrever um pedido novo registrado no meio tempo
+        anterior = await db.pedidos.find_one(
+            {"cliente_id": cliente_id}, {"_id": 0, "data": 1}, sort=[("data", -1), ("id", -1)]
+        )
+        await db.clientes.update_one(
+            {"id": cliente_id, "resumo_compras.ultimo_pedido": ultimo},
+            {"$set": {"resumo_compras.ultimo_pedido": anterior["data"] if anterior else None}}
+        )
+
+
+async def reconstruir_resumos_clientes() -> int:
+    """Recalcula resumo_compras de todos os clientes a partir de pedidos.
+    
+    O $merge sobrescreve com um retrato de pedidos: $inc de pedidos gravados durante a
+    agregação se perdem. Roda só pela CLI (rebuild-client-summaries) ou dentro da migração
+    de schema, que tem a trava de execução única (ver executar_uma_vez).
+    """
+    await db.pedidos.aggregate([
+        {"$match": {"cliente_id": {"$type": "string"}}},
+        {"$group": {
+            "_id": "$cliente_id",
+            "quantidade_pedidos": {"$sum": 1},
+            "valor_total": {"$sum": "$valor_total_venda"},
+            "ultimo_pedido": {"$max": "$data"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": "$_id",
+            "resumo_compras": {
+                "quantidade_pedidos": "$quantidade_pedidos",
+                "valor_total": "$valor_total",
+                "ultimo_pedido": "$ultimo_pedido",
+            },
+        }},
+        {"$merge": {"into": "clientes", "on": "id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ]).to_list(None)
+    # Clientes sem pedidos (ou cujo resumo ficou de uma reconstrução anterior)
+    com_pedidos = await db.pedidos.distinct("cliente_id")
+    await db.clientes.update_many(
+        {"id": {"$nin": com_pedidos}},
+        {"$set": {"resumo_compras": RESUMO_COMPRAS_VAZIO}}
+    )
+    return await db.clientes.count_documents({})
+
+
+async def migrar_historico_clientes() -> int:
+    """Troca o array clientes.historico pelo resumo_compras calculado a partir de pedidos"""
+    if not await db.clientes.find_one({"historico": {"$exists": True}}, {"_id": 1}):
+        return 0
+    await reconstruir_resumos_clientes()
+    result = await db.clientes.update_many({"historico": {"$exists": True}}, {"$unset": {"historico": ""}})
+    if result.modified_count:
+        logger.info(f"Histórico embutido removido de {result.modified_count} clientes")
+    return result.modified_count
+
+
+@api_router.get("/clientes/{cliente_id}/historico")
+async def get_historico_cliente(
+    cliente_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """Pedidos do cliente, mais recentes primeiro, com paginação por cursor (header X-Next-Cursor)"""
+    if not await db.clientes.find_one({"id": cliente_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Cliente not found")
+    
+    filtros: List[Dict[str, Any]] = [{"cliente_id": cliente_id}]
+    if cursor:
+        ultimo = _decodificar_cursor(cursor)
+        filtros.append({"$or": [
+            {"data": {"$lt": ultimo["data"]}},
+            {"data": ultimo["data"], "id": {"$lt": ultimo["id"]}}
+        ]})
+    
+    pedidos = await db.pedidos.find(
+        {"$and": filtros},
+        {"_id": 0, "id": 1, "numero": 1, "data": 1, "valor_total_venda": 1, "vendedor": 1, "status": 1}
+    ).sort([("data", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    
+    if len(pedidos) > limit:
+        pedidos = pedidos[:limit]
+        response.headers["X-Next-Cursor"] = _codificar_cursor({"data": pedidos[-1]["data"], "id": pedidos[-1]["id"]})
+    
+    return [
+        {
+            "pedido_id": p["id"],
+            "numero": p.get("numero"),
+            "data": p.get("data"),
+            "valor": p.get("valor_total_venda", 0),
+            "vendedor": p.get("vendedor"),
+            "status": p.get("status"),
+        }
+        for p in pedidos
+    ]
+
+
+# ==================== BUSCA ====================
+# GET /search?q= faz busca por prefixo, sem acentos e tolerante a erros de digitação em
+# clientes, produtos e fornecedores, para os seletores consultarem o servidor em vez de
+# baixar as listas inteiras. Cada processo mantém um índice de trigramas em memória
+# (IndiceBusca), atualizado nas gravações feitas por ele. Gravações de outros workers são
+# detectadas pelo contador da coleção em versoes (ver incrementar_versao): o índice guarda a
+# versão lida antes de carregar e é reconstruído quando ela muda, tanto na própria busca
+# quanto a cada BUSCA_VERIFICAR_SEGUNDOS. Se a reconstrução passar de BUSCA_ESPERA (ou o
+# índice ainda não foi carregado), a busca usa o índice de texto do Mongo.
+
+BUSCA_ESPERA = float(os.environ.get("BUSCA_ESPERA_SEGUNDOS", "2"))
+
+BUSCA_FONTES: Dict[str, Dict[str, Any]] = {
+    "clientes": {
+        "tipo": "cliente",
+        "campos": ["codigo", "nome", "razao_social", "nome_fantasia", "cpf_cnpj"],
+        "documento": "cpf_cnpj",
+        "rotulo": ["nome", "razao_social"],
+        "resumo": ["id", "codigo", "nome", "razao_social", "nome_fantasia", "cpf_cnpj", "cidade", "estado"],
+    },
+    "produtos": {
+        "tipo": "produto",
+        "campos": ["codigo", "descricao"],
+        "documento": None,
+        "rotulo": ["descricao"],
+        "resumo": ["id", "codigo", "descricao", "preco_compra", "preco_venda", "margem", "fornecedor", "variacoes"],
+    },
+    "fornecedores": {
+        "tipo": "fornecedor",
+        "campos": ["codigo", "razao_social", "nome_fantasia", "cnpj_cpf"],
+        "documento": "cnpj_cpf",
+        "rotulo": ["nome_fantasia", "razao_social"],
+        "resumo": ["id", "codigo", "razao_social", "nome_fantasia", "cnpj_cpf", "categoria", "cidade", "estado"],
+    },
+}
+BUSCA_TIPOS = {fonte["tipo"]: colecao for colecao, fonte in BUSCA_FONTES.items()}
+
+
+def normalizar_busca(texto: Any) -> str:
+    """Minúsculas, sem acentos e só com letras e dígitos separados por espaço"""
+    sem_acento = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", " ", sem_acento.lower()).strip()
+
+
+def _trigramas(token: str, prefixo: bool = False) -> Set[str]:
+    # Sem o espaço final, os trigramas de um termo são um subconjunto dos de qualquer
+    # palavra que comece com ele: é isso que faz a busca por prefixo
+    marcado = "  " + token + ("" if prefixo else " ")
+    return {marcado[i:i + 3] for i in range(len(marcado) - 2)}
+
+
+def _tolerancia(termo: str) -> int:
+    """Erros de digitação aceitos conforme o tamanho do termo"""
+    if len(termo) < 4:
+        return 0
+    return 1 if len(termo) < 8 else 2
+
+
+def _distancia(a: str, b: str, limite: int) -> int:
+    """Distância de Damerau-Levenshtein (transposições contam 1), interrompida acima de limite"""
+    anterior2 = None
+    anterior = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        atual = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            custo = 0 if a[i - 1] == b[j - 1] else 1
+            atual[j] = min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + custo)
+            if anterior2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                atual[j] = min(atual[j], anterior2[j - 2] + 1)
+        if min(atual) > limite:
+            return limite + 1
+        anterior2, anterior = anterior, atual
+    return anterior[-1]
+
+
+def _pontuar(termo: str, token: str) -> float:
+    if token == termo:
+        return 1.0
+    if token.startswith(termo):
+        return 0.8
+    tolerancia = _tolerancia(termo)
+    if not tolerancia:
+        return 0.0
+    # Compara com o início da palavra, aceitando uma letra a mais ou a menos
+    distancia = min(
+        _distancia(termo, token[:len(termo) + delta], tolerancia)
+        for delta in (-1, 0, 1) if len(termo) + delta > 0
+    )
+    return 0.6 - 0.1 * distancia if distancia <= tolerancia else 0.0
+
+
+def _entrada_busca(colecao: str, doc: Dict[str, Any]) -> Tuple[List[Tuple[str, float]], Dict[str, Any]]:
+    """Tokens (com peso) e resumo devolvido na busca para um documento"""
+    fonte = BUSCA_FONTES[colecao]
+    tokens: Dict[str, float] = {}
+    for campo in fonte["campos"]:
+        peso = 2.0 if campo in ("codigo", fonte["documento"]) else 1.0
+        for token in normalizar_busca(doc.get(campo)).split():
+            tokens[token] = max(tokens.get(token, 0.0), peso)
+    # CPF/CNPJ sem pontuação e número do código sem prefixo nem zeros ("CLI000123" -> "123")
+    documento = re.sub(r"\D", "", str(doc.get(fonte["documento"]) or "")) if fonte["documento"] else ""
+    numero_codigo = re.sub(r"\D", "", str(doc.get("codigo") or "")).lstrip("0")
+    for extra in (documento, numero_codigo):
+        if extra:
+            tokens[extra] = 2.0
+    resumo = {campo: doc.get(campo) for campo in fonte["resumo"]}
+    resumo["rotulo"] = next((doc[c] for c in fonte["rotulo"] if doc.get(c)), doc.get("codigo", ""))
+    return list(tokens.items()), resumo
+
+
+class IndiceBusca:
+    """Índice de trigramas em memória de uma coleção"""
+    
+    def __init__(self):
+        self.pronto = False
+        self.versao: Optional[Tuple[Any, int]] = None
+        self.tokens: Dict[str, List[Tuple[str, float]]] = {}
+        self.resumos: Dict[str, Dict[str, Any]] = {}
+        self.trigramas: Dict[str, Set[str]] = defaultdict(set)
+    
+    def adicionar(self, doc_id: str, tokens: List[Tuple[str, float]], resumo: Dict[str, Any]):
+        self.remover(doc_id)
+        self.tokens[doc_id] = tokens
+        self.resumos[doc_id] = resumo
+        for token, _ in tokens:
+            for trigrama in _trigramas(token):
+                self.trigramas[trigrama].add(doc_id)
+    
+    def remover(self, doc_id: str):
+        for token, _ in self.tokens.pop(doc_id, []):
+            for trigrama in _trigramas(token):
+                ids = self.trigramas.get(trigrama)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del self.trigramas[trigrama]
+        self.resumos.pop(doc_id, None)
+    
+    def buscar(self, termos: List[str], limite: int) -> List[Tuple[float, str]]:
+        """(score, id) dos melhores documentos que casam com todos os termos"""
+        candidatos: Optional[Set[str]] = None
+        for termo in termos:
+            trigramas = _trigramas(termo, prefixo=True)
+            contagem = Counter()
+            for trigrama in trigramas:
+                contagem.update(self.trigramas.get(trigrama, ()))
+            # Troca, inserção ou remoção de uma letra derruba até 3 trigramas; a transposição
+            # de duas letras vizinhas ("mecrado"), até 4
+            exigido = max(1, len(trigramas) - 4 * _tolerancia(termo))
+            ids = {doc_id for doc_id, n in contagem.items() if n >= exigido}
+            candidatos = ids if candidatos is None else candidatos & ids
+            if not candidatos:
+                return []
+        
+        pontuados = []
+        for doc_id in candidatos or ():
+            score = 0.0
+            for termo in termos:
+                melhor = max((_pontuar(termo, token) * peso for token, peso in self.tokens[doc_id]), default=0.0)
+                if not melhor:
+                    break
+                score += melhor
+            else:
+                pontuados.append((score, doc_id))
+        return heapq.nlargest(limite, pontuados)
+
+
+indices_busca: Dict[str, IndiceBusca] = {colecao: IndiceBusca() for colecao in BUSCA_FONTES}
+# ids gravados durante uma reconstrução, reaplicados no índice novo ao final
+_busca_reconstruindo: Dict[str, Set[str]] = {}
+# Reconstrução em andamento por coleção: buscas simultâneas esperam a mesma
+_tarefas_busca: Dict[str, asyncio.Task] = {}
+
+
+def _projecao_busca(colecao: str) -> Dict[str, int]:
+    fonte = BUSCA_FONTES[colecao]
+    return {"_id": 0, **{campo: 1 for campo in set(fonte["campos"]) | set(fonte["resumo"]) | set(fonte["rotulo"])}}
+
+
+def indexar_busca(colecao: str, doc: Dict[str, Any]):
+    """Atualiza o índice de busca depois de inserir ou alterar um documento"""
+    if colecao in _busca_reconstruindo:
+        _busca_reconstruindo[colecao].add(doc["id"])
+    indices_busca[colecao].adicionar(doc["id"], *_entrada_busca(colecao, doc))
+
+
+def remover_busca(colecao: str, doc_id: str):
+    if colecao in _busca_reconstruindo:
+        _busca_reconstruindo[colecao].add(doc_id)
+    indices_busca[colecao].remover(doc_id)
+
+
+async def _versoes_busca(colecoes: List[str]) -> Dict[str, Tuple[Any, int]]:
+    docs = {d["_id"]: d async for d in db.versoes.find({"_id": {"$in": colecoes}})}
+    return {c: (docs.get(c, {}).get("epoca"), docs.get(c, {}).get("versao", 0)) for c in colecoes}
+
+
+async def reconstruir_busca(colecao: str) -> int:
+    """Recarrega o índice de busca da coleção a partir do banco"""
+    _busca_reconstruindo[colecao] = set()
+    try:
+        novo = IndiceBusca()
+        # Lida antes dos documentos: uma gravação durante a carga deixa o índice desatualizado
+        # e a próxima verificação reconstrói de novo
+        novo.versao = (await _versoes_busca([colecao]))[colecao]
+        async for doc in db[colecao].find({}, _projecao_busca(colecao)):
+            if doc.get("id"):
+                novo.adicionar(doc["id"], *_entrada_busca(colecao, doc))
+        novo.pronto = True
+        indices_busca[colecao] = novo
+    finally:
+        alterados = _busca_reconstruindo.pop(colecao, set())
+    for doc_id in alterados:
+        doc = await db[colecao].find_one({"id": doc_id}, _projecao_busca(colecao))
+        if doc:
+            indexar_busca(colecao, doc)
+        else:
+            remover_busca(colecao, doc_id)
+    return len(novo.tokens)
+
+
+def _agendar_reconstrucao_busca(colecao: str) -> asyncio.Task:
+    tarefa = _tarefas_busca.get(colecao)
+    if tarefa is None or tarefa.done():
+        tarefa = asyncio.create_task(reconstruir_busca(colecao))
+        # Falhas aparecem no log mesmo quando nenhuma busca espera a tarefa até o fim
+        tarefa.add_done_callback(
+            lambda t: t.cancelled() or t.exception() is None
+            or logger.error(f"Falha ao reconstruir o índice de busca de {colecao}: {t.exception()}")
+        )
+        _tarefas_busca[colecao] = tarefa
+    return tarefa
+
+
+async def _indice_atualizado(colecao: str, versao: Tuple[Any, int]) -> bool:
+    """Garante o índice na versão informada, esperando a reconstrução até BUSCA_ESPERA"""
+    indice = indices_busca[colecao]
+    if indice.pronto and indice.versao == versao:
+        return True
+    try:
+        await asyncio.wait_for(asyncio.shield(_agendar_reconstrucao_busca(colecao)), BUSCA_ESPERA)
+    except Exception:
+        # Tempo esgotado ou falha (já registrada pela tarefa): fica para o índice de texto
+        return False
+    indice = indices_busca[colecao]
+    return indice.pronto and indice.versao == versao
+
+
+async def loop_reconstrucao_busca():
+    # Mantém o índice de workers ociosos em dia; a busca também verifica a versão antes de usar
+    intervalo = float(os.environ.get("BUSCA_VERIFICAR_SEGUNDOS", "10"))
+    while True:
+        try:
+            for colecao, versao in (await _versoes_busca(list(BUSCA_FONTES))).items():
+                indice = indices_busca[colecao]
+                if not indice.pronto or indice.versao != versao:
+                    await _agendar_reconstrucao_busca(colecao)
+        except Exception as e:
+            logger.error(f"Falha ao reconstruir o índice de busca: {e}")
+        await asyncio.sleep(intervalo)
+
+
+async def _buscar_texto(colecao: str, q: str, limite: int) -> List[Tuple[float, Dict[str, Any]]]:
+    """Busca pelo índice de texto do Mongo (palavras inteiras), usada antes do índice em memória carregar"""
+    try:
+        docs = await db[colecao].find(
+            {"$text": {"$search": q}},
+            {**_projecao_busca(colecao), "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).to_list(limite)
+    except Exception as e:
+        logger.warning(f"Busca por texto indisponível em {colecao}: {e}")
+        return []
+    return [(doc.pop("score"), _entrada_busca(colecao, doc)[1]) for doc in docs]
+
+
+@api_router.get("/search")
+async def buscar_cadastros(
+    q: str = Query(..., min_length=1),
+    tipos: Optional[str] = Query(None, description="cliente,produto,fornecedor (padrão: todos)"),
+    limite: int = Query(20, ge=1, le=50),
+    current_user: User = Depends(get_current_user)
+):
+    """Busca por prefixo, sem acentos e tolerante a erros em clientes, produtos e fornecedores"""
+    colecoes = list(BUSCA_FONTES)
+    if tipos:
+        invalidos = [t for t in tipos.split(",") if t.strip() not in BUSCA_TIPOS]
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"Tipo inválido: {invalidos}. Use: {list(BUSCA_TIPOS)}")
+        colecoes = [BUSCA_TIPOS[t.strip()] for t in tipos.split(",")]
+    
+    termos = normalizar_busca(q).split()
+    if not termos:
+        return []
+    
+    resultados = []
+    versoes = await _versoes_busca(colecoes)
+    for colecao in colecoes:
+        if await _indice_atualizado(colecao, versoes[colecao]):
+            indice = indices_busca[colecao]
+            encontrados = [(score, indice.resumos[doc_id]) for score, doc_id in indice.buscar(termos, limite)]
+        else:
+            encontrados = await _buscar_texto(colecao, q, limite)
+        tipo = BUSCA_FONTES[colecao]["tipo"]
+        resultados.extend({"tipo": tipo, "score": round(score, 3), **resumo} for score, resumo in encontrados)
+    
+    resultados.sort(key=lambda r: (-r["score"], str(r.get("rotulo") or "")))
+    return resultados[:limite]
+
+
+def _filtros_relatorio(
+    data_inicio: Optional[date],
+    data_fim: Optional[date],
     cliente_id: Optional[str] = None,
     vendedor: Optional[str] = None,
     segmento: Optional[str] = None,
-    cidade: Optional[str] = None,
     status: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    """Relatório geral com dados fiéis aos pedidos"""
-    # Build filter for pedidos
+    cidade: Optional[str] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Monta os filtros de pedidos, orçamentos, licitações e despesas usados pelos relatórios"""
     filter_pedidos = {}
+    filter_orcamentos = {}
+    filter_licitacoes = {}
+    filter_despesas = {}
+    
     if data_inicio and data_fim:
-        # Ajustar data_fim para incluir o dia inteiro (até 23:59:59)
-        data_inicio_iso = datetime.fromisoformat(data_inicio).replace(hour=0, minute=0, second=0).isoformat()
-        data_fim_iso = datetime.fromisoformat(data_fim).replace(hour=23, minute=59, second=59).isoformat()
-        filter_pedidos["data"] = {
-            "$gte": data_inicio_iso,
-            "$lte": data_fim_iso
-        }
+        # O dia final entra inteiro: o limite superior é o início do dia seguinte
+        periodo = filtro_periodo(data_inicio, data_fim)
+        filter_pedidos["data"] = dict(periodo)
+        filter_orcamentos["data"] = dict(periodo)
+        filter_licitacoes["data_empenho"] = dict(periodo)
+        filter_despesas["data_despesa"] = dict(periodo)
     if cliente_id:
         filter_pedidos["cliente_id"] = cliente_id
+        filter_orcamentos["cliente_id"] = cliente_id
     if vendedor:
         filter_pedidos["vendedor"] = vendedor
+        filter_orcamentos["vendedor"] = vendedor
     if segmento and segmento != "todos":
         filter_pedidos["tipo_venda"] = segmento
     if status and status != "todos":
         filter_pedidos["status"] = status
-    
-    # Build filter for licitações
-    filter_licitacoes = {}
-    if data_inicio and data_fim:
-        data_inicio_iso = datetime.fromisoformat(data_inicio).replace(hour=0, minute=0, second=0).isoformat()
-        data_fim_iso = datetime.fromisoformat(data_fim).replace(hour=23, minute=59, second=59).isoformat()
-        filter_licitacoes["data_empenho"] = {
-            "$gte": data_inicio_iso,
-            "$lte": data_fim_iso
-        }
     if cidade:
         filter_licitacoes["cidade"] = {"$regex": cidade, "$options": "i"}
     
-    # Build filter for despesas
-    filter_despesas = {}
-    if data_inicio and data_fim:
-        data_inicio_iso = datetime.fromisoformat(data_inicio).replace(hour=0, minute=0, second=0).isoformat()
-        data_fim_iso = datetime.fromisoformat(data_fim).replace(hour=23, minute=59, second=59).isoformat()
-        filter_despesas["data_despesa"] = {
-            "$gte": data_inicio_iso,
-            "$lte": data_fim_iso
-        }
-    
-    # Fetch data
-    pedidos = await db.pedidos.find(filter_pedidos, {"_id": 0}).to_list(1000)
+    return {
+        "pedidos": filter_pedidos,
+        "orcamentos": filter_orcamentos,
+        "licitacoes": filter_licitacoes,
+        "despesas": filter_despesas,
+    }
+
+
+def _pipeline_pedidos_com_cidade(
+    filter_pedidos: Dict[str, Any],
+    cidade: Optional[str],
+    sort: Optional[List[Tuple[str, int]]] = None
+) -> List[Dict[str, Any]]:
+    """$match dos pedidos + cidade do pedido.
+
+    A cidade é a gravada no pedido (cliente_cidade), a mesma usada pelos rollups; só pedidos
+    antigos sem o campo usam a cidade atual do cliente, via $lookup. localField/foreignField
+    usa o índice clientes.id em qualquer versão do servidor (o $lookup com let/pipeline/$expr
+    não usa antes do 5.0); o documento do cliente é descartado logo depois de extrair a cidade. O $sort, quando pedido, vem logo após
+    o $match para usar o índice em vez de ordenar tudo em memória depois do $lookup.
+    """
+    pipeline: List[Dict[str, Any]] = [{"$match": filter_pedidos}]
+    if sort:
+        pipeline.append({"$sort": dict(sort)})
+    pipeline += [
+        {"$lookup": {"from": "clientes", "localField": "cliente_id", "foreignField": "id", "as": "cliente"}},
+        {"$addFields": {"cliente_cidade": {"$cond": [
+            {"$eq": [{"$type": "$cliente_cidade"}, "missing"]},
+            {"$arrayElemAt": ["$cliente.cidade", 0]},
+            "$cliente_cidade",
+        ]}}},
+        {"$project": {"cliente": 0}},
+    ]
+    if cidade:
+        pipeline.append({"$match": {"cliente_cidade": {"$regex": cidade, "$options": "i"}}})
+    return pipeline
+
+
+def _cidade_agrupamento(campo: str) -> Dict[str, Any]:
+    """Cidade vazia ou ausente vira "Não informada", como em chave_rollup_pedido/_licitacao"""
+    return {"$cond": [{"$eq": [{"$ifNull": [campo, ""]}, ""]}, "Não informada", campo]}
+
+
+def _soma_despesas_detalhadas(repassar: Optional[bool] = None) -> Dict[str, Any]:
+    """Expressão que soma despesas_detalhadas.valor de um pedido (opcionalmente só repassadas/internas)"""
+    despesas = {"$ifNull": ["$despesas_detalhadas", []]}
+    if repassar is not None:
+        cond = {"$eq": [{"$ifNull": ["$$d.repassar", False]}, True]}
+        despesas = {"$filter": {"input": despesas, "as": "d", "cond": cond if repassar else {"$not": [cond]}}}
+    return {"$sum": {"$map": {"input": despesas, "as": "d", "in": {"$ifNull": ["$$d.valor", 0]}}}}
+
+
+def _mes_ano(campo: str) -> Dict[str, Any]:
+    """Chave YYYY-MM de um campo de data armazenado como string ISO ou como data BSON"""
+    return {"$cond": [
+        {"$eq": [{"$type": campo}, "string"]},
+        {"$substrCP": [campo, 0, 7]},
+        {"$dateToString": {"format": "%Y-%m", "date": campo}}
+    ]}
+
+
+def _agrupamento(resultado: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Converte a saída de um $group ({_id, ...}) no dicionário chaveado usado pela resposta"""
+    return {r.pop("_id"): r for r in resultado}
+
+
+@api_router.get("/relatorios/geral")
+async def get_relatorio_geral(
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    cliente_id: Optional[str] = None,
+    vendedor: Optional[str] = None,
+    segmento: Optional[str] = None,
+    cidade: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Relatório geral com dados fiéis aos pedidos.
+
+    Os agrupamentos são calculados no MongoDB com um $facet por coleção; apenas os
+    resultados agregados (e as linhas de pedidos_detalhados) atravessam a rede.
+    """
+    filtros = _filtros_relatorio(data_inicio, data_fim, cliente_id, vendedor, segmento, status, cidade)
     
     # If segmento is "licitacao", only get licitações, otherwise filter based on segmento
-    if segmento == "licitacao":
-        licitacoes = await db.licitacoes.find(filter_licitacoes, {"_id": 0}).to_list(1000)
-        pedidos = []  # Clear pedidos when filtering by licitação
-    elif segmento and segmento != "todos":
-        licitacoes = []  # Clear licitações when filtering by other segments
-    else:
-        licitacoes = await db.licitacoes.find(filter_licitacoes, {"_id": 0}).to_list(1000)
+    incluir_pedidos = segmento != "licitacao"
+    incluir_licitacoes = not segmento or segmento in ("todos", "licitacao")
+    
+    base_pedidos = _pipeline_pedidos_com_cidade(filtros["pedidos"], cidade)
+    
+    pipeline_pedidos = base_pedidos + [{"$facet": {
+        "totais": [{"$group": {
+            "_id": None,
+            "quantidade": {"$sum": 1},
+            "faturado": {"$sum": "$valor_total_venda"},
+            "custo": {"$sum": "$custo_total"},
+            "lucro": {"$sum": "$lucro_total"},
+            "frete": {"$sum": "$frete"},
+            "frete_repassado": {"$sum": {"$cond": [{"$eq": [{"$ifNull": ["$repassar_frete", False]}, True]}, {"$ifNull": ["$frete", 0]}, 0]}},
+            "despesas": {"$sum": _soma_despesas_detalhadas()},
+            "despesas_repassadas": {"$sum": _soma_despesas_detalhadas(repassar=True)},
+            "despesas_internas": {"$sum": _soma_despesas_detalhadas(repassar=False)},
+        }}],
+        "por_segmento": [{"$group": {
+            "_id": {"$ifNull": ["$tipo_venda", "outros"]},
+            "quantidade": {"$sum": 1},
+            "faturamento": {"$sum": "$valor_total_venda"},
+            "lucro": {"$sum": "$lucro_total"},
+            "custo": {"$sum": "$custo_total"},
+        }}],
+        "por_status": [{"$group": {
+            "_id": {"$ifNull": ["$status", "pendente"]},
+            "quantidade": {"$sum": 1},
+            "faturamento": {"$sum": "$valor_total_venda"},
+            "lucro": {"$sum": "$lucro_total"},
+        }}],
+        "por_vendedor": [{"$group": {
+            "_id": {"$ifNull": ["$vendedor", "Não informado"]},
+            "quantidade": {"$sum": 1},
+            "faturamento": {"$sum": "$valor_total_venda"},
+            "lucro": {"$sum": "$lucro_total"},
+            "custo": {"$sum": "$custo_total"},
+        }}],
+        "por_cidade": [{"$group": {
+            "_id": _cidade_agrupamento("$cliente_cidade"),
+            "quantidade": {"$sum": 1},
+            "faturamento": {"$sum": "$valor_total_venda"},
+            "lucro": {"$sum": "$lucro_total"},
+        }}],
+        "por_forma_pagamento": [{"$group": {
+            "_id": {"$ifNull": ["$forma_pagamento", "Não informado"]},
+            "quantidade": {"$sum": 1},
+            "faturamento": {"$sum": "$valor_total_venda"},
+        }}],
+        "por_mes": [
+            {"$match": {"data": {"$nin": [None, ""]}}},
+            {"$group": {
+                "_id": _mes_ano("$data"),
+                "quantidade": {"$sum": 1},
+                "faturamento": {"$sum": "$valor_total_venda"},
+                "lucro": {"$sum": "$lucro_total"},
+            }},
+        ],
+    }}]
+    
+    # As linhas do detalhamento ficam fora do $facet: a saída de um $facet é um único
+    # documento (limite de 16 MB) e o detalhamento cresce com o histórico.
+    pipeline_detalhados = base_pedidos + [
+        {"$sort": {"data": -1, "id": -1}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "numero": {"$ifNull": ["$numero", ""]},
+            "data": {"$ifNull": ["$data", ""]},
+            "cliente_nome": {"$ifNull": ["$cliente_nome", ""]},
+            "cliente_cidade": {"$ifNull": ["$cliente_cidade", ""]},
+            "vendedor": {"$ifNull": ["$vendedor", ""]},
+            "status": {"$ifNull": ["$status", "pendente"]},
+            "tipo_venda": {"$ifNull": ["$tipo_venda", ""]},
+            "forma_pagamento": {"$ifNull": ["$forma_pagamento", ""]},
+            "valor_venda": {"$ifNull": ["$valor_total_venda", 0]},
+            "custo_total": {"$ifNull": ["$custo_total", 0]},
+            "lucro": {"$ifNull": ["$lucro_total", 0]},
+            "frete": {"$ifNull": ["$frete", 0]},
+            "repassar_frete": {"$ifNull": ["$repassar_frete", False]},
+            "qtd_itens": {"$size": {"$ifNull": ["$itens", []]}},
+        }},
+    ]
     
-    despesas = await db.despesas.find(filter_despesas, {"_id": 0}).to_list(1000)
+    pipeline_licitacoes = [
+        {"$match": filtros["licitacoes"]},
+        {"$facet": {
+            "totais": [{"$group": {
+                "_id": None,
+                "quantidade": {"$sum": 1},
+                "faturado": {"$sum": "$valor_total_venda"},
+                "custo": {"$sum": "$valor_total_compra"},
+                "lucro": {"$sum": "$lucro_total"},
+            }}],
+            "por_cidade": [{"$group": {
+                "_id": _cidade_agrupamento("$cidade"),
+                "quantidade": {"$sum": 1},
+                "faturamento": {"$sum": "$valor_total_venda"},
+                "lucro": {"$sum": "$lucro_total"},
+            }}],
+            "recentes": [
+                {"$sort": {"data_empenho": -1}},
+                {"$limit": 10},
+                {"$project": {
+                    "_id": 0,
+                    "tipo": "Licitação",
+                    "numero": {"$ifNull": ["$numero_licitacao", ""]},
+                    "cliente_nome": {"$ifNull": ["$orgao_publico", ""]},
+                    "valor_venda": {"$ifNull": ["$valor_total_venda", 0]},
+                    "lucro": {"$ifNull": ["$lucro_total", 0]},
+                    "data": {"$ifNull": ["$data_empenho", ""]},
+                    "status": {"$ifNull": ["$status", ""]},
+                    "tipo_venda": "licitacao",
+                    "vendedor": "-",
+                }},
+            ],
+        }},
+    ]
     
-    # If cidade filter is set, also filter pedidos by cliente cidade
-    if cidade:
-        cliente_ids_in_cidade = []
-        clientes = await db.clientes.find({"cidade": {"$regex": cidade, "$options": "i"}}, {"_id": 0, "id": 1}).to_list(1000)
-        cliente_ids_in_cidade = [c["id"] for c in clientes]
-        pedidos = [p for p in pedidos if p.get("cliente_id") in cliente_ids_in_cidade]
+    pipeline_despesas = [
+        {"$match": filtros["despesas"]},
+        {"$group": {"_id": None, "total": {"$sum": "$valor"}}},
+    ]
+    
+    vazio = [{"totais": [], "por_segmento": [], "por_status": [], "por_vendedor": [], "por_cidade": [],
+              "por_forma_pagamento": [], "por_mes": [], "recentes": []}]
+    
+    async def executar(colecao, pipeline, ativo=True):
+        if not ativo:
+            return vazio
+        return await db[colecao].aggregate(pipeline).to_list(None)
+    
+    res_pedidos, pedidos_detalhados, res_licitacoes, res_despesas = await asyncio.gather(
+        executar("pedidos", pipeline_pedidos, incluir_pedidos),
+        executar("pedidos", pipeline_detalhados, incluir_pedidos),
+        executar("licitacoes", pipeline_licitacoes, incluir_licitacoes),
+        executar("despesas", pipeline_despesas),
+    )
+    if not incluir_pedidos:
+        pedidos_detalhados = []
+    
+    facet_pedidos = res_pedidos[0]
+    facet_licitacoes = res_licitacoes[0]
+    
+    totais_pedidos = facet_pedidos["totais"][0] if facet_pedidos["totais"] else {}
+    totais_licitacoes = facet_licitacoes["totais"][0] if facet_licitacoes["totais"] else {}
     
     # Calculate totals from pedidos - using actual stored values
-    total_faturado_pedidos = sum(p.get("valor_total_venda", 0) for p in pedidos)
-    total_custo_pedidos = sum(p.get("custo_total", 0) for p in pedidos)
-    total_lucro_pedidos = sum(p.get("lucro_total", 0) for p in pedidos)
+    quantidade_pedidos = totais_pedidos.get("quantidade", 0)
+    total_faturado_pedidos = totais_pedidos.get("faturado", 0)
+    total_custo_pedidos = totais_pedidos.get("custo", 0)
+    total_lucro_pedidos = totais_pedidos.get("lucro", 0)
     
-    # Calculate despesas detalhadas from pedidos
-    total_frete_pedidos = sum(p.get("frete", 0) for p in pedidos)
-    total_frete_repassado = sum(p.get("frete", 0) for p in pedidos if p.get("repassar_frete", False))
+    total_frete_pedidos = totais_pedidos.get("frete", 0)
+    total_frete_repassado = totais_pedidos.get("frete_repassado", 0)
     total_frete_interno = total_frete_pedidos - total_frete_repassado
     
-    # Despesas detalhadas dos pedidos
-    total_despesas_pedidos = 0
-    total_despesas_repassadas_pedidos = 0
-    total_despesas_internas_pedidos = 0
-    
-    for p in pedidos:
-        despesas_det = p.get("despesas_detalhadas", [])
-        for d in despesas_det:
-            valor = d.get("valor", 0)
-            total_despesas_pedidos += valor
-            if d.get("repassar", False):
-                total_despesas_repassadas_pedidos += valor
-            else:
-                total_despesas_internas_pedidos += valor
+    total_despesas_pedidos = totais_pedidos.get("despesas", 0)
+    total_despesas_repassadas_pedidos = totais_pedidos.get("despesas_repassadas", 0)
+    total_despesas_internas_pedidos = totais_pedidos.get("despesas_internas", 0)
     
     # Total despesas internas (não repassadas) - impactam o custo real
     total_despesas_internas = total_frete_interno + total_despesas_internas_pedidos
     
     # Licitações
-    total_faturado_licitacoes = sum(lic.get("valor_total_venda", 0) for lic in licitacoes)
-    total_custo_licitacoes = sum(lic.get("valor_total_compra", 0) for lic in licitacoes)
-    total_lucro_licitacoes = sum(lic.get("lucro_total", 0) for lic in licitacoes)
+    quantidade_licitacoes = totais_licitacoes.get("quantidade", 0)
+    total_faturado_licitacoes = totais_licitacoes.get("faturado", 0)
+    total_custo_licitacoes = totais_licitacoes.get("custo", 0)
+    total_lucro_licitacoes = totais_licitacoes.get("lucro", 0)
     
     total_faturado = total_faturado_pedidos + total_faturado_licitacoes
     total_custo = total_custo_pedidos + total_custo_licitacoes
     
-    total_despesas_operacionais = sum(d.get("valor", 0) for d in despesas)
+    total_despesas_operacionais = res_despesas[0]["total"] if res_despesas else 0
     
-    # Group by segmento
-    segmentos_pedidos = {}
-    for p in pedidos:
-        seg = p.get("tipo_venda", "outros")
-        if seg not in segmentos_pedidos:
-            segmentos_pedidos[seg] = {"quantidade": 0, "faturamento": 0, "lucro": 0, "custo": 0}
-        segmentos_pedidos[seg]["quantidade"] += 1
-        segmentos_pedidos[seg]["faturamento"] += p.get("valor_total_venda", 0)
-        segmentos_pedidos[seg]["lucro"] += p.get("lucro_total", 0)
-        segmentos_pedidos[seg]["custo"] += p.get("custo_total", 0)
+    segmentos_pedidos = _agrupamento(facet_pedidos["por_segmento"])
     
     # Add licitações as a segment
-    if licitacoes:
+    if quantidade_licitacoes:
         segmentos_pedidos["licitacao"] = {
-            "quantidade": len(licitacoes),
+            "quantidade": quantidade_licitacoes,
             "faturamento": total_faturado_licitacoes,
             "lucro": total_lucro_licitacoes,
             "custo": total_custo_licitacoes
         }
     
-    # Group by status
-    status_pedidos = {}
-    for p in pedidos:
-        st = p.get("status", "pendente")
-        if st not in status_pedidos:
-            status_pedidos[st] = {"quantidade": 0, "faturamento": 0, "lucro": 0}
-        status_pedidos[st]["quantidade"] += 1
-        status_pedidos[st]["faturamento"] += p.get("valor_total_venda", 0)
-        status_pedidos[st]["lucro"] += p.get("lucro_total", 0)
-    
-    # Group by vendedor
-    vendedores_stats = {}
-    for p in pedidos:
-        vend = p.get("vendedor", "Não informado")
-        if vend not in vendedores_stats:
-            vendedores_stats[vend] = {"quantidade": 0, "faturamento": 0, "lucro": 0, "custo": 0}
-        vendedores_stats[vend]["quantidade"] += 1
-        vendedores_stats[vend]["faturamento"] += p.get("valor_total_venda", 0)
-        vendedores_stats[vend]["lucro"] += p.get("lucro_total", 0)
-        vendedores_stats[vend]["custo"] += p.get("custo_total", 0)
-    
-    # Group by cidade (from clientes)
-    cidades_stats = {}
-    clientes_dict = {}
-    clientes_all = await db.clientes.find({}, {"_id": 0}).to_list(1000)
-    for c in clientes_all:
-        clientes_dict[c["id"]] = c
-    
-    for p in pedidos:
-        cliente = clientes_dict.get(p.get("cliente_id"), {})
-        cid = cliente.get("cidade", "Não informada")
+    # Cidades dos pedidos (via cliente) + cidades das licitações
+    cidades_stats = _agrupamento(facet_pedidos["por_cidade"])
+    for cid, stats in _agrupamento(facet_licitacoes["por_cidade"]).items():
         if cid not in cidades_stats:
             cidades_stats[cid] = {"quantidade": 0, "faturamento": 0, "lucro": 0}
-        cidades_stats[cid]["quantidade"] += 1
-        cidades_stats[cid]["faturamento"] += p.get("valor_total_venda", 0)
-        cidades_stats[cid]["lucro"] += p.get("lucro_total", 0)
+        for campo in ("quantidade", "faturamento", "lucro"):
+            cidades_stats[cid][campo] += stats[campo]
     
-    # Add licitações cities
-    for lic in licitacoes:
-        cid = lic.get("cidade", "Não informada")
-        if cid not in cidades_stats:
-            cidades_stats[cid] = {"quantidade": 0, "faturamento": 0, "lucro": 0}
-        cidades_stats[cid]["quantidade"] += 1
-        cidades_stats[cid]["faturamento"] += lic.get("valor_total_venda", 0)
-        cidades_stats[cid]["lucro"] += lic.get("lucro_total", 0)
-    
-    # Group by forma de pagamento
-    formas_pagamento_stats = {}
-    for p in pedidos:
-        forma = p.get("forma_pagamento", "Não informado")
-        if forma not in formas_pagamento_stats:
-            formas_pagamento_stats[forma] = {"quantidade": 0, "faturamento": 0}
-        formas_pagamento_stats[forma]["quantidade"] += 1
-        formas_pagamento_stats[forma]["faturamento"] += p.get("valor_total_venda", 0)
-    
-    # Group by month for trend analysis
-    pedidos_por_mes = {}
-    for p in pedidos:
-        data_str = p.get("data", "")
-        if data_str:
-            try:
-                data = datetime.fromisoformat(data_str.replace("Z", "+00:00"))
-                mes_ano = data.strftime("%Y-%m")
-                if mes_ano not in pedidos_por_mes:
-                    pedidos_por_mes[mes_ano] = {"quantidade": 0, "faturamento": 0, "lucro": 0}
-                pedidos_por_mes[mes_ano]["quantidade"] += 1
-                pedidos_por_mes[mes_ano]["faturamento"] += p.get("valor_total_venda", 0)
-                pedidos_por_mes[mes_ano]["lucro"] += p.get("lucro_total", 0)
-            except:
-                pass
-    
-    # All pedidos details for the table (sorted by date desc)
-    pedidos_detalhados = []
-    for p in sorted(pedidos, key=lambda x: x.get("data", ""), reverse=True):
-        cliente = clientes_dict.get(p.get("cliente_id"), {})
-        pedidos_detalhados.append({
-            "id": p.get("id"),
-            "numero": p.get("numero", ""),
-            "data": p.get("data", ""),
-            "cliente_nome": p.get("cliente_nome", ""),
-            "cliente_cidade": cliente.get("cidade", ""),
-            "vendedor": p.get("vendedor", ""),
-            "status": p.get("status", "pendente"),
-            "tipo_venda": p.get("tipo_venda", ""),
-            "forma_pagamento": p.get("forma_pagamento", ""),
-            "valor_venda": p.get("valor_total_venda", 0),
-            "custo_total": p.get("custo_total", 0),
-            "lucro": p.get("lucro_total", 0),
-            "frete": p.get("frete", 0),
-            "repassar_frete": p.get("repassar_frete", False),
-            "qtd_itens": len(p.get("itens", []))
-        })
-    
-    # Recent transactions (last 10)
-    transacoes_recentes = pedidos_detalhados[:10]
-    
-    for lic in sorted(licitacoes, key=lambda x: x.get("data_empenho", ""), reverse=True)[:10]:
-        transacoes_recentes.append({
-            "tipo": "Licitação",
-            "numero": lic.get("numero_licitacao", ""),
-            "cliente_nome": lic.get("orgao_publico", ""),
-            "valor_venda": lic.get("valor_total_venda", 0),
-            "lucro": lic.get("lucro_total", 0),
-            "data": lic.get("data_empenho", ""),
-            "status": lic.get("status", ""),
-            "tipo_venda": "licitacao",
-            "vendedor": "-"
-        })
-    
-    # Sort all transactions by date
-    transacoes_recentes = sorted(transacoes_recentes, key=lambda x: x.get("data", ""), reverse=True)[:10]
+    # Recent transactions (last 10), sorted by date
+    transacoes_recentes = pedidos_detalhados[:10] + facet_licitacoes["recentes"]
+    transacoes_recentes = sorted(transacoes_recentes, key=lambda x: _chave_data(x.get("data")), reverse=True)[:10]
     
     return {
         # Totais gerais
@@ -2612,16 +4664,16 @@ async def get_relatorio_geral(
         "lucro_liquido": total_lucro_pedidos + total_lucro_licitacoes - total_despesas_operacionais,
         
         # Quantidades
-        "quantidade_pedidos": len(pedidos),
-        "quantidade_licitacoes": len(licitacoes),
+        "quantidade_pedidos": quantidade_pedidos,
+        "quantidade_licitacoes": quantidade_licitacoes,
         
         # Agrupamentos
         "por_segmento": segmentos_pedidos,
-        "por_status": status_pedidos,
-        "por_vendedor": vendedores_stats,
+        "por_status": _agrupamento(facet_pedidos["por_status"]),
+        "por_vendedor": _agrupamento(facet_pedidos["por_vendedor"]),
         "por_cidade": cidades_stats,
-        "por_forma_pagamento": formas_pagamento_stats,
-        "por_mes": dict(sorted(pedidos_por_mes.items())),
+        "por_forma_pagamento": _agrupamento(facet_pedidos["por_forma_pagamento"]),
+        "por_mes": dict(sorted(_agrupamento(facet_pedidos["por_mes"]).items())),
         
         # Detalhes
         "pedidos_detalhados": pedidos_detalhados,
@@ -2629,43 +4681,509 @@ async def get_relatorio_geral(
     }
 
 
-@api_router.get("/relatorios/filtros")
-async def get_filtros_disponiveis(current_user: User = Depends(get_current_user)):
-    """Return available filter options for the reports page"""
-    # Get unique vendedores
-    vendedores = await db.vendedores.find({"ativo": True}, {"_id": 0, "nome": 1}).to_list(100)
-    vendedores_list = [v["nome"] for v in vendedores]
+@api_router.get("/relatorios/filtros")
+async def get_filtros_disponiveis(current_user: User = Depends(get_current_user)):
+    """Return available filter options for the reports page"""
+    # Get unique vendedores
+    vendedores = await db.vendedores.find({"ativo": True}, {"_id": 0, "nome": 1}).to_list(100)
+    vendedores_list = [v["nome"] for v in vendedores]
+    
+    # Get unique cidades from clientes and licitações
+    clientes = await db.clientes.find({}, {"_id": 0, "cidade": 1}).to_list(1000)
+    licitacoes = await db.licitacoes.find({}, {"_id": 0, "cidade": 1}).to_list(1000)
+    
+    cidades_set = set()
+    for c in clientes:
+        if c.get("cidade"):
+            cidades_set.add(c["cidade"])
+    for lic in licitacoes:
+        if lic.get("cidade"):
+            cidades_set.add(lic["cidade"])
+    
+    cidades_list = sorted(list(cidades_set))
+    
+    # Segmentos disponíveis
+    segmentos = [
+        {"value": "todos", "label": "Todos"},
+        {"value": "licitacao", "label": "Licitação"},
+        {"value": "consumidor_final", "label": "Consumidor Final"},
+        {"value": "revenda", "label": "Revenda"},
+        {"value": "brindeiros", "label": "Brindeiros"}
+    ]
+    
+    return {
+        "vendedores": vendedores_list,
+        "cidades": cidades_list,
+        "segmentos": segmentos
+    }
+
+
+# ==================== EXPORTAÇÃO ====================
+# /export/{colecao} transmite NDJSON ou CSV direto do cursor do MongoDB, em lotes de
+# EXPORT_LOTE documentos: a memória usada não depende do tamanho do período exportado
+# e os primeiros bytes saem assim que o primeiro lote chega.
+
+EXPORT_LOTE = int(os.environ.get("EXPORT_BATCH_SIZE", "500"))
+
+# Ordenação (coberta por índice) e colunas do CSV de cada coleção exportável
+EXPORTACOES: Dict[str, Dict[str, Any]] = {
+    "pedidos": {
+        "sort": [("data", 1), ("id", 1)],
+        "colunas": [
+            "numero", "data", "cliente_id", "cliente_nome", "cliente_cidade", "vendedor", "tipo_venda",
+            "status", "forma_pagamento", "prazo_entrega", "frete", "repassar_frete", "outras_despesas",
+            "custo_total", "valor_total_venda", "despesas_totais", "lucro_total", "itens", "id",
+        ],
+        "filtros": {"cliente_id", "vendedor", "segmento", "status", "cidade"},
+    },
+    "orcamentos": {
+        "sort": [("data", 1)],
+        "colunas": [
+            "numero", "data", "cliente_id", "cliente_nome", "vendedor", "status", "valor_total", "desconto",
+            "valor_frete", "outras_despesas", "valor_final", "validade_dias", "forma_pagamento",
+            "prazo_entrega", "itens", "id",
+        ],
+        "filtros": {"cliente_id", "vendedor"},
+    },
+    "licitacoes": {
+        "sort": [("data_empenho", 1)],
+        "colunas": [
+            "numero_licitacao", "data_empenho", "orgao_publico", "cidade", "estado", "numero_empenho",
+            "numero_nota_empenho", "status_pagamento", "valor_total_venda", "valor_total_compra",
+            "despesas_totais", "lucro_total", "quantidade_total_contratada", "quantidade_total_fornecida",
+            "percentual_executado", "contrato", "produtos", "fornecimentos", "id",
+        ],
+        "filtros": {"cidade"},
+    },
+    "despesas": {
+        "sort": [("data_despesa", 1)],
+        "colunas": ["data_despesa", "data_vencimento", "tipo", "descricao", "valor", "status", "id"],
+        "filtros": set(),
+    },
+}
+
+
+def _valor_exportacao(valor: Any) -> Any:
+    """default= do json.dumps: datas em ISO 8601, demais tipos BSON como texto"""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+def _celula_csv(valor: Any) -> Any:
+    if valor is None:
+        return ""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, default=_valor_exportacao, ensure_ascii=False)
+    return valor
+
+
+def _cursor_exportacao(colecao: str, filtros: Dict[str, Dict[str, Any]], cidade: Optional[str]):
+    sort = EXPORTACOES[colecao]["sort"]
+    if colecao == "pedidos":
+        # Mesmo $lookup de cidade do relatório geral, para que os filtros tenham o mesmo efeito
+        pipeline = _pipeline_pedidos_com_cidade(filtros["pedidos"], cidade, sort) + [{"$project": {"_id": 0}}]
+        return db.pedidos.aggregate(pipeline, batchSize=EXPORT_LOTE)
+    if colecao == "licitacoes":
+        # Fornecimentos vivem na própria coleção; o export junta com os legados embutidos, como o detalhe
+        pipeline = [
+            {"$match": filtros["licitacoes"]},
+            {"$sort": dict(sort)},
+            {"$lookup": {"from": "fornecimentos", "localField": "id", "foreignField": "licitacao_id", "as": "_fornecimentos"}},
+            {"$addFields": {"fornecimentos": {"$concatArrays": [{"$ifNull": ["$fornecimentos", []]}, "$_fornecimentos"]}}},
+            {"$project": {"_id": 0, "_fornecimentos": 0, "fornecimentos._id": 0, "fornecimentos.licitacao_id": 0}},
+        ]
+        return db.licitacoes.aggregate(pipeline, batchSize=EXPORT_LOTE)
+    return db[colecao].find(filtros[colecao], {"_id": 0}).sort(sort).batch_size(EXPORT_LOTE)
+
+
+async def _gerar_ndjson(cursor):
+    linhas = []
+    async for doc in cursor:
+        linhas.append(json.dumps(doc, default=_valor_exportacao, ensure_ascii=False))
+        if len(linhas) >= EXPORT_LOTE:
+            yield ("\n".join(linhas) + "\n").encode("utf-8")
+            linhas = []
+    if linhas:
+        yield ("\n".join(linhas) + "\n").encode("utf-8")
+
+
+async def _gerar_csv(cursor, colunas: List[str]):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=";")
+    # BOM para o Excel reconhecer UTF-8; separador ";" segue o padrão pt-BR
+    yield ("\ufeff" + ";".join(colunas) + "\r\n").encode("utf-8")
+    quantidade = 0
+    async for doc in cursor:
+        escritor.writerow([_celula_csv(doc.get(coluna)) for coluna in colunas])
+        quantidade += 1
+        if quantidade >= EXPORT_LOTE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            quantidade = 0
+    if quantidade:
+        yield buffer.getvalue().encode("utf-8")
+
+
+@api_router.get("/export/{colecao}")
+async def exportar_colecao(
+    colecao: str,
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    cliente_id: Optional[str] = None,
+    vendedor: Optional[str] = None,
+    segmento: Optional[str] = None,
+    cidade: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Exporta pedidos, orçamentos, licitações ou despesas com os mesmos filtros dos relatórios.
+
+    O período vale para todas as coleções; os demais filtros só onde existem (ver
+    EXPORTACOES[...]["filtros"]) e pedir um que a coleção não tem responde 400.
+    """
+    if colecao not in EXPORTACOES:
+        raise HTTPException(status_code=404, detail=f"Exportação não disponível. Use: {list(EXPORTACOES)}")
+    informados = {
+        "cliente_id": cliente_id, "vendedor": vendedor, "cidade": cidade,
+        "segmento": None if segmento == "todos" else segmento,
+        "status": None if status == "todos" else status,
+    }
+    invalidos = sorted(nome for nome, valor in informados.items() if valor and nome not in EXPORTACOES[colecao]["filtros"])
+    if invalidos:
+        raise HTTPException(status_code=400, detail=f"Filtros não suportados na exportação de {colecao}: {', '.join(invalidos)}")
+    
+    filtros = _filtros_relatorio(data_inicio, data_fim, cliente_id, vendedor, segmento, status, cidade)
+    cursor = _cursor_exportacao(colecao, filtros, cidade)
+    
+    nome = f"{colecao}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.{formato}"
+    if formato == "csv":
+        corpo = _gerar_csv(cursor, EXPORTACOES[colecao]["colunas"])
+        media_type = "text/csv; charset=utf-8"
+    else:
+        corpo = _gerar_ndjson(cursor)
+        media_type = "application/x-ndjson"
+    return StreamingResponse(
+        corpo,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nome}"'}
+    )
+
+
+# ==================== PDFs ====================
+# Orçamentos e o relatório geral são renderizados no servidor (reportlab, em pdf_render.py)
+# por um pool de processos, para que a geração não ocupe o event loop. O resultado fica em
+# disco num cache endereçado por conteúdo: a chave é o hash da versão do documento (id +
+# updated_at do orçamento; filtros + dados agregados do relatório), então downloads
+# repetidos do mesmo documento não renderizam de novo e qualquer alteração gera outra chave.
+
+PDF_CACHE_DIR = os.path.join(UPLOAD_DIR, "pdf_cache")
+PDF_CACHE_TTL_DIAS = float(os.environ.get("PDF_CACHE_TTL_DIAS", "30"))
+# Mudanças de layout em pdf_render.py devem incrementar a versão para invalidar o cache
+PDF_RENDER_VERSAO = 1
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_em_andamento: Dict[str, "asyncio.Future"] = {}
+
+
+def _pool_pdf() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn: os workers importam só pdf_render, sem herdar o cliente Mongo nem o event loop
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=int(os.environ.get("PDF_WORKERS", "2")),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pdf_pool
+
+
+def _chave_pdf(*partes: Any) -> str:
+    bruto = json.dumps([PDF_RENDER_VERSAO, *partes], default=_valor_exportacao, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(bruto.encode()).hexdigest()
+
+
+def _caminho_pdf(chave: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, chave[:2], f"{chave}.pdf")
+
+
+def _gravar_pdf(caminho: str, conteudo: bytes):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.{uuid.uuid4().hex}.tmp"
+    with open(temporario, "wb") as arquivo:
+        arquivo.write(conteudo)
+    os.replace(temporario, caminho)
+
+
+async def obter_pdf(chave: str, renderizar, *args) -> str:
+    """Caminho do PDF em cache; renderiza no pool na primeira vez (uma única vez por chave)"""
+    caminho = _caminho_pdf(chave)
+    if os.path.exists(caminho):
+        # Marca o uso para a limpeza por idade (atime não é confiável com noatime/relatime)
+        os.utime(caminho)
+        return caminho
     
-    # Get unique cidades from clientes and licitações
-    clientes = await db.clientes.find({}, {"_id": 0, "cidade": 1}).to_list(1000)
-    licitacoes = await db.licitacoes.find({}, {"_id": 0, "cidade": 1}).to_list(1000)
+    em_andamento = _pdf_em_andamento.get(chave)
+    if em_andamento is not None:
+        return await asyncio.shield(em_andamento)
     
-    cidades_set = set()
-    for c in clientes:
-        if c.get("cidade"):
-            cidades_set.add(c["cidade"])
-    for lic in licitacoes:
-        if lic.get("cidade"):
-            cidades_set.add(lic["cidade"])
+    futuro = asyncio.get_running_loop().create_future()
+    _pdf_em_andamento[chave] = futuro
+    try:
+        conteudo = await asyncio.get_running_loop().run_in_executor(_pool_pdf(), renderizar, *args)
+        await asyncio.to_thread(_gravar_pdf, caminho, conteudo)
+        futuro.set_result(caminho)
+        return caminho
+    except Exception as e:
+        futuro.set_exception(e)
+        # Ninguém mais aguardando: evita o aviso de exceção não recuperada
+        futuro.exception()
+        raise
+    finally:
+        _pdf_em_andamento.pop(chave, None)
+
+
+def _limpar_cache_pdf() -> int:
+    """Remove PDFs não usados há mais de PDF_CACHE_TTL_DIAS (versões antigas ficam órfãs)"""
+    limite = time.time() - PDF_CACHE_TTL_DIAS * 86400
+    removidos = 0
+    for raiz, _, arquivos in os.walk(PDF_CACHE_DIR):
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            try:
+                if os.stat(caminho).st_mtime < limite:
+                    os.remove(caminho)
+                    removidos += 1
+            except FileNotFoundError:
+                pass
+    return removidos
+
+
+async def loop_limpeza_cache_pdf():
+    while True:
+        try:
+            removidos = await asyncio.to_thread(_limpar_cache_pdf)
+            if removidos:
+                logger.info(f"Cache de PDFs: {removidos} arquivos expirados removidos")
+        except Exception as e:
+            logger.error(f"Falha ao limpar o cache de PDFs: {e}")
+        await asyncio.sleep(86400)
+
+
+@api_router.get("/orcamentos/{orcamento_id}/pdf")
+async def get_orcamento_pdf(orcamento_id: str, current_user: User = Depends(get_current_user)):
+    """PDF do orçamento, servido do cache enquanto o orçamento não for alterado"""
+    import pdf_render
     
-    cidades_list = sorted(list(cidades_set))
+    orc = await db.orcamentos.find_one({"id": orcamento_id}, {"_id": 0})
+    if not orc:
+        raise HTTPException(status_code=404, detail="Orçamento not found")
+    normalizar_leitura("orcamentos", orc)
     
-    # Segmentos disponíveis
-    segmentos = [
-        {"value": "todos", "label": "Todos"},
-        {"value": "licitacao", "label": "Licitação"},
-        {"value": "consumidor_final", "label": "Consumidor Final"},
-        {"value": "revenda", "label": "Revenda"},
-        {"value": "brindeiros", "label": "Brindeiros"}
-    ]
+    versao = orc.get("updated_at") or orc.get("created_at")
+    # Documentos sem data de alteração (legados) entram na chave pelo próprio conteúdo
+    chave = _chave_pdf("orcamento", orcamento_id, versao if versao else orc)
+    caminho = await obter_pdf(chave, pdf_render.render_orcamento, orc)
+    return FileResponse(caminho, media_type="application/pdf", filename=f"Orcamento_{orc.get('numero', orcamento_id)}.pdf")
+
+
+@api_router.get("/relatorios/geral/pdf")
+async def get_relatorio_geral_pdf(
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    cliente_id: Optional[str] = None,
+    vendedor: Optional[str] = None,
+    segmento: Optional[str] = None,
+    cidade: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """PDF do relatório geral com os mesmos filtros de /relatorios/geral"""
+    import pdf_render
     
+    filtros = {
+        "data_inicio": data_inicio, "data_fim": data_fim, "cliente_id": cliente_id, "vendedor": vendedor,
+        "segmento": segmento, "cidade": cidade, "status": status,
+    }
+    # As agregações são baratas; o que se evita é renderizar de novo quando os números não mudaram
+    relatorio = await get_relatorio_geral(current_user=current_user, **filtros)
+    chave = _chave_pdf("relatorio_geral", filtros, relatorio)
+    caminho = await obter_pdf(chave, pdf_render.render_relatorio_geral, relatorio, filtros)
+    return FileResponse(caminho, media_type="application/pdf", filename=f"Relatorio_XSELL_{data_inicio or 'inicio'}_{data_fim or 'hoje'}.pdf")
+
+
+# ==================== ROLLUPS ====================
+# Coleção "rollups": totais de vendas por (mês, tipo_venda, vendedor, cidade, status),
+# mantidos com $inc a cada escrita de pedido/licitação.
+
+def _mes_rollup(data: Any) -> str:
+    if isinstance(data, datetime):
+        return data.strftime("%Y-%m")
+    return data[:7] if data else ""
+
+
+async def _cidade_pedido(pedido: Dict[str, Any]) -> Optional[str]:
+    """Cidade gravada no pedido; pedidos antigos sem o campo usam a cidade atual do cliente"""
+    if "cliente_cidade" in pedido:
+        return pedido["cliente_cidade"]
+    cliente = await db.clientes.find_one({"id": pedido.get("cliente_id")}, {"_id": 0, "cidade": 1})
+    return (cliente or {}).get("cidade")
+
+
+def _valor_rollup(valor: Any, padrao: str) -> Any:
+    return padrao if valor is None or valor == "" else valor
+
+
+def chave_rollup_pedido(pedido: Dict[str, Any], cidade: Optional[str]) -> Dict[str, Any]:
+    """Bucket de um pedido; usada tanto no $inc incremental quanto em rebuild_rollups"""
     return {
-        "vendedores": vendedores_list,
-        "cidades": cidades_list,
-        "segmentos": segmentos
+        "mes": _mes_rollup(pedido.get("data")),
+        "tipo_venda": _valor_rollup(pedido.get("tipo_venda"), "outros"),
+        "vendedor": _valor_rollup(pedido.get("vendedor"), "Não informado"),
+        "cidade": _valor_rollup(cidade, "Não informada"),
+        "status": _valor_rollup(pedido.get("status"), "pendente"),
+    }
+
+
+def chave_rollup_licitacao(lic: Dict[str, Any]) -> Dict[str, Any]:
+    """Bucket de uma licitação; usada tanto no $inc incremental quanto em rebuild_rollups"""
+    return {
+        "mes": _mes_rollup(lic.get("data_empenho")),
+        "tipo_venda": "licitacao",
+        "vendedor": "-",
+        "cidade": _valor_rollup(lic.get("cidade"), "Não informada"),
+        "status": _valor_rollup(lic.get("status_pagamento"), "pendente"),
+    }
+
+
+def _valores_rollup_pedido(pedido: Dict[str, Any]) -> Dict[str, float]:
+    return {
+        "quantidade": 1,
+        "faturamento": pedido.get("valor_total_venda", 0),
+        "custo": pedido.get("custo_total", 0),
+        "lucro": pedido.get("lucro_total", 0),
+    }
+
+
+def _valores_rollup_licitacao(lic: Dict[str, Any]) -> Dict[str, float]:
+    return {
+        "quantidade": 1,
+        "faturamento": lic.get("valor_total_venda", 0),
+        "custo": lic.get("valor_total_compra", 0),
+        "lucro": lic.get("lucro_total", 0),
+    }
+
+
+async def _inc_rollup(chave: Dict[str, Any], valores: Dict[str, float], sinal: int):
+    await db.rollups.update_one(
+        {"_id": chave},
+        {"$inc": {campo: sinal * (valor or 0) for campo, valor in valores.items()}},
+        upsert=True
+    )
+
+
+async def aplicar_rollup_pedido(pedido: Dict[str, Any], sinal: int = 1):
+    """Soma (sinal=1) ou remove (sinal=-1) a contribuição de um pedido nos rollups"""
+    chave = chave_rollup_pedido(pedido, await _cidade_pedido(pedido))
+    await _inc_rollup(chave, _valores_rollup_pedido(pedido), sinal)
+
+
+async def aplicar_rollup_licitacao(lic: Dict[str, Any], sinal: int = 1):
+    """Soma (sinal=1) ou remove (sinal=-1) a contribuição de uma licitação nos rollups"""
+    await _inc_rollup(chave_rollup_licitacao(lic), _valores_rollup_licitacao(lic), sinal)
+
+
+async def rebuild_rollups() -> int:
+    """Recalcula a coleção rollups do zero a partir de pedidos e licitações.
+    
+    Os buckets são montados com as mesmas funções do caminho incremental
+    (chave_rollup_pedido/chave_rollup_licitacao), então os dois nunca divergem na
+    normalização de campos vazios nem na origem da cidade.
+    """
+    buckets: Dict[Tuple[Tuple[str, Any], ...], Dict[str, float]] = {}
+    
+    def somar(chave: Dict[str, Any], valores: Dict[str, float]):
+        bucket = buckets.setdefault(tuple(chave.items()), dict.fromkeys(valores, 0))
+        for campo, valor in valores.items():
+            bucket[campo] += valor or 0
+    
+    cidades = {c["id"]: c.get("cidade") async for c in db.clientes.find({}, {"_id": 0, "id": 1, "cidade": 1})}
+    projecao_pedido = {"_id": 0, "data": 1, "tipo_venda": 1, "vendedor": 1, "status": 1, "cliente_id": 1,
+                       "cliente_cidade": 1, "valor_total_venda": 1, "custo_total": 1, "lucro_total": 1}
+    async for pedido in db.pedidos.find({}, projecao_pedido).batch_size(MIGRACAO_LOTE):
+        cidade = pedido["cliente_cidade"] if "cliente_cidade" in pedido else cidades.get(pedido.get("cliente_id"))
+        somar(chave_rollup_pedido(pedido, cidade), _valores_rollup_pedido(pedido))
+    
+    projecao_licitacao = {"_id": 0, "data_empenho": 1, "cidade": 1, "status_pagamento": 1,
+                          "valor_total_venda": 1, "valor_total_compra": 1, "lucro_total": 1}
+    async for lic in db.licitacoes.find({}, projecao_licitacao).batch_size(MIGRACAO_LOTE):
+        somar(chave_rollup_licitacao(lic), _valores_rollup_licitacao(lic))
+    
+    if not buckets:
+        await db.rollups.delete_many({})
+        logger.info("Rollups reconstruídos: 0 buckets")
+        return 0
+    
+    await db.rollups_rebuild.drop()
+    docs = [{"_id": dict(chave), **valores} for chave, valores in buckets.items()]
+    for inicio in range(0, len(docs), MIGRACAO_LOTE):
+        await db.rollups_rebuild.insert_many(docs[inicio:inicio + MIGRACAO_LOTE], ordered=False)
+    await db.rollups_rebuild.rename("rollups", dropTarget=True)
+    logger.info(f"Rollups reconstruídos: {len(docs)} buckets")
+    return len(docs)
+
+
+def _somar_rollups_por(campo: Optional[str]) -> List[Dict[str, Any]]:
+    return [{"$group": {
+        "_id": f"$_id.{campo}" if campo else None,
+        "quantidade": {"$sum": "$quantidade"},
+        "faturamento": {"$sum": "$faturamento"},
+        "lucro": {"$sum": "$lucro"},
+        "custo": {"$sum": "$custo"},
+    }}]
+
+
+@api_router.get("/relatorios/resumo")
+async def get_relatorio_resumo(current_user: User = Depends(get_current_user)):
+    """Totais de todo o período lidos dos rollups (custo proporcional ao número de buckets)"""
+    resultado = await db.rollups.aggregate([{"$facet": {
+        "totais": _somar_rollups_por(None),
+        "por_segmento": _somar_rollups_por("tipo_venda"),
+        "por_status": _somar_rollups_por("status"),
+        "por_vendedor": _somar_rollups_por("vendedor"),
+        "por_cidade": _somar_rollups_por("cidade"),
+        "por_mes": _somar_rollups_por("mes"),
+    }}]).to_list(None)
+    facet = resultado[0]
+    
+    totais = facet["totais"][0] if facet["totais"] else {}
+    segmentos = _agrupamento(facet["por_segmento"])
+    licitacoes = segmentos.get("licitacao", {})
+    
+    return {
+        "total_faturado": totais.get("faturamento", 0),
+        "total_custo": totais.get("custo", 0),
+        "lucro_total": totais.get("lucro", 0),
+        "quantidade_pedidos": totais.get("quantidade", 0) - licitacoes.get("quantidade", 0),
+        "quantidade_licitacoes": licitacoes.get("quantidade", 0),
+        "por_segmento": segmentos,
+        "por_status": _agrupamento(facet["por_status"]),
+        "por_vendedor": _agrupamento(facet["por_vendedor"]),
+        "por_cidade": _agrupamento(facet["por_cidade"]),
+        "por_mes": dict(sorted(_agrupamento(facet["por_mes"]).items())),
     }
 
 
+@api_router.post("/relatorios/rollups/rebuild")
+async def rebuild_rollups_endpoint(perfil: PerfilAcesso = Depends(verificar_nivel_presidente)):
+    """Reconstrói os rollups a partir dos documentos (apenas Presidente)"""
+    buckets = await rebuild_rollups()
+    return {"message": "Rollups reconstruídos", "buckets": buckets}
+
+
 # =============================================================================
 # AGENDA DE LICITAÇÕES - Models and Endpoints
 # =============================================================================
@@ -2719,30 +5237,57 @@ class AgendaLicitacao(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class AgendaLicitacaoResumo(BaseModel):
+    """Linha da agenda (view=summary): anexos, eventos e histórico viram contagens"""
+    id: str
+    data_disputa: datetime
+    horario_disputa: str
+    numero_licitacao: str
+    portal: str
+    cidade: str
+    estado: str
+    produtos: List[str] = []
+    objeto: Optional[str] = None
+    valor_estimado: Optional[float] = None
+    observacoes: Optional[str] = None
+    status: str = "agendada"
+    alertas: List[str] = []
+    quantidade_anexos: int = 0
+    quantidade_eventos: int = 0
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+
 # Endpoints da Agenda de Licitações
-@api_router.get("/agenda-licitacoes", response_model=List[AgendaLicitacao])
-async def get_agenda_licitacoes(current_user: User = Depends(get_current_user)):
-    """Listar todas as licitações da agenda com alertas e ordenação por data"""
-    licitacoes = await db.agenda_licitacoes.find({}, {"_id": 0}).sort("data_disputa", 1).to_list(1000)
+AGENDA_CONTAGENS = {"quantidade_anexos": "anexos", "quantidade_eventos": "eventos"}
+
+
+@api_router.get("/agenda-licitacoes", response_model=Union[List[AgendaLicitacao], List[AgendaLicitacaoResumo]])
+async def get_agenda_licitacoes(
+    view: str = Query("full", pattern=VIEW_LISTAGEM),
+    current_user: User = Depends(get_current_user)
+):
+    """Listar todas as licitações da agenda com alertas e ordenação por data
+
+    Com view=summary anexos/eventos/histórico não são lidos; dos eventos vêm só os campos usados nos alertas.
+    """
+    resumo = view == "summary"
+    if resumo:
+        projecao = projecao_resumo(
+            AgendaLicitacaoResumo, AGENDA_CONTAGENS,
+            **{"eventos.status": 1, "eventos.data": 1, "eventos.descricao": 1}
+        )
+    else:
+        projecao = {"_id": 0}
+    licitacoes = await db.agenda_licitacoes.find({}, projecao).sort("data_disputa", 1).to_list(1000)
     
     agora = datetime.now(timezone.utc)
     
     for lic in licitacoes:
-        # Converter strings para datetime
-        if isinstance(lic.get("data_disputa"), str):
-            lic["data_disputa"] = datetime.fromisoformat(lic["data_disputa"])
-        if isinstance(lic.get("created_at"), str):
-            lic["created_at"] = datetime.fromisoformat(lic["created_at"])
-        if lic.get("updated_at") and isinstance(lic["updated_at"], str):
-            lic["updated_at"] = datetime.fromisoformat(lic["updated_at"])
-        
         # Calcular alertas
         alertas = []
-        data_disputa = lic.get("data_disputa")
+        data_disputa = _como_datetime(lic.get("data_disputa"))
         if data_disputa:
-            if data_disputa.tzinfo is None:
-                data_disputa = data_disputa.replace(tzinfo=timezone.utc)
-            
             diff = data_disputa - agora
             dias = diff.days
             horas = diff.total_seconds() / 3600
@@ -2759,12 +5304,7 @@ async def get_agenda_licitacoes(current_user: User = Depends(get_current_user)):
         # Verificar eventos próximos
         for evento in lic.get("eventos", []):
             if evento.get("status") == "pendente":
-                evento_data = evento.get("data")
-                if isinstance(evento_data, str):
-                    evento_data = datetime.fromisoformat(evento_data)
-                if evento_data and evento_data.tzinfo is None:
-                    evento_data = evento_data.replace(tzinfo=timezone.utc)
-                
+                evento_data = _como_datetime(evento.get("data"))
                 if evento_data:
                     diff_evento = (evento_data - agora).total_seconds() / 3600
                     if diff_evento <= 24 and diff_evento > 0:
@@ -2772,6 +5312,10 @@ async def get_agenda_licitacoes(current_user: User = Depends(get_current_user)):
         
         lic["alertas"] = alertas
         
+        if resumo:
+            lic.pop("eventos", None)
+            continue
+        
         # Garantir campos padrão
         if "anexos" not in lic:
             lic["anexos"] = []
@@ -2780,7 +5324,9 @@ async def get_agenda_licitacoes(current_user: User = Depends(get_current_user)):
         if "historico" not in lic:
             lic["historico"] = []
     
-    return licitacoes
+    if resumo:
+        return resposta_lista(AgendaLicitacaoResumo, licitacoes)
+    return resposta_lista(AgendaLicitacao, licitacoes)
 
 
 @api_router.post("/agenda-licitacoes", response_model=AgendaLicitacao)
@@ -2790,7 +5336,7 @@ async def create_agenda_licitacao(lic_data: AgendaLicitacaoCreate, current_user:
     
     lic_doc = {
         "id": lic_id,
-        "data_disputa": lic_data.data_disputa.isoformat(),
+        "data_disputa": lic_data.data_disputa,
         "horario_disputa": lic_data.horario_disputa,
         "numero_licitacao": lic_data.numero_licitacao,
         "portal": lic_data.portal,
@@ -2804,21 +5350,17 @@ async def create_agenda_licitacao(lic_data: AgendaLicitacaoCreate, current_user:
         "eventos": [],
         "status": "agendada",
         "historico": [{
-            "data": datetime.now(timezone.utc).isoformat(),
+            "data": datetime.now(timezone.utc),
             "usuario": current_user.email,
             "acao": "Licitação criada"
         }],
         "alertas": [],
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "updated_at": None
     }
     
     await db.agenda_licitacoes.insert_one(lic_doc)
     
-    # Converter para retorno
-    lic_doc["data_disputa"] = lic_data.data_disputa
-    lic_doc["created_at"] = datetime.now(timezone.utc)
-    
     return AgendaLicitacao(**lic_doc)
 
 
@@ -2829,12 +5371,6 @@ async def get_agenda_licitacao(licitacao_id: str, current_user: User = Depends(g
     if not lic:
         raise HTTPException(status_code=404, detail="Licitação não encontrada")
     
-    # Converter strings para datetime
-    if isinstance(lic.get("data_disputa"), str):
-        lic["data_disputa"] = datetime.fromisoformat(lic["data_disputa"])
-    if isinstance(lic.get("created_at"), str):
-        lic["created_at"] = datetime.fromisoformat(lic["created_at"])
-    
     return AgendaLicitacao(**lic)
 
 
@@ -2848,13 +5384,13 @@ async def update_agenda_licitacao(licitacao_id: str, lic_data: AgendaLicitacaoCr
     # Adicionar ao histórico
     historico = existing.get("historico", [])
     historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "usuario": current_user.email,
         "acao": "Licitação atualizada"
     })
     
     update_doc = {
-        "data_disputa": lic_data.data_disputa.isoformat(),
+        "data_disputa": lic_data.data_disputa,
         "horario_disputa": lic_data.horario_disputa,
         "numero_licitacao": lic_data.numero_licitacao,
         "portal": lic_data.portal,
@@ -2865,16 +5401,12 @@ async def update_agenda_licitacao(licitacao_id: str, lic_data: AgendaLicitacaoCr
         "valor_estimado": lic_data.valor_estimado,
         "observacoes": lic_data.observacoes,
         "historico": historico,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.agenda_licitacoes.update_one({"id": licitacao_id}, {"$set": update_doc})
     
     updated = await db.agenda_licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
-    if isinstance(updated.get("data_disputa"), str):
-        updated["data_disputa"] = datetime.fromisoformat(updated["data_disputa"])
-    if isinstance(updated.get("created_at"), str):
-        updated["created_at"] = datetime.fromisoformat(updated["created_at"])
     
     return AgendaLicitacao(**updated)
 
@@ -2892,14 +5424,14 @@ async def update_agenda_licitacao_status(licitacao_id: str, status: str, current
     
     historico = existing.get("historico", [])
     historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "usuario": current_user.email,
         "acao": f"Status alterado para: {status}"
     })
     
     await db.agenda_licitacoes.update_one(
         {"id": licitacao_id},
-        {"$set": {"status": status, "historico": historico, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"status": status, "historico": historico, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Status atualizado com sucesso"}
@@ -2908,9 +5440,11 @@ async def update_agenda_licitacao_status(licitacao_id: str, status: str, current
 @api_router.delete("/agenda-licitacoes/{licitacao_id}")
 async def delete_agenda_licitacao(licitacao_id: str, current_user: User = Depends(get_current_user)):
     """Excluir licitação da agenda"""
-    result = await db.agenda_licitacoes.delete_one({"id": licitacao_id})
-    if result.deleted_count == 0:
+    existing = await db.agenda_licitacoes.find_one_and_delete({"id": licitacao_id}, projection={"_id": 0, "anexos": 1})
+    if not existing:
         raise HTTPException(status_code=404, detail="Licitação não encontrada")
+    for anexo in existing.get("anexos", []):
+        await descartar_anexo(anexo, os.path.join(UPLOAD_DIR, licitacao_id))
     return {"message": "Licitação excluída com sucesso"}
 
 
@@ -2924,30 +5458,30 @@ async def add_evento_agenda(licitacao_id: str, evento: EventoAgenda, current_use
     
     evento_doc = {
         "id": str(uuid.uuid4()),
-        "data": evento.data.isoformat(),
+        "data": evento.data,
         "horario": evento.horario,
         "tipo": evento.tipo,
         "descricao": evento.descricao,
         "status": evento.status,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     eventos = existing.get("eventos", [])
     eventos.append(evento_doc)
     
     # Ordenar eventos por data
-    eventos.sort(key=lambda x: x.get("data", ""))
+    eventos.sort(key=lambda x: _chave_data(x.get("data")))
     
     historico = existing.get("historico", [])
     historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "usuario": current_user.email,
         "acao": f"Evento adicionado: {evento.descricao}"
     })
     
     await db.agenda_licitacoes.update_one(
         {"id": licitacao_id},
-        {"$set": {"eventos": eventos, "historico": historico, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"eventos": eventos, "historico": historico, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Evento adicionado com sucesso", "evento": evento_doc}
@@ -2977,14 +5511,14 @@ async def update_evento_status(licitacao_id: str, evento_id: str, status: str, c
     
     historico = existing.get("historico", [])
     historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "usuario": current_user.email,
         "acao": f"Status do evento alterado para: {status}"
     })
     
     await db.agenda_licitacoes.update_one(
         {"id": licitacao_id},
-        {"$set": {"eventos": eventos, "historico": historico, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"eventos": eventos, "historico": historico, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Status do evento atualizado"}
@@ -3002,14 +5536,14 @@ async def delete_evento_agenda(licitacao_id: str, evento_id: str, current_user:
     
     historico = existing.get("historico", [])
     historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "usuario": current_user.email,
         "acao": "Evento removido"
     })
     
     await db.agenda_licitacoes.update_one(
         {"id": licitacao_id},
-        {"$set": {"eventos": eventos, "historico": historico, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"eventos": eventos, "historico": historico, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Evento excluído com sucesso"}
@@ -3029,7 +5563,7 @@ async def add_anexo_agenda(licitacao_id: str, anexo: Dict[str, Any], current_use
         "url": anexo.get("url", ""),
         "tipo": anexo.get("tipo", "application/pdf"),
         "tamanho": anexo.get("tamanho", 0),
-        "uploaded_at": datetime.now(timezone.utc).isoformat()
+        "uploaded_at": datetime.now(timezone.utc)
     }
     
     anexos = existing.get("anexos", [])
@@ -3037,14 +5571,14 @@ async def add_anexo_agenda(licitacao_id: str, anexo: Dict[str, Any], current_use
     
     historico = existing.get("historico", [])
     historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
+        "data": datetime.now(timezone.utc),
         "usuario": current_user.email,
         "acao": f"Anexo adicionado: {anexo_doc['nome']}"
     })
     
     await db.agenda_licitacoes.update_one(
         {"id": licitacao_id},
-        {"$set": {"anexos": anexos, "historico": historico, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"anexos": anexos, "historico": historico, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Anexo adicionado com sucesso", "anexo": anexo_doc}
@@ -3053,24 +5587,26 @@ async def add_anexo_agenda(licitacao_id: str, anexo: Dict[str, Any], current_use
 @api_router.delete("/agenda-licitacoes/{licitacao_id}/anexos/{anexo_id}")
 async def delete_anexo_agenda(licitacao_id: str, anexo_id: str, current_user: User = Depends(get_current_user)):
     """Excluir anexo"""
-    existing = await db.agenda_licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
+    existing = await db.agenda_licitacoes.find_one_and_update(
+        {"id": licitacao_id},
+        {
+            "$pull": {"anexos": {"id": anexo_id}},
+            "$push": {"historico": {
+                "data": datetime.now(timezone.utc),
+                "usuario": current_user.email,
+                "acao": "Anexo removido"
+            }},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+        },
+        projection={"_id": 0, "anexos": 1}
+    )
     if not existing:
         raise HTTPException(status_code=404, detail="Licitação não encontrada")
     
-    anexos = existing.get("anexos", [])
-    anexos = [a for a in anexos if a.get("id") != anexo_id]
-    
-    historico = existing.get("historico", [])
-    historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
-        "usuario": current_user.email,
-        "acao": "Anexo removido"
-    })
-    
-    await db.agenda_licitacoes.update_one(
-        {"id": licitacao_id},
-        {"$set": {"anexos": anexos, "historico": historico, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    # find_one_and_update devolve o documento anterior: o anexo removido ainda está nele
+    for anexo in existing.get("anexos", []):
+        if anexo.get("id") == anexo_id:
+            await descartar_anexo(anexo, os.path.join(UPLOAD_DIR, licitacao_id))
     
     return {"message": "Anexo excluído com sucesso"}
 
@@ -3115,96 +5651,885 @@ async def upload_anexo_agenda(
     current_user: User = Depends(get_current_user)
 ):
     """Upload de arquivo (Edital PDF) para uma licitação da agenda"""
-    existing = await db.agenda_licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
+    existing = await db.agenda_licitacoes.find_one({"id": licitacao_id}, {"_id": 0, "id": 1})
     if not existing:
         raise HTTPException(status_code=404, detail="Licitação não encontrada")
     
-    # Validar tipo de arquivo
-    allowed_types = ["application/pdf", "application/msword", 
-                     "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                     "image/jpeg", "image/png"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Tipo de arquivo não permitido. Use PDF, DOC, DOCX, JPG ou PNG.")
-    
-    # Criar diretório para a licitação
-    lic_dir = os.path.join(UPLOAD_DIR, licitacao_id)
-    os.makedirs(lic_dir, exist_ok=True)
-    
-    # Gerar nome único para o arquivo
-    file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1] if file.filename else ".pdf"
-    file_name = f"{file_id}{file_ext}"
-    file_path = os.path.join(lic_dir, file_name)
-    
-    # Salvar arquivo
-    try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao salvar arquivo: {str(e)}")
+    gravado = await salvar_upload(file, "edital")
     
     # Criar registro do anexo
-    anexo_doc = {
-        "id": file_id,
-        "nome": file.filename,
-        "nome_arquivo": file_name,
-        "tipo": file.content_type,
-        "tamanho": os.path.getsize(file_path),
-        "uploaded_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    anexos = existing.get("anexos", [])
-    anexos.append(anexo_doc)
-    
-    historico = existing.get("historico", [])
-    historico.append({
-        "data": datetime.now(timezone.utc).isoformat(),
-        "usuario": current_user.email,
-        "acao": f"Anexo adicionado: {file.filename}"
-    })
+    anexo_doc = _doc_anexo(str(uuid.uuid4()), file.filename, file.content_type, gravado["tamanho"], gravado["sha256"])
     
-    await db.agenda_licitacoes.update_one(
-        {"id": licitacao_id},
-        {"$set": {"anexos": anexos, "historico": historico, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    await anexar_edital(licitacao_id, anexo_doc, current_user.email)
     
     return {"message": "Arquivo enviado com sucesso", "anexo": anexo_doc}
 
 
 @api_router.get("/agenda-licitacoes/{licitacao_id}/anexos/{anexo_id}/download")
-async def download_anexo_agenda(licitacao_id: str, anexo_id: str, current_user: User = Depends(get_current_user)):
-    """Download de um anexo"""
-    from fastapi.responses import FileResponse
-    
-    existing = await db.agenda_licitacoes.find_one({"id": licitacao_id}, {"_id": 0})
+@sem_compressao
+async def download_anexo_agenda(
+    licitacao_id: str,
+    anexo_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Download de um anexo (ETag, 304 e Range)"""
+    # $elemMatch traz só o anexo pedido, sem carregar o restante da licitação
+    existing = await db.agenda_licitacoes.find_one(
+        {"id": licitacao_id},
+        {"_id": 0, "anexos": {"$elemMatch": {"id": anexo_id}}}
+    )
     if not existing:
         raise HTTPException(status_code=404, detail="Licitação não encontrada")
     
-    anexo = next((a for a in existing.get("anexos", []) if a.get("id") == anexo_id), None)
-    if not anexo:
+    anexos = existing.get("anexos") or []
+    if not anexos:
         raise HTTPException(status_code=404, detail="Anexo não encontrado")
     
-    file_path = os.path.join(UPLOAD_DIR, licitacao_id, anexo.get("nome_arquivo", ""))
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado no servidor")
+    caminho = _caminho_anexo(anexos[0], os.path.join(UPLOAD_DIR, licitacao_id))
+    return await responder_anexo(request, anexos[0], caminho, ANEXO_CACHE_IMUTAVEL)
+
+
+# ==================== MIGRAÇÃO DE DATAS ====================
+# Converte campos de data gravados como string ISO em BSON date. Idempotente e retomável:
+# o progresso (último _id processado) fica em migracoes, e documentos já convertidos
+# deixam de casar com o filtro $type: "string".
+
+CAMPOS_DATA: Dict[str, List[str]] = {
+    "users": ["created_at"],
+    "clientes": ["created_at", "resumo_compras.ultimo_pedido", "ocorrencias.data"],
+    "dados_pagamento": ["created_at"],
+    "produtos": ["created_at"],
+    "pedidos": ["data", "created_at"],
+    "orcamentos": ["data", "created_at", "updated_at", "data_cobrar_resposta"],
+    "licitacoes": [
+        "data_empenho", "previsao_fornecimento", "fornecimento_efetivo", "previsao_pagamento", "created_at",
+        "contrato.data_inicio", "contrato.data_fim",
+        "fornecimentos.data_fornecimento", "fornecimentos.created_at",
+    ],
+    "fornecimentos": ["data_fornecimento", "created_at"],
+    "despesas": ["data_despesa", "data_vencimento", "created_at", "boleto.uploaded_at"],
+    "fornecedores": ["created_at"],
+    "vendedores": ["created_at"],
+    "caixa": ["updated_at"],
+    "agenda_licitacoes": [
+        "data_disputa", "created_at", "updated_at",
+        "eventos.data", "eventos.created_at", "historico.data", "anexos.uploaded_at",
+    ],
+}
+
+MIGRACAO_LOTE = 500
+
+
+def _converter_campo_data(doc: Dict[str, Any], caminho: str) -> bool:
+    """Converte in-place o campo (ou subcampo de dict/lista) indicado por caminho; retorna se mudou"""
+    raiz, _, sub = caminho.partition(".")
+    valor = doc.get(raiz)
+    if not sub:
+        if isinstance(valor, str) and valor:
+            convertido = _como_datetime(valor)
+            if convertido is not None:
+                doc[raiz] = convertido
+                return True
+        return False
+    alvos = valor if isinstance(valor, list) else [valor]
+    mudou = False
+    for alvo in alvos:
+        if isinstance(alvo, dict):
+            mudou = _converter_campo_data(alvo, sub) or mudou
+    return mudou
+
+
+async def migrar_datas_para_bson() -> Dict[str, int]:
+    """Migra todas as coleções de CAMPOS_DATA; pode ser interrompida e reexecutada"""
+    from pymongo import UpdateOne
+    
+    convertidos = {}
+    for colecao, campos in CAMPOS_DATA.items():
+        chave = f"datas_bson:{colecao}"
+        progresso = await db.migracoes.find_one({"_id": chave}) or {}
+        if progresso.get("concluida"):
+            continue
+        
+        filtro = {"$or": [{campo: {"$type": "string"}} for campo in campos]}
+        if progresso.get("ultimo_id"):
+            filtro = {"$and": [filtro, {"_id": {"$gt": progresso["ultimo_id"]}}]}
+        raizes = {campo.split(".")[0] for campo in campos}
+        
+        total = 0
+        cursor = db[colecao].find(filtro, {raiz: 1 for raiz in raizes}).sort("_id", 1).batch_size(MIGRACAO_LOTE)
+        lote = []
+        ultimo_id = None
+        async for doc in cursor:
+            ultimo_id = doc["_id"]
+            alterados = {campo.split(".")[0] for campo in campos if _converter_campo_data(doc, campo)}
+            if alterados:
+                lote.append(UpdateOne({"_id": doc["_id"]}, {"$set": {raiz: doc[raiz] for raiz in alterados}}))
+            if len(lote) >= MIGRACAO_LOTE:
+                await db[colecao].bulk_write(lote, ordered=False)
+                total += len(lote)
+                lote = []
+                await db.migracoes.update_one({"_id": chave}, {"$set": {"ultimo_id": ultimo_id}}, upsert=True)
+        if lote:
+            await db[colecao].bulk_write(lote, ordered=False)
+            total += len(lote)
+        
+        await db.migracoes.update_one(
+            {"_id": chave},
+            {"$set": {"ultimo_id": ultimo_id, "concluida": True, "concluida_em": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        convertidos[colecao] = total
+        if total and colecao in COLECOES_VERSIONADAS:
+            await incrementar_versao(colecao)
+        if total:
+            logger.info(f"Migração de datas: {total} documentos convertidos em {colecao}")
+    return convertidos
+
+
+# ==================== MIGRAÇÕES DE SCHEMA ====================
+# Cada coleção tem uma lista ordenada de passos; o passo N leva um documento da versão N-1
+# para N e devolve apenas os campos que precisa gravar. Documentos novos já são gravados na
+# versão atual, o migrador de startup atualiza os antigos em lote, e as leituras só aplicam
+# os passos em documentos que ainda não foram migrados.
+
+def _pedido_v1(pedido: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos que pedidos antigos não tinham"""
+    mudancas = {}
+    if "despesas_totais" not in pedido:
+        mudancas["despesas_totais"] = pedido.get("frete", 0) + pedido.get("outras_despesas", 0)
+    if pedido.get("vendedor") is None:
+        mudancas["vendedor"] = ""
+    if "repassar_frete" not in pedido:
+        mudancas["repassar_frete"] = False
+    itens = pedido.get("itens") or []
+    if any("lucro_item" not in item or "despesas" not in item for item in itens):
+        mudancas["itens"] = [{"lucro_item": 0.0, "despesas": 0.0, **item} for item in itens]
+    return mudancas
+
+
+def _orcamento_v1(orc: Dict[str, Any]) -> Dict[str, Any]:
+    """Desconto, frete, outras despesas e cobrança adicionados ao orçamento"""
+    mudancas = {}
+    if "valor_final" not in orc:
+        mudancas["valor_final"] = orc.get("valor_total", 0) - orc.get("desconto", 0)
+    padroes = {
+        "desconto": 0.0,
+        "valor_frete": 0.0,
+        "repassar_frete": True,
+        "outras_despesas": 0.0,
+        "repassar_outras_despesas": False,
+        "cliente_cobrado": False,
+    }
+    for campo, valor in padroes.items():
+        if campo not in orc:
+            mudancas[campo] = valor
+    return mudancas
+
+
+def _licitacao_v1(lic: Dict[str, Any]) -> Dict[str, Any]:
+    """Licitações anteriores ao modelo de contrato/fornecimentos"""
+    mudancas = {}
+    if "status_pagamento" not in lic:
+        mudancas["status_pagamento"] = lic.get("status", "pendente")
+    produtos = lic.get("produtos", [])
+    if "valor_total_venda" not in lic:
+        mudancas["valor_total_venda"] = sum(p.get("preco_venda", 0) * p.get("quantidade_contratada", p.get("quantidade_empenhada", 0)) for p in produtos)
+    if "valor_total_compra" not in lic:
+        mudancas["valor_total_compra"] = sum(p.get("preco_compra", 0) * p.get("quantidade_contratada", p.get("quantidade_empenhada", 0)) for p in produtos)
+    for campo in ("frete", "impostos", "outras_despesas"):
+        if campo not in lic:
+            mudancas[campo] = 0.0
+    return mudancas
+
+
+def _licitacao_v2(lic: Dict[str, Any]) -> Dict[str, Any]:
+    """Métricas derivadas passam a ser gravadas em vez de calculadas na leitura"""
+    return calcular_metricas_licitacao(lic)
+
+
+def _licitacao_v3(lic: Dict[str, Any]) -> Dict[str, Any]:
+    """despesas_totais/lucro_total voltam a ser do contrato; o realizado vai para campos próprios"""
+    return calcular_metricas_licitacao(lic)
+
+
+MIGRACOES_SCHEMA: Dict[str, List[Any]] = {
+    "pedidos": [_pedido_v1],
+    "orcamentos": [_orcamento_v1],
+    "licitacoes": [_licitacao_v1, _licitacao_v2, _licitacao_v3],
+}
+
+SCHEMA_VERSION = {colecao: len(passos) for colecao, passos in MIGRACOES_SCHEMA.items()}
+
+
+def aplicar_schema(colecao: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Aplica in-place os passos pendentes e retorna os campos alterados (incluindo schema_version)"""
+    versao = doc.get("schema_version", 0)
+    alvo = SCHEMA_VERSION[colecao]
+    mudancas = {}
+    for passo in MIGRACOES_SCHEMA[colecao][versao:alvo]:
+        alteracao = passo(doc)
+        doc.update(alteracao)
+        mudancas.update(alteracao)
+    if versao != alvo:
+        doc["schema_version"] = alvo
+        mudancas["schema_version"] = alvo
+    return mudancas
+
+
+def normalizar_leitura(colecao: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Fallback para documentos que o migrador ainda não alcançou"""
+    if doc.get("schema_version", 0) < SCHEMA_VERSION[colecao]:
+        aplicar_schema(colecao, doc)
+    return doc
+
+
+def _contribuicao_rollup(colecao: str, doc: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], Dict[str, float]]]:
+    """Bucket e valores que o documento soma nos rollups (None para coleções fora dos rollups)"""
+    if colecao == "pedidos":
+        return chave_rollup_pedido(doc, doc.get("cliente_cidade")), _valores_rollup_pedido(doc)
+    if colecao == "licitacoes":
+        return chave_rollup_licitacao(doc), _valores_rollup_licitacao(doc)
+    return None
+
+
+ROLLUP_POR_COLECAO = {"pedidos": aplicar_rollup_pedido, "licitacoes": aplicar_rollup_licitacao}
+
+
+async def migrar_schema() -> Dict[str, int]:
+    """Leva todos os documentos à versão atual em lotes de bulk_write.
     
-    return FileResponse(
-        file_path, 
-        filename=anexo.get("nome", "anexo"),
-        media_type=anexo.get("tipo", "application/octet-stream")
-    )
+    Documentos cuja migração muda valores somados nos rollups (ex.: lucro_total das
+    licitações) são gravados um a um, com o $inc da diferença nos rollups logo depois,
+    em vez de um rebuild completo concorrente com as escritas.
+    """
+    from pymongo import UpdateOne
+    
+    migrados = {}
+    for colecao, alvo in SCHEMA_VERSION.items():
+        filtro = {"schema_version": {"$not": {"$gte": alvo}}}
+        total = 0
+        lote = []
+        async for doc in db[colecao].find(filtro).batch_size(MIGRACAO_LOTE):
+            original = dict(doc)
+            mudancas = aplicar_schema(colecao, doc)
+            
+            # Só grava se os campos lidos não mudaram no meio tempo; senão fica para a próxima execução
+            guarda = {"_id": doc["_id"], **filtro}
+            for campo in mudancas:
+                if campo == "schema_version":
+                    continue
+                guarda[campo] = original[campo] if campo in original else {"$exists": False}
+            
+            novo = {**original, **mudancas}
+            if _contribuicao_rollup(colecao, original) != _contribuicao_rollup(colecao, novo):
+                resultado = await db[colecao].update_one(guarda, {"$set": mudancas})
+                if resultado.modified_count:
+                    await ROLLUP_POR_COLECAO[colecao](original, -1)
+                    await ROLLUP_POR_COLECAO[colecao](novo)
+                    total += 1
+                continue
+            lote.append(UpdateOne(guarda, {"$set": mudancas}))
+            
+            if len(lote) >= MIGRACAO_LOTE:
+                resultado = await db[colecao].bulk_write(lote, ordered=False)
+                total += resultado.modified_count
+                lote = []
+        if lote:
+            resultado = await db[colecao].bulk_write(lote, ordered=False)
+            total += resultado.modified_count
+        
+        migrados[colecao] = total
+        if total:
+            logger.info(f"Schema de {colecao}: {total} documentos migrados para a versão {alvo}")
+    
+    migrados["fornecimentos"] = await migrar_fornecimentos_embutidos()
+    migrados["historico_clientes"] = await migrar_historico_clientes()
+    return migrados
+
+
+async def migrar_fornecimentos_embutidos() -> int:
+    """Move o array licitacoes.fornecimentos para a coleção fornecimentos"""
+    from pymongo import UpdateOne
+    
+    movidos = 0
+    async for lic in db.licitacoes.find({"fornecimentos": {"$exists": True}}, {"_id": 1, "id": 1, "fornecimentos": 1}):
+        fornecimentos = lic.get("fornecimentos") or []
+        if fornecimentos:
+            # Upsert por id: se a migração for interrompida, reexecutar não duplica
+            await db.fornecimentos.bulk_write([
+                UpdateOne({"id": f["id"]}, {"$setOnInsert": {**f, "licitacao_id": lic["id"]}}, upsert=True)
+                for f in fornecimentos
+            ], ordered=False)
+        # $inc em vez de $set: fornecimentos novos já podem ter somado nos contadores
+        await db.licitacoes.update_one(
+            {"_id": lic["_id"], "fornecimentos": {"$exists": True}},
+            {
+                "$unset": {"fornecimentos": ""},
+                "$inc": {
+                    "quantidade_fornecimentos": len(fornecimentos),
+                    "despesas_fornecimentos": sum(f.get("total_despesas", 0) for f in fornecimentos),
+                },
+            }
+        )
+        movidos += len(fornecimentos)
+    if movidos:
+        logger.info(f"Fornecimentos movidos para a coleção própria: {movidos}")
+    return movidos
+
+
+def _copiar_para_temporario(caminho: str) -> str:
+    """Hard link (ou cópia, entre sistemas de arquivos) do arquivo legado num temporário do armazenamento"""
+    temporario = _temporario_blob()
+    try:
+        os.link(caminho, temporario)
+        # O link herda o mtime antigo; sem isso a coleta trataria o temporário como esquecido
+        os.utime(temporario)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(caminho, temporario)
+    return temporario
+
+
+def _remover_legado(caminho: str):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+async def _migrar_arquivo_para_blob(caminho: str, anexo: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Copia um arquivo legado para o armazenamento por hash; None se o arquivo não existir.
+    
+    O original fica no lugar: só é apagado depois que o documento passa a apontar para o
+    blob, então uma falha (ou outro worker migrando o mesmo anexo) nunca deixa o documento
+    sem arquivo.
+    """
+    try:
+        temporario = await asyncio.to_thread(_copiar_para_temporario, caminho)
+    except FileNotFoundError:
+        return None
+    sha256 = await asyncio.to_thread(_sha256_arquivo, temporario)
+    tamanho = await asyncio.to_thread(os.path.getsize, temporario)
+    await armazenar_blob(temporario, sha256, tamanho, anexo.get("tipo"))
+    return {"sha256": sha256, "tamanho": tamanho}
+
+
+async def _migrar_anexo(caminho: str, anexo: Dict[str, Any], colecao: str, filtro: Dict[str, Any], campos: Dict[str, str], **opcoes) -> bool:
+    """Blob primeiro, depois o documento, por último o arquivo legado; erros ficam restritos ao anexo"""
+    try:
+        blob = await _migrar_arquivo_para_blob(caminho, anexo)
+        if not blob:
+            return False
+        result = await db[colecao].update_one(
+            filtro,
+            {"$set": {campos["sha256"]: blob["sha256"], campos["tamanho"]: blob["tamanho"]},
+             "$unset": {campos["nome_arquivo"]: ""}},
+            **opcoes
+        )
+        if result.modified_count == 0:
+            # Anexo trocado, removido ou já migrado por outro worker no meio tempo
+            await liberar_blob(blob["sha256"])
+            return False
+        await asyncio.to_thread(_remover_legado, caminho)
+        return True
+    except Exception as e:
+        logger.error(f"Falha ao migrar o anexo {anexo.get('id')} ({caminho}): {e}")
+        return False
+
+
+async def migrar_anexos_para_blobs() -> int:
+    """Passa boletos e anexos da agenda gravados por nome_arquivo para o armazenamento por hash.
+    
+    Idempotente: só casa documentos que ainda têm nome_arquivo. Arquivos ausentes no disco
+    ficam como estão (o download continua respondendo 404).
+    """
+    movidos = 0
+    pasta_boletos = os.path.join(UPLOAD_DIR, "boletos")
+    async for desp in db.despesas.find({"boleto.nome_arquivo": {"$exists": True}}, {"_id": 0, "id": 1, "boleto": 1}):
+        boleto = desp["boleto"]
+        movidos += await _migrar_anexo(
+            os.path.join(pasta_boletos, boleto["nome_arquivo"]), boleto, "despesas",
+            {"id": desp["id"], "boleto.id": boleto.get("id"), "boleto.nome_arquivo": boleto["nome_arquivo"]},
+            {"sha256": "boleto.sha256", "tamanho": "boleto.tamanho", "nome_arquivo": "boleto.nome_arquivo"},
+        )
+    
+    async for lic in db.agenda_licitacoes.find({"anexos.nome_arquivo": {"$exists": True}}, {"_id": 0, "id": 1, "anexos": 1}):
+        for anexo in lic.get("anexos", []):
+            if not anexo.get("nome_arquivo"):
+                continue
+            movidos += await _migrar_anexo(
+                os.path.join(UPLOAD_DIR, lic["id"], anexo["nome_arquivo"]), anexo, "agenda_licitacoes",
+                {"id": lic["id"]},
+                {"sha256": "anexos.$[a].sha256", "tamanho": "anexos.$[a].tamanho", "nome_arquivo": "anexos.$[a].nome_arquivo"},
+                array_filters=[{"a.id": anexo.get("id"), "a.nome_arquivo": anexo["nome_arquivo"]}],
+            )
+    if movidos:
+        logger.info(f"Anexos movidos para o armazenamento por hash: {movidos}")
+    return movidos
+
+
+# ==================== ÍNDICES ====================
+
+def _indice_por_id(unique: bool = True) -> Dict[str, Any]:
+    return {"keys": [("id", 1)], "unique": unique}
+
+
+# Índices declarados por coleção. Cada entrada: keys (lista de (campo, direção)) e opções do create_index.
+INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        _indice_por_id(),
+        {"keys": [("email", 1)], "unique": True},
+    ],
+    "clientes": [
+        _indice_por_id(),
+        {"keys": [("codigo", 1)]},
+        # /search antes do índice em memória carregar (ver BUSCA_FONTES)
+        {"keys": [(c, "text") for c in BUSCA_FONTES["clientes"]["campos"]], "default_language": "portuguese"},
+    ],
+    "produtos": [
+        _indice_por_id(),
+        {"keys": [("codigo", 1)]},
+        {"keys": [(c, "text") for c in BUSCA_FONTES["produtos"]["campos"]], "default_language": "portuguese"},
+    ],
+    "pedidos": [
+        _indice_por_id(),
+        # Paginação por cursor e filtros de /pedidos
+        {"keys": [("data", -1), ("id", -1)]},
+        {"keys": [("status", 1), ("data", -1), ("id", -1)]},
+        {"keys": [("vendedor", 1), ("data", -1), ("id", -1)]},
+        {"keys": [("cliente_id", 1), ("data", -1), ("id", -1)]},
+        {"keys": [("tipo_venda", 1), ("data", -1), ("id", -1)]},
+        {"keys": [("numero", 1)]},
+    ],
+    "orcamentos": [
+        _indice_por_id(),
+        {"keys": [("data", -1)]},
+        {"keys": [("numero", 1)]},
+    ],
+    "licitacoes": [
+        _indice_por_id(),
+        {"keys": [("data_empenho", -1)]},
+    ],
+    "fornecimentos": [
+        _indice_por_id(),
+        {"keys": [("licitacao_id", 1), ("produto_contrato_id", 1), ("data_fornecimento", 1)]},
+    ],
+    "despesas": [
+        _indice_por_id(),
+        {"keys": [("data_vencimento", -1)]},
+        # Filtro de período dos relatórios e ordenação da exportação
+        {"keys": [("data_despesa", 1)]},
+        {"keys": [("status", 1), ("data_vencimento", 1)]},
+    ],
+    "agenda_licitacoes": [
+        _indice_por_id(),
+        {"keys": [("data_disputa", 1)]},
+    ],
+    "fornecedores": [
+        _indice_por_id(),
+        {"keys": [("categoria", 1)]},
+        {"keys": [(c, "text") for c in BUSCA_FONTES["fornecedores"]["campos"]], "default_language": "portuguese"},
+    ],
+    "vendedores": [
+        _indice_por_id(),
+        {"keys": [("email", 1)]},
+    ],
+    "dados_pagamento": [
+        _indice_por_id(),
+    ],
+    "caixa": [
+        _indice_por_id(),
+    ],
+    "caixa_movimentos": [
+        _indice_por_id(),
+        {"keys": [("caixa_id", 1), ("data", 1)]},
+    ],
+    "caixa_snapshots": [
+        {"keys": [("caixa_id", 1), ("data", -1)], "unique": True},
+    ],
+    "uploads": [
+        _indice_por_id(),
+        {"keys": [("status", 1), ("updated_at", 1)]},
+    ],
+    "blobs": [
+        # Varredura da coleta: refs <= 0 e updated_at antes da carência
+        {"keys": [("refs", 1), ("updated_at", 1)]},
+    ],
+    "notificacoes_enviadas": [
+        # O registro só precisa durar enquanto a despesa está na janela de aviso
+        {"keys": [("created_at", 1)], "expireAfterSeconds": 30 * 86400},
+    ],
+}
+
+# Consultas quentes que nunca devem cair em COLLSCAN: (coleção, filtro, ordenação)
+HOT_QUERIES: List[Dict[str, Any]] = [
+    {"colecao": "users", "filtro": {"email": "x@x.com"}},
+    {"colecao": "clientes", "filtro": {"id": "x"}},
+    {"colecao": "clientes", "filtro": {"codigo": "CLI-000001"}},
+    {"colecao": "produtos", "filtro": {"id": "x"}},
+    {"colecao": "produtos", "filtro": {"codigo": "x"}},
+    {"colecao": "pedidos", "filtro": {"id": "x"}},
+    {"colecao": "pedidos", "filtro": {}, "sort": [("data", -1), ("id", -1)]},
+    {"colecao": "pedidos", "filtro": {"status": "pendente"}, "sort": [("data", -1), ("id", -1)]},
+    {"colecao": "pedidos", "filtro": {"cliente_id": "x"}, "sort": [("data", -1), ("id", -1)]},
+    {"colecao": "orcamentos", "filtro": {"id": "x"}},
+    {"colecao": "orcamentos", "filtro": {}, "sort": [("data", -1)]},
+    {"colecao": "licitacoes", "filtro": {"id": "x"}},
+    {"colecao": "licitacoes", "filtro": {}, "sort": [("data_empenho", -1)]},
+    {"colecao": "fornecimentos", "filtro": {"licitacao_id": "x"}},
+    {"colecao": "despesas", "filtro": {"id": "x"}},
+    {"colecao": "despesas", "filtro": {}, "sort": [("data_vencimento", -1)]},
+    {"colecao": "despesas", "filtro": {}, "sort": [("data_despesa", 1)]},
+    {"colecao": "despesas", "filtro": {"status": "pendente", "data_vencimento": {"$gte": datetime(2026, 1, 1), "$lt": datetime(2026, 1, 3)}},
+     "sort": [("data_vencimento", 1)]},
+    {"colecao": "agenda_licitacoes", "filtro": {"id": "x"}},
+    {"colecao": "agenda_licitacoes", "filtro": {}, "sort": [("data_disputa", 1)]},
+    {"colecao": "vendedores", "filtro": {"email": "x@x.com"}},
+    {"colecao": "caixa_movimentos", "filtro": {"caixa_id": "x"}, "sort": [("data", -1)]},
+    {"colecao": "caixa_snapshots", "filtro": {"caixa_id": "x", "data": {"$lte": datetime(2026, 1, 1)}}, "sort": [("data", -1)]},
+]
+
+# Último relatório de divergência entre índices declarados e existentes
+index_report: Dict[str, Any] = {"status": "pendente", "colecoes": {}}
+
+
+def _nome_indice(keys: List[Any]) -> str:
+    return "_".join(f"{campo}_{direcao}" for campo, direcao in keys)
+
+
+async def ensure_indexes() -> Dict[str, Any]:
+    """Cria índices ausentes e registra divergências (índices extras ou com opções diferentes)"""
+    relatorio = {}
+    for colecao, declarados in INDEXES.items():
+        existentes = await db[colecao].index_information()
+        info = {"criados": [], "divergentes": [], "extras": [], "erros": []}
+        nomes_declarados = set()
+        for spec in declarados:
+            keys = spec["keys"]
+            nome = _nome_indice(keys)
+            nomes_declarados.add(nome)
+            unique = spec.get("unique", False)
+            ttl = spec.get("expireAfterSeconds")
+            atual = existentes.get(nome)
+            if atual is None:
+                try:
+                    opcoes = {k: spec[k] for k in ("expireAfterSeconds", "default_language") if k in spec}
+                    await db[colecao].create_index(keys, name=nome, unique=unique, background=True, **opcoes)
+                    info["criados"].append(nome)
+                except Exception as e:
+                    # Ex.: duplicatas legadas impedindo um índice único
+                    info["erros"].append(f"{nome}: {e}")
+            elif bool(atual.get("unique", False)) != unique or atual.get("expireAfterSeconds") != ttl:
+                info["divergentes"].append(nome)
+        info["extras"] = [n for n in existentes if n != "_id_" and n not in nomes_declarados]
+        relatorio[colecao] = info
+        
+        if info["criados"]:
+            logger.info(f"Índices criados em {colecao}: {info['criados']}")
+        if info["divergentes"] or info["erros"]:
+            logger.warning(f"Divergência de índices em {colecao}: {info}")
+    
+    index_report["status"] = "ok"
+    index_report["colecoes"] = relatorio
+    return relatorio
+
+
+def _estagios_do_plano(plano: Any) -> List[str]:
+    """Percorre recursivamente um plano do explain() e coleta os nomes dos estágios"""
+    estagios = []
+    if isinstance(plano, dict):
+        if "stage" in plano:
+            estagios.append(plano["stage"])
+        for valor in plano.values():
+            estagios.extend(_estagios_do_plano(valor))
+    elif isinstance(plano, list):
+        for item in plano:
+            estagios.extend(_estagios_do_plano(item))
+    return estagios
+
+
+async def verificar_consultas_quentes() -> List[Dict[str, Any]]:
+    """Executa explain() em cada consulta de HOT_QUERIES e devolve as que resultaram em COLLSCAN"""
+    falhas = []
+    for consulta in HOT_QUERIES:
+        cursor = db[consulta["colecao"]].find(consulta["filtro"])
+        if consulta.get("sort"):
+            cursor = cursor.sort(consulta["sort"])
+        plano = await cursor.explain()
+        estagios = _estagios_do_plano(plano.get("queryPlanner", {}).get("winningPlan", {}))
+        if "COLLSCAN" in estagios:
+            falhas.append({**consulta, "estagios": estagios})
+    return falhas
+
+
+@api_router.get("/sistema/metricas")
+async def get_metricas_sistema(current_user: User = Depends(get_current_user)):
+    """Contadores internos de cache e filas do processo atual"""
+    return {
+        "cache_usuarios": user_cache.stats(),
+        "cache_perfis": perfil_cache.stats(),
+        "hash_senhas": pool_hash.stats()
+    }
+
+
+@api_router.get("/sistema/indices")
+async def get_index_report(current_user: User = Depends(get_current_user)):
+    """Relatório de índices criados/divergentes desde o último startup"""
+    return index_report
+
+
+# ==================== COMPRESSÃO ====================
+# Relatórios e listagens grandes saem em JSON e a equipe de vendas acessa por rede móvel.
+# A codificação é negociada pelo Accept-Encoding (br quando o brotli está instalado, senão gzip);
+# respostas abaixo de COMPRESSAO_MINIMO_BYTES, tipos já comprimidos, 206/304 e rotas marcadas
+# com @sem_compressao passam intactas. Respostas em streaming (exportações) são comprimidas
+# bloco a bloco, com flush a cada bloco para o cliente receber os dados conforme saem.
+
+COMPRESSAO_MINIMO_BYTES = int(os.environ.get("COMPRESSAO_MINIMO_BYTES", "1024"))
+COMPRESSAO_GZIP_NIVEL = int(os.environ.get("COMPRESSAO_GZIP_NIVEL", "6"))
+COMPRESSAO_BROTLI_QUALIDADE = int(os.environ.get("COMPRESSAO_BROTLI_QUALIDADE", "4"))
+TIPOS_COMPRIMIVEIS = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+def escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    """Codificação preferida pelo cliente entre as suportadas (q-values; br desempata com gzip)"""
+    aceitas: Dict[str, float] = {}
+    for parte in accept_encoding.split(","):
+        nome, _, parametros = parte.partition(";")
+        nome = nome.strip().lower()
+        if not nome:
+            continue
+        q = 1.0
+        for parametro in parametros.split(";"):
+            chave, _, valor = parametro.partition("=")
+            if chave.strip().lower() == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        aceitas[nome] = q
+    
+    melhor, melhor_q = None, 0.0
+    for nome in (["br", "gzip"] if BROTLI_AVAILABLE else ["gzip"]):
+        q = aceitas.get(nome, aceitas.get("*", 0.0))
+        if q > melhor_q:
+            melhor, melhor_q = nome, q
+    return melhor
+
+
+class Compressor:
+    """Compressor incremental de gzip ou brotli"""
+    
+    def __init__(self, codificacao: str):
+        self.brotli = codificacao == "br"
+        if self.brotli:
+            self._obj = brotli.Compressor(quality=COMPRESSAO_BROTLI_QUALIDADE)
+        else:
+            # wbits=31: formato gzip (cabeçalho + CRC), não deflate cru
+            self._obj = zlib.compressobj(COMPRESSAO_GZIP_NIVEL, zlib.DEFLATED, 31)
+    
+    def parcial(self, dados: bytes) -> bytes:
+        if self.brotli:
+            return self._obj.process(dados) + self._obj.flush()
+        return self._obj.compress(dados) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+    
+    def final(self, dados: bytes = b"") -> bytes:
+        if self.brotli:
+            return self._obj.process(dados) + self._obj.finish()
+        return self._obj.compress(dados) + self._obj.flush()
+
+
+class CompressaoMiddleware:
+    """Middleware ASGI de compressão negociada com tamanho mínimo"""
+    
+    def __init__(self, app, minimo: int = COMPRESSAO_MINIMO_BYTES):
+        self.app = app
+        self.minimo = minimo
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        codificacao = escolher_codificacao(Headers(scope=scope).get("accept-encoding", ""))
+        if codificacao is None:
+            await self.app(scope, receive, send)
+            return
+        
+        inicio: Dict[str, Any] = {}
+        estado = {"comprimir": False, "compressor": None}
+        
+        def deve_comprimir(mensagem) -> bool:
+            status_http = mensagem["status"]
+            if status_http < 200 or status_http in (204, 206, 304):
+                return False
+            headers = Headers(raw=mensagem["headers"])
+            if "content-encoding" in headers:
+                return False
+            # O roteador preenche scope["endpoint"] antes de a resposta começar
+            if getattr(scope.get("endpoint"), "sem_compressao", False):
+                return False
+            tipo = headers.get("content-type", "").split(";")[0].strip().lower()
+            return tipo.startswith("text/") or tipo in TIPOS_COMPRIMIVEIS
+        
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                inicio.update(mensagem)
+                estado["comprimir"] = deve_comprimir(mensagem)
+                if not estado["comprimir"]:
+                    await send(mensagem)
+                return
+            if mensagem["type"] != "http.response.body" or not estado["comprimir"]:
+                await send(mensagem)
+                return
+            
+            corpo = mensagem.get("body", b"")
+            mais = mensagem.get("more_body", False)
+            compressor = estado["compressor"]
+            if compressor is None:
+                headers = MutableHeaders(raw=inicio["headers"])
+                headers.add_vary_header("Accept-Encoding")
+                if not mais and len(corpo) < self.minimo:
+                    estado["comprimir"] = False
+                    await send(inicio)
+                    await send(mensagem)
+                    return
+                
+                headers["Content-Encoding"] = codificacao
+                compressor = estado["compressor"] = Compressor(codificacao)
+                if not mais:
+                    corpo = compressor.final(corpo)
+                    headers["Content-Length"] = str(len(corpo))
+                    await send(inicio)
+                    await send({"type": "http.response.body", "body": corpo, "more_body": False})
+                    return
+                if "content-length" in headers:
+                    del headers["content-length"]
+                await send(inicio)
+            
+            dados = compressor.parcial(corpo) if mais else compressor.final(corpo)
+            if dados or not mais:
+                await send({"type": "http.response.body", "body": dados, "more_body": mais})
+        
+        await self.app(scope, receive, enviar)
 
 
 app.include_router(api_router)
 
+app.add_middleware(CompressaoMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Content-Disposition", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
+
+@app.on_event("startup")
+async def startup_indexes():
+    # Não bloqueia o startup: os índices são criados em segundo plano
+    asyncio.create_task(ensure_indexes())
+
+
+@app.on_event("startup")
+async def startup_migrar_datas():
+    asyncio.create_task(migrar_datas_para_bson())
+
+
+@app.on_event("startup")
+async def startup_migrar_schema():
+    # Um worker só por versão de schema. Na primeira execução (coleção rollups vazia) o rebuild
+    # roda no mesmo job, depois da migração: ele lê os documentos já migrados e o $inc das
+    # diferenças aplicado pela migração não se perde no rename. Escritas de pedidos durante
+    # esse rebuild inicial ainda podem ficar de fora (o rename troca a coleção inteira); por
+    # isso ele só roda com a coleção vazia. Fora disso, e se a coleção for apagada depois,
+    # use python server.py rebuild-rollups num horário sem movimento
+    rollups_vazios = await db.rollups.estimated_document_count() == 0
+    chave = json.dumps({"schema": SCHEMA_VERSION, "rollups_iniciais": rollups_vazios}, sort_keys=True)
+    
+    async def migrar():
+        migrados = await migrar_schema()
+        if rollups_vazios:
+            migrados["rollups"] = await rebuild_rollups()
+        return migrados
+    asyncio.create_task(executar_uma_vez("migracao_schema", chave, migrar))
+
+
+@app.on_event("startup")
+async def startup_caixa():
+    async def iniciar():
+        await iniciar_livro_caixa()
+        await loop_snapshots_caixa()
+    asyncio.create_task(iniciar())
+
+
+@app.on_event("startup")
+async def startup_cache_pdf():
+    asyncio.create_task(loop_limpeza_cache_pdf())
+
+
+@app.on_event("startup")
+async def startup_uploads():
+    asyncio.create_task(loop_limpeza_uploads())
+
+
+@app.on_event("startup")
+async def startup_busca():
+    asyncio.create_task(loop_reconstrucao_busca())
+
+
+@app.on_event("startup")
+async def startup_tarefas():
+    for nome in TAREFAS_AGENDADAS:
+        asyncio.create_task(loop_tarefa_agendada(nome))
+
+
+@app.on_event("startup")
+async def startup_blobs():
+    # Tarefas independentes: uma falha na migração não impede a coleta de rodar
+    asyncio.create_task(migrar_anexos_para_blobs())
+    asyncio.create_task(loop_coleta_blobs())
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # Comandos de manutenção: python server.py <comando>
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Comandos de manutenção do XSELL")
+    parser.add_argument("comando", choices=[
+        "rebuild-rollups", "migrate-dates", "migrate-schema", "reconcile-caixa", "migrate-blobs", "gc-blobs",
+        "rebuild-client-summaries",
+    ])
+    args = parser.parse_args()
+    
+    if args.comando == "rebuild-rollups":
+        print(f"Rollups reconstruídos: {asyncio.run(rebuild_rollups())} buckets")
+    elif args.comando == "migrate-dates":
+        print(f"Documentos convertidos: {asyncio.run(migrar_datas_para_bson())}")
+    elif args.comando == "migrate-schema":
+        print(f"Documentos migrados: {asyncio.run(migrar_schema())}")
+    elif args.comando == "reconcile-caixa":
+        print(f"Reconciliação do caixa: {asyncio.run(reconciliar_caixa(corrigir=True))}")
+    elif args.comando == "migrate-blobs":
+        print(f"Anexos movidos: {asyncio.run(migrar_anexos_para_blobs())}")
+    elif args.comando == "gc-blobs":
+        print(f"Coleta de blobs: {asyncio.run(coletar_blobs())}")
+    elif args.comando == "rebuild-client-summaries":
+        print(f"Resumos de compras recalculados: {asyncio.run(reconstruir_resumos_clientes())} clientes")
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+# Mede só a serialização das listagens, sem banco: python backend_bench_serializacao.py [quantidade]
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_bench")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from pydantic import TypeAdapter  # noqa: E402
+
+import server  # noqa: E402
+
+REPETICOES = 20
+
+
+def gerar_pedidos(quantidade):
+    base = datetime(2024, 1, 1)
+    pedidos = []
+    for i in range(quantidade):
+        itens = [{
+            "produto_id": str(uuid.uuid4()),
+            "descricao": f"Produto {j}",
+            "quantidade": 10 + j,
+            "preco_compra": 12.5,
+            "preco_venda": 19.9,
+            "lucro_item": 74.0,
+            "despesas": 0.0,
+        } for j in range(8)]
+        pedidos.append({
+            "id": str(uuid.uuid4()),
+            "numero": f"PED-{i:06d}",
+            "data": base + timedelta(hours=i),
+            "cliente_id": str(uuid.uuid4()),
+            "cliente_nome": f"Cliente {i}",
+            "itens": itens,
+            "frete": 50.0,
+            "despesas_detalhadas": [{"descricao": "Embalagem", "valor": 12.0}],
+            "tipo_venda": "consumidor_final",
+            "vendedor": "Vendedor",
+            "custo_total": 1000.0,
+            "valor_total_venda": 1592.0,
+            "despesas_totais": 62.0,
+            "lucro_total": 530.0,
+            "status": "pendente",
+            "schema_version": server.SCHEMA_VERSION["pedidos"],
+            "created_at": base,
+        })
+    return pedidos
+
+
+def gerar_licitacoes(quantidade):
+    base = datetime(2024, 1, 1)
+    licitacoes = []
+    for i in range(quantidade):
+        produtos = [{
+            "produto_id": str(uuid.uuid4()),
+            "descricao": f"Item {j}",
+            "quantidade_contratada": 100,
+            "quantidade_fornecida": 40,
+            "preco_compra": 8.0,
+            "preco_venda": 11.0,
+        } for j in range(10)]
+        fornecimentos = [{
+            "id": str(uuid.uuid4()),
+            "data": base + timedelta(days=j),
+            "itens": [{"produto_id": p["produto_id"], "quantidade": 4} for p in produtos],
+        } for j in range(5)]
+        licitacoes.append({
+            "id": str(uuid.uuid4()),
+            "contrato": {"numero_contrato": f"CT-{i}", "status": "vigente"},
+            "numero_licitacao": f"PE-{i:04d}/2024",
+            "cidade": "Cidade",
+            "estado": "SP",
+            "orgao_publico": "Prefeitura",
+            "numero_empenho": f"EMP-{i}",
+            "data_empenho": base + timedelta(days=i),
+            "numero_nota_empenho": f"NE-{i}",
+            "produtos": produtos,
+            "fornecimentos": fornecimentos,
+            "valor_total_venda": 11000.0,
+            "valor_total_compra": 8000.0,
+            "lucro_total": 3000.0,
+            "status_pagamento": "pendente",
+            "schema_version": server.SCHEMA_VERSION["licitacoes"],
+            "created_at": base,
+        })
+    return licitacoes
+
+
+def serializar_antes(adaptador, docs):
+    """Caminho anterior: response_model valida, converte em dicts jsonáveis e o json padrão gera o corpo"""
+    validados = adaptador.validate_python(docs)
+    return json.dumps(adaptador.dump_python(validados, mode="json"), ensure_ascii=False).encode()
+
+
+def serializar_depois(modelo, docs):
+    return server.resposta_lista(modelo, docs).body
+
+
+def medir(funcao, *args):
+    funcao(*args)
+    inicio = time.perf_counter()
+    for _ in range(REPETICOES):
+        corpo = funcao(*args)
+    return (time.perf_counter() - inicio) / REPETICOES * 1000, len(corpo)
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    casos = [
+        ("/pedidos", server.Pedido, gerar_pedidos(quantidade)),
+        ("/pedidos?view=summary", server.PedidoResumo, gerar_pedidos(quantidade)),
+        ("/licitacoes", server.Licitacao, gerar_licitacoes(quantidade)),
+        ("/licitacoes?view=summary", server.LicitacaoResumo, gerar_licitacoes(quantidade)),
+    ]
+    print(f"{quantidade} documentos, média de {REPETICOES} execuções")
+    for rota, modelo, docs in casos:
+        adaptador = TypeAdapter(List[modelo])
+        ms_antes, bytes_antes = medir(serializar_antes, adaptador, docs)
+        ms_depois, bytes_depois = medir(serializar_depois, modelo, docs)
+        print(
+            f"{rota:28s} antes {ms_antes:8.2f} ms ({bytes_antes / 1024:8.1f} KiB)"
+            f" | depois {ms_depois:8.2f} ms ({bytes_depois / 1024:8.1f} KiB)"
+            f" | {ms_antes / ms_depois:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
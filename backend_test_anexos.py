@@ -0,0 +1,170 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+# Testa Range/If-Range dos downloads sem banco: python backend_test_anexos.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_test_anexos")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from fastapi import HTTPException  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+import server  # noqa: E402
+
+CONTEUDO = bytes(range(100))
+SHA256 = "a" * 64
+
+
+def requisicao(**cabecalhos):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(nome.replace("_", "-").encode(), valor.encode()) for nome, valor in cabecalhos.items()],
+    })
+
+
+class AnexosTester:
+    def __init__(self, pasta):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+        self.caminho = os.path.join(pasta, "boleto.pdf")
+        with open(self.caminho, "wb") as f:
+            f.write(CONTEUDO)
+        self.anexo = {"nome": "boleto.pdf", "tipo": "application/pdf", "sha256": SHA256}
+
+    def log_test(self, name, success, details=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED")
+        else:
+            print(f"❌ {name} - FAILED: {details}")
+
+        self.test_results.append({
+            "test": name,
+            "success": success,
+            "details": details
+        })
+
+    def verificar_intervalo(self, nome, cabecalho, tamanho, esperado):
+        obtido = server._intervalo_pedido(cabecalho, tamanho)
+        self.log_test(nome, obtido == esperado, f"'{cabecalho}' em {tamanho} bytes: {obtido}, esperado {esperado}")
+
+    def verificar_416(self, nome, cabecalho, tamanho):
+        try:
+            obtido = server._intervalo_pedido(cabecalho, tamanho)
+        except HTTPException as e:
+            self.log_test(nome, e.status_code == 416 and e.headers.get("Content-Range") == f"bytes */{tamanho}",
+                          f"{e.status_code} {e.headers}")
+            return
+        self.log_test(nome, False, f"'{cabecalho}' retornou {obtido} em vez de 416")
+
+    def test_intervalos(self):
+        self.verificar_intervalo("Intervalo fechado", "bytes=0-9", 100, (0, 9))
+        self.verificar_intervalo("Intervalo aberto", "bytes=90-", 100, (90, 99))
+        self.verificar_intervalo("Fim além do arquivo é truncado", "bytes=50-500", 100, (50, 99))
+        self.verificar_intervalo("Unidade sem diferenciar maiúsculas", "Bytes=0-0", 100, (0, 0))
+
+    def test_sufixos(self):
+        self.verificar_intervalo("Sufixo", "bytes=-10", 100, (90, 99))
+        self.verificar_intervalo("Sufixo maior que o arquivo", "bytes=-500", 100, (0, 99))
+        self.verificar_intervalo("Sufixo zero é ignorado", "bytes=-0", 100, None)
+        self.verificar_416("Sufixo em arquivo vazio", "bytes=-5", 0)
+
+    def test_ignorados(self):
+        """Cabeçalhos que não se aplicam: o arquivo inteiro é enviado"""
+        self.verificar_intervalo("Outra unidade", "items=0-9", 100, None)
+        self.verificar_intervalo("Vários intervalos", "bytes=0-9,20-29", 100, None)
+        self.verificar_intervalo("Sem hífen", "bytes=10", 100, None)
+        self.verificar_intervalo("Número inválido", "bytes=a-b", 100, None)
+        self.verificar_intervalo("Hífen sozinho", "bytes=-", 100, None)
+        self.verificar_intervalo("Fim antes do início", "bytes=50-10", 100, None)
+        self.verificar_intervalo("Fim antes do início fora do arquivo", "bytes=200-150", 100, None)
+
+    def test_fora_do_arquivo(self):
+        self.verificar_416("Início no tamanho do arquivo", "bytes=100-", 100)
+        self.verificar_416("Início além do arquivo", "bytes=150-200", 100)
+
+    async def corpo(self, resposta):
+        return b"".join([bloco async for bloco in resposta.body_iterator])
+
+    async def test_resposta(self):
+        resposta = await server.responder_anexo(requisicao(range="bytes=10-19"), self.anexo, self.caminho, "private")
+        corpo = await self.corpo(resposta)
+        self.log_test("206 com o trecho pedido",
+                      resposta.status_code == 206 and corpo == CONTEUDO[10:20]
+                      and resposta.headers["content-range"] == "bytes 10-19/100" and resposta.headers["content-length"] == "10",
+                      f"{resposta.status_code} {dict(resposta.headers)}")
+
+        resposta = await server.responder_anexo(requisicao(range="bytes=-5"), self.anexo, self.caminho, "private")
+        corpo = await self.corpo(resposta)
+        self.log_test("206 com sufixo", resposta.status_code == 206 and corpo == CONTEUDO[-5:],
+                      f"{resposta.status_code} {corpo!r}")
+
+        resposta = await server.responder_anexo(requisicao(if_none_match=f'W/"{SHA256}"'), self.anexo, self.caminho, "private")
+        self.log_test("304 com If-None-Match (comparação fraca)", resposta.status_code == 304, str(resposta.status_code))
+
+        try:
+            await server.responder_anexo(requisicao(range="bytes=100-"), self.anexo, self.caminho, "private")
+            self.log_test("416 fora do arquivo", False, "não levantou HTTPException")
+        except HTTPException as e:
+            self.log_test("416 fora do arquivo", e.status_code == 416, str(e.status_code))
+
+    async def test_if_range(self):
+        """If-Range só libera o intervalo com o ETag forte atual; senão vai o arquivo inteiro"""
+        resposta = await server.responder_anexo(
+            requisicao(range="bytes=0-9", if_range=f'"{SHA256}"'), self.anexo, self.caminho, "private")
+        self.log_test("If-Range com o ETag atual", resposta.status_code == 206, str(resposta.status_code))
+
+        resposta = await server.responder_anexo(
+            requisicao(range="bytes=0-9", if_range='"versao-antiga"'), self.anexo, self.caminho, "private")
+        self.log_test("If-Range desatualizado envia o arquivo inteiro",
+                      resposta.status_code == 200 and resposta.path == self.caminho, str(resposta.status_code))
+
+        resposta = await server.responder_anexo(
+            requisicao(range="bytes=0-9", if_range=f'W/"{SHA256}"'), self.anexo, self.caminho, "private")
+        self.log_test("If-Range fraco não vale", resposta.status_code == 200, str(resposta.status_code))
+
+        # Arquivo legado sem hash: ETag fraco, então If-Range nunca libera o intervalo
+        legado = {"nome": "boleto.pdf", "tipo": "application/pdf"}
+        etag = server._etag_anexo(legado, os.stat(self.caminho))
+        resposta = await server.responder_anexo(
+            requisicao(range="bytes=0-9", if_range=etag), legado, self.caminho, "private")
+        self.log_test("If-Range com ETag fraco do legado", resposta.status_code == 200,
+                      f"{etag} -> {resposta.status_code}")
+
+        resposta = await server.responder_anexo(
+            requisicao(range="bytes=0-9", if_range="Wed, 21 Oct 2015 07:28:00 GMT"), self.anexo, self.caminho, "private")
+        self.log_test("If-Range com data envia o arquivo inteiro", resposta.status_code == 200, str(resposta.status_code))
+
+    def run_all_tests(self):
+        print("🚀 Starting Anexos Tests")
+        self.test_intervalos()
+        self.test_sufixos()
+        self.test_ignorados()
+        self.test_fora_do_arquivo()
+        asyncio.run(self.test_resposta())
+        asyncio.run(self.test_if_range())
+
+        print(f"\n📊 Test Summary:")
+        print(f"   Tests Run: {self.tests_run}")
+        print(f"   Tests Passed: {self.tests_passed}")
+        print(f"   Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    with tempfile.TemporaryDirectory() as pasta:
+        tester = AnexosTester(pasta)
+        success = tester.run_all_tests()
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
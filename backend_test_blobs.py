@@ -0,0 +1,153 @@
+import asyncio
+import os
+import sys
+import json
+import tempfile
+import hashlib
+from datetime import timedelta
+
+# Executa contra um mongod local: MONGO_URL=mongodb://localhost:27017 python backend_test_blobs.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_test_blobs")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+
+
+class BlobsTester:
+    def __init__(self, pasta):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+        # Armazenamento isolado numa pasta temporária; carência negativa deixa tudo elegível à coleta
+        server.UPLOAD_DIR = pasta
+        server.BLOBS_DIR = os.path.join(pasta, "blobs")
+        server.BLOBS_TMP_DIR = os.path.join(server.BLOBS_DIR, "tmp")
+        server.BLOB_GC_CARENCIA = timedelta(seconds=-1)
+
+    def log_test(self, name, success, details=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED")
+        else:
+            print(f"❌ {name} - FAILED: {details}")
+
+        self.test_results.append({
+            "test": name,
+            "success": success,
+            "details": details
+        })
+
+    def temporario(self, conteudo):
+        caminho = server._temporario_blob()
+        with open(caminho, "wb") as f:
+            f.write(conteudo)
+        return caminho
+
+    async def refs(self, sha256):
+        blob = await server.db.blobs.find_one({"_id": sha256})
+        return blob["refs"] if blob else None
+
+    async def test_refcount(self):
+        conteudo = b"boleto de teste"
+        sha256 = hashlib.sha256(conteudo).hexdigest()
+
+        await server.armazenar_blob(self.temporario(conteudo), sha256, len(conteudo), "application/pdf")
+        await server.armazenar_blob(self.temporario(conteudo), sha256, len(conteudo), "application/pdf")
+        temporarios = os.listdir(server.BLOBS_TMP_DIR)
+        self.log_test("Mesmo conteúdo soma referências", await self.refs(sha256) == 2, f"refs {await self.refs(sha256)}")
+        self.log_test("Um único arquivo no armazenamento",
+                      os.path.exists(server._caminho_blob(sha256)) and not temporarios, str(temporarios))
+
+        self.log_test("referenciar_blob reaproveita", await server.referenciar_blob(sha256, len(conteudo)) and await self.refs(sha256) == 3)
+        self.log_test("referenciar_blob exige o mesmo tamanho",
+                      not await server.referenciar_blob(sha256, len(conteudo) + 1) and await self.refs(sha256) == 3)
+
+        for _ in range(2):
+            await server.liberar_blob(sha256)
+        resultado = await server.coletar_blobs()
+        self.log_test("Blob referenciado não é coletado",
+                      await self.refs(sha256) == 1 and os.path.exists(server._caminho_blob(sha256)), json.dumps(resultado))
+
+        await server.liberar_blob(sha256)
+        resultado = await server.coletar_blobs()
+        self.log_test("Blob sem referências é coletado",
+                      resultado["blobs"] == 1 and await self.refs(sha256) is None and not os.path.exists(server._caminho_blob(sha256)),
+                      json.dumps(resultado))
+        self.log_test("referenciar_blob de blob coletado", not await server.referenciar_blob(sha256, len(conteudo)))
+
+    async def test_referencia_sem_arquivo(self):
+        """Documento sem arquivo no disco: a referência é desfeita e o upload segue normal"""
+        conteudo = b"arquivo perdido"
+        sha256 = hashlib.sha256(conteudo).hexdigest()
+        await server.armazenar_blob(self.temporario(conteudo), sha256, len(conteudo), None)
+        os.remove(server._caminho_blob(sha256))
+        ok = await server.referenciar_blob(sha256, len(conteudo))
+        self.log_test("Arquivo ausente não gera referência", not ok and await self.refs(sha256) == 1, f"refs {await self.refs(sha256)}")
+
+    async def test_orfaos_e_temporarios(self):
+        orfao = server._caminho_blob("f" * 64)
+        os.makedirs(os.path.dirname(orfao), exist_ok=True)
+        with open(orfao, "wb") as f:
+            f.write(b"sem documento")
+        temporario = self.temporario(b"upload interrompido")
+
+        resultado = await server.coletar_blobs()
+        self.log_test("Arquivo órfão removido", not os.path.exists(orfao) and resultado["orfaos"] >= 1, json.dumps(resultado))
+        self.log_test("Temporário esquecido removido", not os.path.exists(temporario) and resultado["temporarios"] >= 1, json.dumps(resultado))
+
+    async def test_migracao(self):
+        """Boleto legado: blob primeiro, documento depois, original por último; workers simultâneos não duplicam"""
+        conteudo = b"boleto legado"
+        sha256 = hashlib.sha256(conteudo).hexdigest()
+        pasta_boletos = os.path.join(server.UPLOAD_DIR, "boletos")
+        os.makedirs(pasta_boletos, exist_ok=True)
+        legado = os.path.join(pasta_boletos, "legado.pdf")
+        with open(legado, "wb") as f:
+            f.write(conteudo)
+        await server.db.despesas.insert_many([
+            {"id": "d1", "boleto": {"id": "b1", "nome_arquivo": "legado.pdf", "tipo": "application/pdf"}},
+            {"id": "d2", "boleto": {"id": "b2", "nome_arquivo": "sumiu.pdf", "tipo": "application/pdf"}},
+        ])
+
+        movidos = await asyncio.gather(server.migrar_anexos_para_blobs(), server.migrar_anexos_para_blobs())
+        d1 = await server.db.despesas.find_one({"id": "d1"})
+        d2 = await server.db.despesas.find_one({"id": "d2"})
+        self.log_test("Boleto migrado uma única vez", sum(movidos) == 1 and await self.refs(sha256) == 1,
+                      f"movidos {movidos}, refs {await self.refs(sha256)}")
+        self.log_test("Documento aponta para o blob",
+                      d1["boleto"].get("sha256") == sha256 and "nome_arquivo" not in d1["boleto"], json.dumps(d1["boleto"]))
+        self.log_test("Arquivo legado removido só depois", not os.path.exists(legado) and os.path.exists(server._caminho_blob(sha256)))
+        self.log_test("Arquivo ausente mantém o documento", d2["boleto"].get("nome_arquivo") == "sumiu.pdf", json.dumps(d2["boleto"]))
+
+    async def run_all_tests(self):
+        print("🚀 Starting Blobs Tests")
+        print(f"   Mongo: {os.environ['MONGO_URL']} / {os.environ['DB_NAME']}")
+        await server.client.drop_database(os.environ["DB_NAME"])
+        try:
+            await self.test_refcount()
+            await self.test_referencia_sem_arquivo()
+            await self.test_orfaos_e_temporarios()
+            await self.test_migracao()
+        finally:
+            await server.client.drop_database(os.environ["DB_NAME"])
+
+        print(f"\n📊 Test Summary:")
+        print(f"   Tests Run: {self.tests_run}")
+        print(f"   Tests Passed: {self.tests_passed}")
+        print(f"   Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    with tempfile.TemporaryDirectory() as pasta:
+        tester = BlobsTester(pasta)
+        success = asyncio.run(tester.run_all_tests())
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
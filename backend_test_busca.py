@@ -0,0 +1,141 @@
+import asyncio
+import os
+import sys
+
+# Testa só o índice em memória, sem banco: python backend_test_busca.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_test_busca")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+
+
+PRODUTOS = [
+    {"id": "p1", "codigo": "PRD000001", "descricao": "Caneta esferográfica azul"},
+    {"id": "p2", "codigo": "PRD000002", "descricao": "Caderno universitário"},
+    {"id": "p3", "codigo": "PRD000003", "descricao": "Cesta básica de mercado"},
+    {"id": "p4", "codigo": "PRD000004", "descricao": "Papel sulfite A4"},
+]
+
+
+class BuscaTester:
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+        self.indice = server.IndiceBusca()
+        for doc in PRODUTOS:
+            self.indice.adicionar(doc["id"], *server._entrada_busca("produtos", doc))
+
+    def log_test(self, name, success, details=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED")
+        else:
+            print(f"❌ {name} - FAILED: {details}")
+
+        self.test_results.append({
+            "test": name,
+            "success": success,
+            "details": details
+        })
+
+    def buscar(self, q):
+        return [doc_id for _, doc_id in self.indice.buscar(server.normalizar_busca(q).split(), 10)]
+
+    def verificar_primeiro(self, nome, q, esperado):
+        ids = self.buscar(q)
+        self.log_test(nome, ids[:1] == [esperado], f"'{q}' retornou {ids}")
+
+    def test_prefixo_e_acentos(self):
+        self.verificar_primeiro("Prefixo", "cane", "p1")
+        self.verificar_primeiro("Sem acento", "esferografica", "p1")
+        self.verificar_primeiro("Vários termos", "caneta azul", "p1")
+        self.verificar_primeiro("Número do código", "3", "p3")
+
+    def test_transposicoes(self):
+        """Letras vizinhas trocadas derrubam 4 trigramas e ainda devem ser encontradas"""
+        self.verificar_primeiro("Transposição no meio", "mecrado", "p3")
+        self.verificar_primeiro("Transposição no início", "cnaeta", "p1")
+        self.verificar_primeiro("Transposição no fim", "caderon", "p2")
+
+    def test_insercoes_e_remocoes(self):
+        self.verificar_primeiro("Letra a mais", "merrcado", "p3")
+        self.verificar_primeiro("Letra a menos", "mrcado", "p3")
+        self.verificar_primeiro("Letra trocada", "sulfyte", "p4")
+        self.verificar_primeiro("Dois erros em termo longo", "univresitaro", "p2")
+
+    def test_sem_falsos_positivos(self):
+        self.log_test("Termo curto não tolera erro", self.buscar("cax") == [], str(self.buscar("cax")))
+        self.log_test("Termo sem relação", self.buscar("parafuso") == [], str(self.buscar("parafuso")))
+        self.log_test("Todos os termos precisam casar", self.buscar("caneta sulfite") == [], str(self.buscar("caneta sulfite")))
+
+    def test_remocao(self):
+        self.indice.remover("p4")
+        self.log_test("Documento removido sai do índice", self.buscar("sulfite") == [], str(self.buscar("sulfite")))
+        self.log_test("Trigramas órfãos são descartados", not any("p4" in ids for ids in self.indice.trigramas.values()))
+
+    async def verificar_versao(self):
+        """Índice de outra versão (gravação em outro worker) é reconstruído antes da busca"""
+        originais = server.reconstruir_busca, server.BUSCA_ESPERA, server.indices_busca["produtos"]
+        atual = server.IndiceBusca()
+        atual.pronto, atual.versao = True, ("epoca", 1)
+        server.indices_busca["produtos"] = atual
+        novo_produto = {"id": "p5", "codigo": "PRD000005", "descricao": "Grampeador de mesa"}
+
+        async def reconstruir(colecao, atraso=0.0):
+            await asyncio.sleep(atraso)
+            novo = server.IndiceBusca()
+            for doc in PRODUTOS + [novo_produto]:
+                novo.adicionar(doc["id"], *server._entrada_busca(colecao, doc))
+            novo.pronto, novo.versao = True, ("epoca", 2)
+            server.indices_busca[colecao] = novo
+            return len(novo.tokens)
+
+        try:
+            server.reconstruir_busca = reconstruir
+            self.log_test("Mesma versão usa o índice atual", await server._indice_atualizado("produtos", ("epoca", 1))
+                          and server.indices_busca["produtos"] is atual)
+
+            ok = await server._indice_atualizado("produtos", ("epoca", 2))
+            encontrados = [d for _, d in server.indices_busca["produtos"].buscar(["grampeador"], 10)]
+            self.log_test("Versão nova reconstrói o índice", ok and encontrados == ["p5"], f"{ok} {encontrados}")
+
+            server.reconstruir_busca = lambda colecao: reconstruir(colecao, atraso=1.0)
+            server.BUSCA_ESPERA = 0.05
+            ok = await server._indice_atualizado("produtos", ("epoca", 3))
+            self.log_test("Reconstrução demorada cai no índice de texto", not ok)
+            await server._tarefas_busca["produtos"]
+        finally:
+            server.reconstruir_busca, server.BUSCA_ESPERA, server.indices_busca["produtos"] = originais
+
+    def test_versao(self):
+        asyncio.run(self.verificar_versao())
+
+    def run_all_tests(self):
+        print("🚀 Starting Busca Tests")
+        self.test_prefixo_e_acentos()
+        self.test_transposicoes()
+        self.test_insercoes_e_remocoes()
+        self.test_sem_falsos_positivos()
+        self.test_remocao()
+        self.test_versao()
+
+        print(f"\n📊 Test Summary:")
+        print(f"   Tests Run: {self.tests_run}")
+        print(f"   Tests Passed: {self.tests_passed}")
+        print(f"   Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    tester = BuscaTester()
+    success = tester.run_all_tests()
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
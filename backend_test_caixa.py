@@ -0,0 +1,148 @@
+import asyncio
+import os
+import sys
+import json
+from datetime import datetime, timezone
+
+# Executa contra um mongod local: MONGO_URL=mongodb://localhost:27017 python backend_test_caixa.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_test_caixa")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+
+MOVIMENTOS = 200
+
+
+class CaixaTester:
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+
+    def log_test(self, name, success, details=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED")
+        else:
+            print(f"❌ {name} - FAILED: {details}")
+
+        self.test_results.append({
+            "test": name,
+            "success": success,
+            "details": details
+        })
+
+    async def limpar(self):
+        for colecao in ("caixa", "caixa_movimentos", "caixa_snapshots"):
+            await server.db[colecao].delete_many({})
+
+    async def test_movimentos_concorrentes(self):
+        """Créditos e débitos simultâneos: nenhum $inc se perde e o livro bate com o saldo"""
+        await self.limpar()
+        await asyncio.gather(*[
+            server.registrar_movimento_caixa("credito" if i % 3 else "debito", 10.0, f"Movimento {i}")
+            for i in range(MOVIMENTOS)
+        ])
+        creditos = sum(1 for i in range(MOVIMENTOS) if i % 3)
+        esperado = 10.0 * (creditos - (MOVIMENTOS - creditos))
+
+        caixa = await server.obter_caixa()
+        self.log_test("Saldo após movimentos concorrentes", caixa["saldo"] == esperado,
+                      f"saldo {caixa['saldo']}, esperado {esperado}")
+
+        resultado = await server.reconciliar_caixa()
+        self.log_test("Reconciliação sem diferença", resultado["diferenca"] == 0 and resultado["movimentos"] == MOVIMENTOS,
+                      json.dumps(resultado, default=str))
+
+    async def test_abertura_concorrente(self):
+        """Caixa anterior ao livro: movimentos junto da abertura não entram duas vezes"""
+        await self.limpar()
+        await server.db.caixa.insert_one({"id": "caixa-legado", "saldo": 500.0})
+
+        await asyncio.gather(
+            server.iniciar_livro_caixa(),
+            *[server.registrar_movimento_caixa("credito", 5.0, f"Movimento {i}") for i in range(50)],
+            server.iniciar_livro_caixa(),
+        )
+
+        aberturas = await server.db.caixa_movimentos.count_documents({"origem": "abertura"})
+        self.log_test("Uma única abertura", aberturas == 1, f"{aberturas} aberturas")
+
+        resultado = await server.reconciliar_caixa()
+        self.log_test("Abertura + movimentos batem com o saldo",
+                      resultado["diferenca"] == 0 and resultado["saldo_materializado"] == 750.0,
+                      json.dumps(resultado, default=str))
+
+    async def test_correcao_reconciliacao(self):
+        """Uma divergência é corrigida com $inc e a conferência seguinte não acusa nada"""
+        await self.limpar()
+        await server.registrar_movimento_caixa("credito", 100.0, "Venda")
+        await server.db.caixa.update_one({}, {"$inc": {"saldo": 7.5}})
+
+        resultado = await server.reconciliar_caixa(corrigir=True)
+        self.log_test("Divergência detectada e corrigida", resultado["diferenca"] == -7.5 and resultado["corrigido"],
+                      json.dumps(resultado, default=str))
+        resultado = await server.reconciliar_caixa()
+        self.log_test("Reconciliação após correção", resultado["diferenca"] == 0, json.dumps(resultado, default=str))
+
+    async def test_movimento_em_andamento(self):
+        """Movimento no livro sem o $inc ainda: a reconciliação não o soma de novo; um antigo perdido é corrigido"""
+        await self.limpar()
+        caixa = await server.registrar_movimento_caixa("credito", 100.0, "Venda")
+        agora = datetime.now(timezone.utc)
+        movimento = {"caixa_id": caixa["id"], "tipo": "credito", "valor": 40.0, "delta": 40.0,
+                     "descricao": "Em andamento", "referencia_id": None, "origem": "manual"}
+        await server.db.caixa_movimentos.insert_one({**movimento, "id": "em-andamento", "data": agora})
+
+        resultado = await server.reconciliar_caixa(corrigir=True)
+        self.log_test("Movimento em andamento não é corrigido",
+                      resultado["diferenca"] == 0 and resultado["em_andamento"] == 1 and not resultado["corrigido"],
+                      json.dumps(resultado, default=str))
+
+        # O $inc do próprio movimento chega depois: o saldo fica certo, sem contagem dupla
+        await server.db.caixa.update_one({"id": caixa["id"]}, {"$inc": {"saldo": 40.0}, "$push": {"aplicados": "em-andamento"}})
+        resultado = await server.reconciliar_caixa()
+        self.log_test("Saldo certo após o $inc atrasado",
+                      resultado["diferenca"] == 0 and resultado["saldo_materializado"] == 140.0,
+                      json.dumps(resultado, default=str))
+
+        # Movimento antigo cujo $inc nunca aconteceu (processo caiu no meio)
+        antigo = agora - server.CAIXA_SNAPSHOT_MARGEM * 2
+        await server.db.caixa_movimentos.insert_one({**movimento, "id": "perdido", "valor": 15.0, "delta": 15.0, "data": antigo})
+        resultado = await server.reconciliar_caixa(corrigir=True)
+        caixa = await server.obter_caixa()
+        self.log_test("Movimento antigo perdido é corrigido",
+                      resultado["diferenca"] == 15.0 and resultado["corrigido"] and caixa["saldo"] == 155.0,
+                      json.dumps(resultado, default=str))
+
+    async def run_all_tests(self):
+        print("🚀 Starting Caixa Tests")
+        print(f"   Mongo: {os.environ['MONGO_URL']} / {os.environ['DB_NAME']}")
+        await server.client.drop_database(os.environ["DB_NAME"])
+        try:
+            await self.test_movimentos_concorrentes()
+            await self.test_abertura_concorrente()
+            await self.test_correcao_reconciliacao()
+            await self.test_movimento_em_andamento()
+        finally:
+            await server.client.drop_database(os.environ["DB_NAME"])
+
+        print(f"\n📊 Test Summary:")
+        print(f"   Tests Run: {self.tests_run}")
+        print(f"   Tests Passed: {self.tests_passed}")
+        print(f"   Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    tester = CaixaTester()
+    success = asyncio.run(tester.run_all_tests())
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+import json
+from datetime import datetime
+
+# Executa contra um mongod local: MONGO_URL=mongodb://localhost:27017 python backend_test_indexes.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_test_indexes")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+
+
+class IndexesTester:
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+
+    def log_test(self, name, success, details=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED")
+        else:
+            print(f"❌ {name} - FAILED: {details}")
+
+        self.test_results.append({
+            "test": name,
+            "success": success,
+            "details": details
+        })
+
+    async def test_ensure_indexes(self):
+        """Todos os índices declarados devem existir após ensure_indexes"""
+        relatorio = await server.ensure_indexes()
+        erros = {col: info["erros"] for col, info in relatorio.items() if info["erros"]}
+        self.log_test("ensure_indexes sem erros", not erros, json.dumps(erros))
+
+        for colecao, declarados in server.INDEXES.items():
+            existentes = await server.db[colecao].index_information()
+            faltando = [server._nome_indice(spec["keys"]) for spec in declarados
+                        if server._nome_indice(spec["keys"]) not in existentes]
+            self.log_test(f"Índices de {colecao}", not faltando, f"Faltando: {faltando}")
+
+        # Segunda execução não deve criar nada nem acusar divergência
+        relatorio = await server.ensure_indexes()
+        criados = {col: info["criados"] for col, info in relatorio.items() if info["criados"]}
+        divergentes = {col: info["divergentes"] for col, info in relatorio.items() if info["divergentes"]}
+        self.log_test("ensure_indexes idempotente", not criados and not divergentes,
+                      json.dumps({"criados": criados, "divergentes": divergentes}))
+
+    async def test_hot_queries_sem_collscan(self):
+        """Nenhuma consulta registrada em HOT_QUERIES pode virar COLLSCAN"""
+        # Alguns documentos para o planner ter o que avaliar
+        await server.db.pedidos.insert_many([
+            {"id": f"p{i}", "data": datetime(2026, 1, i + 1, 10), "status": "pendente", "cliente_id": "c1"}
+            for i in range(20)
+        ])
+        falhas = await server.verificar_consultas_quentes()
+        self.log_test("Consultas quentes usam índice", not falhas,
+                      json.dumps([{"colecao": f["colecao"], "filtro": f["filtro"], "estagios": f["estagios"]} for f in falhas], default=str))
+
+    async def run_all_tests(self):
+        print("🚀 Starting Indexes Tests")
+        print(f"   Mongo: {os.environ['MONGO_URL']} / {os.environ['DB_NAME']}")
+        await server.client.drop_database(os.environ["DB_NAME"])
+        try:
+            await self.test_ensure_indexes()
+            await self.test_hot_queries_sem_collscan()
+        finally:
+            await server.client.drop_database(os.environ["DB_NAME"])
+
+        print(f"\n📊 Test Summary:")
+        print(f"   Tests Run: {self.tests_run}")
+        print(f"   Tests Passed: {self.tests_passed}")
+        print(f"   Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    tester = IndexesTester()
+    success = asyncio.run(tester.run_all_tests())
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import sys
+import json
+from datetime import datetime, timedelta, timezone
+
+# Executa contra um mongod local: MONGO_URL=mongodb://localhost:27017 python backend_test_notificacoes.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_test_notificacoes")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+
+
+class EnviadorComFalha(server.EnviadorLocal):
+    """Falha no primeiro envio, como uma API de email fora do ar"""
+
+    def __init__(self):
+        super().__init__()
+        self.falhou = False
+
+    async def enviar(self, assunto, html):
+        if not self.falhou:
+            self.falhou = True
+            raise RuntimeError("serviço de email indisponível")
+        return await super().enviar(assunto, html)
+
+
+class NotificacoesTester:
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+        self.hoje = server._hoje_local()
+
+    def log_test(self, name, success, details=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED")
+        else:
+            print(f"❌ {name} - FAILED: {details}")
+
+        self.test_results.append({
+            "test": name,
+            "success": success,
+            "details": details
+        })
+
+    async def preparar(self):
+        for colecao in ("despesas", "notificacoes_enviadas", "tarefas"):
+            await server.db[colecao].delete_many({})
+        meio_dia = datetime(self.hoje.year, self.hoje.month, self.hoje.day, 12, tzinfo=timezone.utc)
+        await server.db.despesas.insert_many([
+            {"id": "hoje", "descricao": "Aluguel", "tipo": "fixa", "valor": 1000.0, "status": "pendente", "data_vencimento": meio_dia},
+            {"id": "amanha", "descricao": "Energia", "tipo": "fixa", "valor": 250.0, "status": "pendente", "data_vencimento": meio_dia + timedelta(days=1)},
+            {"id": "paga", "descricao": "Água", "tipo": "fixa", "valor": 80.0, "status": "pago", "data_vencimento": meio_dia},
+        ])
+
+    async def test_reserva_envio(self):
+        """Cada aviso sai uma vez; a véspera não suprime o aviso do dia"""
+        await self.preparar()
+        server.email_enviador = enviador = server.EnviadorLocal()
+
+        resultado = await server.notificar_vencimentos()
+        self.log_test("Primeiro envio avisa as duas pendentes",
+                      resultado["enviado"] and resultado["despesas_notificadas"] == 2 and len(enviador.enviados) == 1,
+                      json.dumps(resultado, default=str))
+        enviadas = await server.db.notificacoes_enviadas.count_documents({"status": "enviada"})
+        self.log_test("Reservas confirmadas como enviadas", enviadas == 2, f"{enviadas} enviadas")
+
+        resultado = await server.notificar_vencimentos()
+        self.log_test("Segunda execução no mesmo dia não reenvia",
+                      not resultado["enviado"] and len(enviador.enviados) == 1, json.dumps(resultado, default=str))
+
+        # No dia seguinte a despesa de "amanhã" vence hoje e deve ser avisada outra vez
+        hoje_original = server._hoje_local
+        server._hoje_local = lambda: self.hoje + timedelta(days=1)
+        try:
+            resultado = await server.notificar_vencimentos()
+        finally:
+            server._hoje_local = hoje_original
+        self.log_test("VENCE HOJE! depois de Vence amanhã",
+                      resultado["enviado"] and resultado["despesas_notificadas"] == 1
+                      and "VENCE HOJE!" in enviador.enviados[-1]["html"] and "Energia" in enviador.enviados[-1]["html"],
+                      json.dumps(resultado, default=str))
+
+    async def test_liberacao_em_falha(self):
+        """Falha no envio libera a reserva; a próxima execução tenta de novo"""
+        await self.preparar()
+        server.email_enviador = enviador = EnviadorComFalha()
+
+        resultado = await server.notificar_vencimentos()
+        reservas = await server.db.notificacoes_enviadas.count_documents({})
+        self.log_test("Falha não deixa reserva presa", not resultado["enviado"] and reservas == 0,
+                      json.dumps({"resultado": resultado, "reservas": reservas}, default=str))
+
+        resultado = await server.notificar_vencimentos()
+        self.log_test("Reenvio após a falha", resultado["enviado"] and len(enviador.enviados) == 1,
+                      json.dumps(resultado, default=str))
+
+    async def test_trava_do_horario(self):
+        """Vários workers no mesmo horário: só um executa a tarefa"""
+        await self.preparar()
+        server.email_enviador = enviador = server.EnviadorLocal()
+        horario = datetime.now(timezone.utc).replace(microsecond=0)
+
+        resultados = await asyncio.gather(*[
+            server.executar_tarefa("notificar_vencimentos", horario) for _ in range(5)
+        ])
+        executadas = [r for r in resultados if r is not None]
+        self.log_test("Horário executado uma única vez", len(executadas) == 1 and len(enviador.enviados) == 1,
+                      json.dumps(resultados, default=str))
+
+        atrasado = await server.executar_tarefa("notificar_vencimentos", horario - timedelta(hours=1))
+        self.log_test("Horário anterior ao já executado é ignorado", atrasado is None, json.dumps(atrasado, default=str))
+
+        estado = await server.db.tarefas.find_one({"_id": "notificar_vencimentos"})
+        self.log_test("Estado da tarefa registrado", estado["status"] == "ok" and estado["horario"] == horario,
+                      json.dumps(estado, default=str))
+
+    async def run_all_tests(self):
+        print("🚀 Starting Notificações Tests")
+        print(f"   Mongo: {os.environ['MONGO_URL']} / {os.environ['DB_NAME']}")
+        await server.client.drop_database(os.environ["DB_NAME"])
+        try:
+            await self.test_reserva_envio()
+            await self.test_liberacao_em_falha()
+            await self.test_trava_do_horario()
+        finally:
+            await server.client.drop_database(os.environ["DB_NAME"])
+
+        print(f"\n📊 Test Summary:")
+        print(f"   Tests Run: {self.tests_run}")
+        print(f"   Tests Passed: {self.tests_passed}")
+        print(f"   Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    tester = NotificacoesTester()
+    success = asyncio.run(tester.run_all_tests())
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
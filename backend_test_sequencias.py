@@ -0,0 +1,122 @@
+import asyncio
+import os
+import sys
+import json
+
+# Executa contra um mongod local: MONGO_URL=mongodb://localhost:27017 python backend_test_sequencias.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "xsell_test_sequencias")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+
+WORKERS = 4
+NUMEROS = 400
+
+
+class SequenciasTester:
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+
+    def log_test(self, name, success, details=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED")
+        else:
+            print(f"❌ {name} - FAILED: {details}")
+
+        self.test_results.append({
+            "test": name,
+            "success": success,
+            "details": details
+        })
+
+    async def limpar(self):
+        for colecao in ("counters", "pedidos"):
+            await server.db[colecao].delete_many({})
+
+    @staticmethod
+    def duplicados(numeros):
+        return sorted({n for n in numeros if numeros.count(n) > 1})
+
+    async def test_workers_concorrentes(self):
+        """Vários workers (um alocador cada) pedindo números ao mesmo tempo: nenhum se repete"""
+        await self.limpar()
+
+        async def zero():
+            return 0
+
+        alocadores = [server.AlocadorSequencia(bloco=bloco) for bloco in (1, 3, 10, 25)[:WORKERS]]
+        numeros = await asyncio.gather(*[
+            alocadores[i % WORKERS].proximo("TST", zero) for i in range(NUMEROS)
+        ])
+        self.log_test("Números únicos entre workers", len(set(numeros)) == NUMEROS,
+                      f"duplicados: {self.duplicados(numeros)[:20]}")
+        self.log_test("Começa em 1", min(numeros) == 1, f"menor {min(numeros)}")
+
+        contador = await server.db.counters.find_one({"_id": "TST"})
+        self.log_test("Contador cobre todos os números entregues", contador["valor"] >= max(numeros),
+                      json.dumps({"contador": contador["valor"], "maior": max(numeros)}))
+
+    async def test_semente_concorrente(self):
+        """Primeiro uso do escopo em vários workers: todos partem do maior número existente"""
+        await self.limpar()
+        await server.db.pedidos.insert_many([
+            {"id": f"p{i}", "numero": f"PED-{i:06d}"} for i in (3, 41, 17)
+        ])
+
+        async def maior_existente():
+            # Dá a vez aos outros workers no meio da semente, como uma consulta real ao banco
+            await asyncio.sleep(0)
+            return 41
+
+        alocadores = [server.AlocadorSequencia(bloco=5) for _ in range(WORKERS)]
+        numeros = await asyncio.gather(*[
+            alocadores[i % WORKERS].proximo("PED", maior_existente) for i in range(40)
+        ])
+        self.log_test("Semente concorrente sem repetição", len(set(numeros)) == 40,
+                      f"duplicados: {self.duplicados(numeros)}")
+        self.log_test("Nenhum número reaproveita os existentes", min(numeros) == 42, f"menor {min(numeros)}")
+
+    async def test_proximo_numero(self):
+        await self.limpar()
+        await server.db.pedidos.insert_many([
+            {"id": "p1", "numero": "PED-000009"},
+            {"id": "p2", "numero": "PED-ANTIGO"},
+        ])
+        server.sequencias = server.AlocadorSequencia(bloco=10)
+        numeros = await asyncio.gather(*[server.proximo_numero("pedidos", "numero", "PED", 6) for _ in range(25)])
+        self.log_test("Formato e sequência a partir do existente",
+                      sorted(numeros) == [f"PED-{n:06d}" for n in range(10, 35)], str(sorted(numeros)[:5]))
+
+    async def run_all_tests(self):
+        print("🚀 Starting Sequências Tests")
+        print(f"   Mongo: {os.environ['MONGO_URL']} / {os.environ['DB_NAME']}")
+        await server.client.drop_database(os.environ["DB_NAME"])
+        try:
+            await self.test_workers_concorrentes()
+            await self.test_semente_concorrente()
+            await self.test_proximo_numero()
+        finally:
+            await server.client.drop_database(os.environ["DB_NAME"])
+
+        print(f"\n📊 Test Summary:")
+        print(f"   Tests Run: {self.tests_run}")
+        print(f"   Tests Passed: {self.tests_passed}")
+        print(f"   Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    tester = SequenciasTester()
+    success = asyncio.run(tester.run_all_tests())
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
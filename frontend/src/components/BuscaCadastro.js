@@ -0,0 +1,70 @@
+import { useState, useEffect } from 'react';
+import { Input } from '@/components/ui/input';
+import axios from 'axios';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+const getAuthHeader = () => ({
+  headers: { Authorization: `Bearer ${localStorage.getItem('token')}` }
+});
+
+// Seletor de cliente/produto/fornecedor: consulta /search conforme a digitação (com pequeno
+// atraso) em vez de baixar a tabela inteira. onSelect recebe o resumo do cadastro.
+export default function BuscaCadastro({ tipo, onSelect, placeholder, testId, limite = 10 }) {
+  const [busca, setBusca] = useState('');
+  const [sugestoes, setSugestoes] = useState([]);
+
+  useEffect(() => {
+    const termo = busca.trim();
+    if (!termo) {
+      setSugestoes([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API}/search`, {
+          ...getAuthHeader(),
+          params: { q: termo, tipos: tipo, limite }
+        });
+        setSugestoes(response.data);
+      } catch (error) {
+        setSugestoes([]);
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [busca, tipo, limite]);
+
+  const selecionar = (item) => {
+    setBusca('');
+    setSugestoes([]);
+    onSelect(item);
+  };
+
+  return (
+    <div className="relative">
+      <Input
+        value={busca}
+        onChange={(e) => setBusca(e.target.value)}
+        placeholder={placeholder}
+        autoComplete="off"
+        data-testid={testId}
+      />
+      {sugestoes.length > 0 && (
+        <div className="absolute z-50 mt-1 w-full max-h-60 overflow-y-auto rounded-md border bg-white shadow-md">
+          {sugestoes.map(item => (
+            <button
+              type="button"
+              key={item.id}
+              onClick={() => selecionar(item)}
+              className="block w-full px-3 py-2 text-left text-sm hover:bg-gray-100"
+            >
+              {item.codigo} - {item.rotulo}
+              {item.cidade && <span className="text-muted-foreground"> ({item.cidade})</span>}
+            </button>
+          ))}
+        </div>
+      )}
+    </div>
+  );
+}
@@ -29,6 +29,65 @@ const getAuthHeader = () => ({
 });
 
 // Formatar data - preserva a data exatamente como cadastrada
+// Editais grandes vão em partes por uma sessão retomável (POST/PUT /uploads)
+const UPLOAD_EM_PARTES_ACIMA = 8 * 1024 * 1024;
+const UPLOAD_PARTE = 4 * 1024 * 1024;
+
+// SHA-256 do arquivo: se o servidor já tiver o conteúdo, o envio é dispensado
+const sha256Arquivo = async (file) => {
+  if (!window.crypto || !window.crypto.subtle) return null;
+  const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+const enviarEditalEmPartes = async (file, licitacaoId) => {
+  const { data: sessao } = await axios.post(`${API}/uploads`, {
+    destino: 'edital',
+    referencia_id: licitacaoId,
+    nome: file.name,
+    tipo: file.type,
+    tamanho: file.size,
+    sha256: await sha256Arquivo(file)
+  }, getAuthHeader());
+  if (sessao.deduplicado) return;
+  
+  const tamanhoParte = Math.min(UPLOAD_PARTE, sessao.parte_max);
+  let recebido = 0;
+  let tentativas = 0;
+  while (recebido < file.size) {
+    try {
+      const parte = file.slice(recebido, recebido + tamanhoParte);
+      const { data } = await axios.put(`${API}/uploads/${sessao.id}?offset=${recebido}`, parte, {
+        headers: { ...getAuthHeader().headers, 'Content-Type': 'application/octet-stream' }
+      });
+      recebido = data.recebido;
+      tentativas = 0;
+    } catch (error) {
+      if (++tentativas > 3 || (error.response && error.response.status !== 409)) throw error;
+      // Retoma do offset que o servidor confirmou
+      const { data } = await axios.get(`${API}/uploads/${sessao.id}`, getAuthHeader());
+      recebido = data.recebido;
+    }
+  }
+  await axios.post(`${API}/uploads/${sessao.id}/concluir`, {}, getAuthHeader());
+};
+
+// Download autenticado; o navegador reaproveita a cópia em cache (ETag + Cache-Control imutável)
+const baixarAnexo = async (licitacaoId, anexo) => {
+  try {
+    const response = await axios.get(
+      `${API}/agenda-licitacoes/${licitacaoId}/anexos/${anexo.id}/download`,
+      { ...getAuthHeader(), responseType: 'blob' }
+    );
+    const url = window.URL.createObjectURL(new Blob([response.data], { type: anexo.tipo || 'application/octet-stream' }));
+    window.open(url, '_blank');
+    setTimeout(() => window.URL.revokeObjectURL(url), 60000);
+  } catch (error) {
+    console.error('Erro ao baixar anexo:', error);
+    toast.error('Erro ao baixar anexo');
+  }
+};
+
 const formatDate = (dateStr) => {
   if (!dateStr) return '-';
   // Parse the date and format without timezone conversion
@@ -153,7 +212,7 @@ export default function AgendaLicitacoes() {
 
   const fetchLicitacoes = async () => {
     try {
-      const response = await axios.get(`${API}/agenda-licitacoes`, getAuthHeader());
+      const response = await axios.get(`${API}/agenda-licitacoes?view=summary`, getAuthHeader());
       setLicitacoes(response.data);
     } catch (error) {
       toast.error('Erro ao carregar agenda de licitações');
@@ -254,9 +313,15 @@ export default function AgendaLicitacoes() {
   };
 
   // Visualizar licitação
-  const handleVisualizar = (licitacao) => {
-    setSelectedLicitacao(licitacao);
-    setViewDialogOpen(true);
+  const handleVisualizar = async (licitacao) => {
+    // A listagem traz só o resumo; eventos e anexos vêm do detalhe
+    try {
+      const response = await axios.get(`${API}/agenda-licitacoes/${licitacao.id}`, getAuthHeader());
+      setSelectedLicitacao(response.data);
+      setViewDialogOpen(true);
+    } catch (error) {
+      toast.error('Erro ao carregar licitação');
+    }
   };
 
   // Alterar status
@@ -1176,16 +1241,20 @@ export default function AgendaLicitacoes() {
                           formData.append('file', file);
                           
                           try {
-                            await axios.post(
-                              `${API}/agenda-licitacoes/${selectedLicitacao.id}/upload`,
-                              formData,
-                              {
-                                headers: {
-                                  'Authorization': `Bearer ${localStorage.getItem('token')}`,
-                                  'Content-Type': 'multipart/form-data'
+                            if (file.size > UPLOAD_EM_PARTES_ACIMA) {
+                              await enviarEditalEmPartes(file, selectedLicitacao.id);
+                            } else {
+                              await axios.post(
+                                `${API}/agenda-licitacoes/${selectedLicitacao.id}/upload`,
+                                formData,
+                                {
+                                  headers: {
+                                    'Authorization': `Bearer ${localStorage.getItem('token')}`,
+                                    'Content-Type': 'multipart/form-data'
+                                  }
                                 }
-                              }
-                            );
+                              );
+                            }
                             toast.success('Arquivo enviado com sucesso!');
                             // Recarregar licitação
                             const response = await axios.get(`${API}/agenda-licitacoes/${selectedLicitacao.id}`, getAuthHeader());
@@ -1229,9 +1298,7 @@ export default function AgendaLicitacoes() {
                               <Button 
                                 variant="outline" 
                                 size="sm"
-                                onClick={() => {
-                                  window.open(`${API}/agenda-licitacoes/${selectedLicitacao.id}/anexos/${anexo.id}/download`, '_blank');
-                                }}
+                                onClick={() => baixarAnexo(selectedLicitacao.id, anexo)}
                               >
                                 <Download className="h-4 w-4 mr-1" />
                                 Baixar
@@ -26,6 +26,8 @@ export default function Clientes() {
   const [open, setOpen] = useState(false);
   const [viewOpen, setViewOpen] = useState(false);
   const [viewingCliente, setViewingCliente] = useState(null);
+  const [historico, setHistorico] = useState([]);
+  const [historicoCursor, setHistoricoCursor] = useState(null);
   const [editingCliente, setEditingCliente] = useState(null);
   const [novaOcorrencia, setNovaOcorrencia] = useState({ tipo: 'observacao', descricao: '' });
   const [formData, setFormData] = useState({
@@ -52,6 +54,28 @@ export default function Clientes() {
     fetchClientes();
   }, []);
 
+  // Histórico de pedidos paginado (o cliente só guarda o resumo_compras)
+  const carregarHistorico = async (clienteId, cursor = null) => {
+    try {
+      const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await axios.get(`${API}/clientes/${clienteId}/historico${params}`, getAuthHeader());
+      setHistorico((anterior) => (cursor ? [...anterior, ...response.data] : response.data));
+      setHistoricoCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Erro ao carregar histórico do cliente');
+    }
+  };
+
+  // A listagem não traz o resumo_compras; o cliente completo vem de /clientes/{id}
+  const abrirCliente = async (clienteId) => {
+    try {
+      const response = await axios.get(`${API}/clientes/${clienteId}`, getAuthHeader());
+      setViewingCliente(response.data);
+    } catch (error) {
+      toast.error('Erro ao carregar cliente');
+    }
+  };
+
   const fetchClientes = async () => {
     try {
       const response = await axios.get(`${API}/clientes`, getAuthHeader());
@@ -132,11 +156,7 @@ export default function Clientes() {
       setNovaOcorrencia({ tipo: 'observacao', descricao: '' });
       
       // Atualizar dados do cliente visualizado
-      const response = await axios.get(`${API}/clientes`, getAuthHeader());
-      const clienteAtualizado = response.data.find(c => c.id === viewingCliente.id);
-      if (clienteAtualizado) {
-        setViewingCliente(clienteAtualizado);
-      }
+      await abrirCliente(viewingCliente.id);
       fetchClientes();
     } catch (error) {
       toast.error('Erro ao adicionar ocorrência');
@@ -449,6 +469,8 @@ export default function Clientes() {
                         size="icon"
                         onClick={() => {
                           setViewingCliente(cliente);
+                          abrirCliente(cliente.id);
+                          carregarHistorico(cliente.id);
                           setViewOpen(true);
                         }}
                         data-testid={`view-cliente-${cliente.id}`}
@@ -496,7 +518,7 @@ export default function Clientes() {
                 </TabsTrigger>
                 <TabsTrigger value="historico">
                   <History className="h-4 w-4 mr-2" />
-                  Histórico ({viewingCliente.historico?.length || 0})
+                  Histórico ({viewingCliente.resumo_compras?.quantidade_pedidos || 0})
                 </TabsTrigger>
                 <TabsTrigger value="ocorrencias">
                   <AlertTriangle className="h-4 w-4 mr-2" />
@@ -540,7 +562,13 @@ export default function Clientes() {
                   <p className="text-sm text-muted-foreground">
                     Histórico de pedidos realizados por este cliente
                   </p>
-                  {viewingCliente.historico && viewingCliente.historico.length > 0 ? (
+                  {viewingCliente.resumo_compras?.quantidade_pedidos > 0 && (
+                    <p className="text-sm">
+                      Total comprado: <span className="font-medium">R$ {(viewingCliente.resumo_compras.valor_total || 0).toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</span>
+                    </p>
+                  )}
+                  {historico.length > 0 ? (
+                    <>
                     <Table>
                       <TableHeader>
                         <TableRow>
@@ -551,8 +579,8 @@ export default function Clientes() {
                         </TableRow>
                       </TableHeader>
                       <TableBody>
-                        {viewingCliente.historico.map((h, idx) => (
-                          <TableRow key={idx}>
+                        {historico.map((h) => (
+                          <TableRow key={h.pedido_id}>
                             <TableCell className="font-mono">{h.numero}</TableCell>
                             <TableCell>{new Date(h.data).toLocaleDateString('pt-BR')}</TableCell>
                             <TableCell>{h.vendedor || '-'}</TableCell>
@@ -563,6 +591,14 @@ export default function Clientes() {
                         ))}
                       </TableBody>
                     </Table>
+                    {historicoCursor && (
+                      <div className="text-center">
+                        <Button variant="outline" size="sm" onClick={() => carregarHistorico(viewingCliente.id, historicoCursor)}>
+                          Carregar mais
+                        </Button>
+                      </div>
+                    )}
+                    </>
                   ) : (
                     <div className="text-center py-8 text-muted-foreground">
                       <History className="h-12 w-12 mx-auto mb-2 opacity-30" />
@@ -26,18 +26,17 @@ export default function Dashboard() {
 
   const fetchDashboardData = async () => {
     try {
-      const [pedidosRes, clientesRes, produtosRes, relatorioRes] = await Promise.all([
-        axios.get(`${API}/pedidos`, getAuthHeader()),
+      const [clientesRes, produtosRes, resumoRes] = await Promise.all([
         axios.get(`${API}/clientes`, getAuthHeader()),
         axios.get(`${API}/produtos`, getAuthHeader()),
-        axios.get(`${API}/relatorios/geral`, getAuthHeader())
+        axios.get(`${API}/relatorios/resumo`, getAuthHeader())
       ]);
 
       setStats({
-        pedidos: pedidosRes.data.length,
+        pedidos: resumoRes.data.quantidade_pedidos || 0,
         clientes: clientesRes.data.length,
         produtos: produtosRes.data.length,
-        faturamento: relatorioRes.data.total_faturado || 0
+        faturamento: resumoRes.data.total_faturado || 0
       });
     } catch (error) {
       console.error('Erro ao carregar dados:', error);
@@ -228,12 +228,13 @@ export default function Licitacoes() {
         numero_empenho: contratoForm.numero_contrato,
         data_empenho: new Date(contratoForm.data_inicio).toISOString(),
         numero_nota_empenho: '',
+        // id casa o produto já gravado; fornecido/restante são mantidos pelo servidor
         produtos: produtosContratados.map(p => ({
+          id: p.id,
           descricao: p.descricao,
           quantidade_contratada: p.quantidade_contratada,
           preco_compra: p.preco_compra,
-          preco_venda: p.preco_venda,
-          quantidade_fornecida: p.quantidade_fornecida || 0
+          preco_venda: p.preco_venda
         })),
         frete: 0,
         impostos: 0,
@@ -286,15 +287,22 @@ export default function Licitacoes() {
   };
 
   // Abrir modal de visualização
-  const handleVisualizarContrato = (contrato) => {
+  const handleVisualizarContrato = async (contrato) => {
     setSelectedContrato(contrato);
     setViewDialogOpen(true);
+    // A listagem não traz os fornecimentos; carregar o contrato completo
+    try {
+      const response = await axios.get(`${API}/licitacoes/${contrato.id}`, getAuthHeader());
+      setSelectedContrato(response.data);
+    } catch (error) {
+      toast.error('Erro ao carregar fornecimentos do contrato');
+    }
   };
 
   // Excluir contrato
   const handleExcluirContrato = async (contratoId) => {
     const contrato = contratos.find(c => c.id === contratoId);
-    const temFornecimentos = contrato && (contrato.fornecimentos || []).length > 0;
+    const temFornecimentos = contrato && (contrato.quantidade_fornecimentos || 0) > 0;
     
     const mensagemConfirmacao = temFornecimentos 
       ? 'Este contrato possui fornecimentos vinculados. Tem certeza que deseja excluir?'
@@ -15,6 +15,7 @@ import {
 } from 'lucide-react';
 import { toast } from 'sonner';
 import axios from 'axios';
+import BuscaCadastro from '@/components/BuscaCadastro';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -49,8 +50,6 @@ const TIPOS_PERSONALIZACAO = [
 
 export default function Orcamentos() {
   const [orcamentos, setOrcamentos] = useState([]);
-  const [clientes, setClientes] = useState([]);
-  const [produtos, setProdutos] = useState([]);
   const [vendedores, setVendedores] = useState([]);
   const [loading, setLoading] = useState(true);
   const [open, setOpen] = useState(false);
@@ -104,15 +103,11 @@ export default function Orcamentos() {
 
   const fetchData = async () => {
     try {
-      const [orcRes, cliRes, prodRes, vendRes] = await Promise.all([
+      const [orcRes, vendRes] = await Promise.all([
         axios.get(`${API}/orcamentos`, getAuthHeader()),
-        axios.get(`${API}/clientes`, getAuthHeader()),
-        axios.get(`${API}/produtos`, getAuthHeader()),
         axios.get(`${API}/vendedores`, getAuthHeader())
       ]);
       setOrcamentos(orcRes.data);
-      setClientes(cliRes.data);
-      setProdutos(prodRes.data);
       setVendedores(vendRes.data);
     } catch (error) {
       toast.error('Erro ao carregar dados');
@@ -177,27 +172,52 @@ export default function Orcamentos() {
     setDespesasOrcamento(despesasOrcamento.filter(d => d.id !== id));
   };
 
-  const buscarClientePorCodigo = () => {
-    const cliente = clientes.find(c => c.codigo === clienteBusca);
-    if (cliente) {
+  // Clientes e produtos não são baixados inteiros: busca por código nas rotas próprias,
+  // por nome/descrição em /search, e o cadastro completo só do cliente escolhido
+  const carregarCliente = async (clienteId) => {
+    if (!clienteId) return null;
+    try {
+      const response = await axios.get(`${API}/clientes/${clienteId}`, getAuthHeader());
+      return response.data;
+    } catch (error) {
+      return null;
+    }
+  };
+
+  const selecionarCliente = async (cliente) => {
+    setFormData((anterior) => ({ ...anterior, cliente_id: cliente.id }));
+    setClienteSelecionado((await carregarCliente(cliente.id)) || cliente);
+  };
+
+  const buscarClientePorCodigo = async () => {
+    if (!clienteBusca) return;
+    try {
+      const response = await axios.get(`${API}/clientes/codigo/${encodeURIComponent(clienteBusca)}`, getAuthHeader());
+      const cliente = response.data;
       setClienteSelecionado(cliente);
-      setFormData({ ...formData, cliente_id: cliente.id });
+      setFormData((anterior) => ({ ...anterior, cliente_id: cliente.id }));
       toast.success(`Cliente encontrado: ${cliente.nome || cliente.razao_social}`);
-    } else {
+    } catch (error) {
       toast.error('Cliente não encontrado');
     }
   };
 
-  const buscarProdutoPorCodigo = () => {
-    const produto = produtos.find(p => p.codigo === novoItem.produto_codigo);
-    if (produto) {
-      setNovoItem({
-        ...novoItem,
-        descricao: produto.descricao,
-        preco_unitario: produto.preco_venda_sugerido?.toString() || '0'
-      });
-      toast.success(`Produto encontrado: ${produto.descricao}`);
-    } else {
+  const selecionarProduto = (produto) => {
+    setNovoItem((anterior) => ({
+      ...anterior,
+      produto_codigo: produto.codigo || '',
+      descricao: produto.descricao,
+      preco_unitario: produto.preco_venda?.toString() || '0'
+    }));
+  };
+
+  const buscarProdutoPorCodigo = async () => {
+    if (!novoItem.produto_codigo) return;
+    try {
+      const response = await axios.get(`${API}/produtos/codigo/${encodeURIComponent(novoItem.produto_codigo)}`, getAuthHeader());
+      selecionarProduto(response.data);
+      toast.success(`Produto encontrado: ${response.data.descricao}`);
+    } catch (error) {
       toast.error('Produto não encontrado');
     }
   };
@@ -331,10 +351,9 @@ export default function Orcamentos() {
     }
   };
 
-  const handleEdit = (orc) => {
+  const handleEdit = async (orc) => {
     setEditingOrcamento(orc);
-    const cliente = clientes.find(c => c.id === orc.cliente_id);
-    setClienteSelecionado(cliente);
+    setClienteSelecionado(await carregarCliente(orc.cliente_id));
     setFormData({
       cliente_id: orc.cliente_id,
       vendedor: orc.vendedor || '',
@@ -443,179 +462,20 @@ export default function Orcamentos() {
     }
   };
 
-  const gerarPDF = (orc) => {
-    const dataOrc = new Date(orc.data).toLocaleDateString('pt-BR');
-    const dataValidade = new Date(new Date(orc.data).getTime() + orc.validade_dias * 24 * 60 * 60 * 1000).toLocaleDateString('pt-BR');
-    
-    const html = `
-      <!DOCTYPE html>
-      <html>
-      <head>
-        <meta charset="UTF-8">
-        <title>Orçamento ${orc.numero}</title>
-        <style>
-          * { margin: 0; padding: 0; box-sizing: border-box; }
-          body { font-family: 'Segoe UI', Arial, sans-serif; padding: 30px; color: #333; font-size: 13px; }
-          .header { display: flex; justify-content: space-between; align-items: flex-start; margin-bottom: 30px; padding-bottom: 20px; border-bottom: 3px solid #1e3a5f; }
-          .logo { font-size: 24px; font-weight: bold; color: #1e3a5f; }
-          .logo span { color: #f97316; }
-          .doc-info { text-align: right; }
-          .doc-info h2 { color: #1e3a5f; font-size: 22px; margin-bottom: 5px; }
-          .doc-info p { color: #666; font-size: 12px; }
-          .section { margin-bottom: 25px; }
-          .section-title { font-size: 14px; font-weight: bold; color: #1e3a5f; margin-bottom: 10px; padding-bottom: 5px; border-bottom: 2px solid #e2e8f0; }
-          .info-grid { display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }
-          .info-box { background: #f8fafc; padding: 15px; border-radius: 6px; }
-          .info-box h4 { font-size: 12px; color: #666; text-transform: uppercase; margin-bottom: 8px; }
-          .info-box p { font-size: 13px; margin-bottom: 3px; }
-          .info-box strong { color: #1e3a5f; }
-          table { width: 100%; border-collapse: collapse; margin-bottom: 20px; }
-          th { background: #1e3a5f; color: white; padding: 10px 8px; text-align: left; font-size: 12px; }
-          th.right, td.right { text-align: right; }
-          th.center, td.center { text-align: center; }
-          td { padding: 10px 8px; border-bottom: 1px solid #e2e8f0; vertical-align: top; }
-          tr:nth-child(even) { background: #f8fafc; }
-          .produto-img { max-width: 60px; max-height: 60px; border-radius: 4px; }
-          .personalizacao { font-size: 11px; color: #f97316; font-style: italic; }
-          .totais { margin-left: auto; width: 300px; }
-          .totais-row { display: flex; justify-content: space-between; padding: 8px 0; border-bottom: 1px solid #e2e8f0; }
-          .totais-row.final { background: #1e3a5f; color: white; padding: 12px 10px; border-radius: 6px; font-size: 16px; font-weight: bold; margin-top: 10px; }
-          .obs { background: #fef3c7; padding: 15px; border-radius: 6px; border-left: 4px solid #f97316; }
-          .obs h4 { color: #92400e; margin-bottom: 8px; }
-          .obs p { color: #78350f; font-size: 12px; }
-          .footer { margin-top: 40px; padding-top: 20px; border-top: 1px solid #e2e8f0; text-align: center; font-size: 11px; color: #888; }
-          .conditions { margin-top: 30px; padding: 15px; background: #f8fafc; border-radius: 6px; }
-          .conditions h4 { font-size: 12px; color: #1e3a5f; margin-bottom: 10px; }
-          .conditions ul { font-size: 11px; color: #666; margin-left: 20px; }
-          .conditions li { margin-bottom: 5px; }
-          @media print { body { padding: 15px; } .produto-img { max-width: 50px; max-height: 50px; } }
-        </style>
-      </head>
-      <body>
-        <div class="header">
-          <div class="logo">XSELL <span>SOLUÇÕES</span></div>
-          <div class="doc-info">
-            <h2>ORÇAMENTO</h2>
-            <p><strong>Nº:</strong> ${orc.numero}</p>
-            <p><strong>Data:</strong> ${dataOrc}</p>
-            <p><strong>Validade:</strong> ${dataValidade}</p>
-          </div>
-        </div>
-        
-        <div class="info-grid">
-          <div class="info-box">
-            <h4>Cliente</h4>
-            <p><strong>${orc.cliente_nome}</strong></p>
-            ${orc.cliente_cnpj ? `<p>CNPJ: ${orc.cliente_cnpj}</p>` : ''}
-            ${orc.cliente_endereco ? `<p>${orc.cliente_endereco}</p>` : ''}
-            ${orc.cliente_telefone ? `<p>Tel: ${orc.cliente_telefone}</p>` : ''}
-            ${orc.cliente_email ? `<p>Email: ${orc.cliente_email}</p>` : ''}
-          </div>
-          <div class="info-box">
-            <h4>Condições Comerciais</h4>
-            <p><strong>Forma de Pagamento:</strong> ${orc.forma_pagamento || '-'}</p>
-            <p><strong>Prazo de Entrega:</strong> ${orc.prazo_entrega || '-'}</p>
-            <p><strong>Frete:</strong> ${FRETE_OPCOES.find(f => f.value === orc.frete_por_conta)?.label || orc.frete_por_conta}</p>
-            ${orc.vendedor ? `<p><strong>Vendedor:</strong> ${orc.vendedor}</p>` : ''}
-          </div>
-        </div>
-        
-        <div class="section" style="margin-top: 25px;">
-          <div class="section-title">Itens do Orçamento</div>
-          <table>
-            <thead>
-              <tr>
-                <th style="width: 70px;">Imagem</th>
-                <th>Descrição</th>
-                <th class="center" style="width: 60px;">Qtd</th>
-                <th class="center" style="width: 50px;">Un</th>
-                <th class="right" style="width: 100px;">Preço Unit.</th>
-                <th class="right" style="width: 100px;">Total</th>
-              </tr>
-            </thead>
-            <tbody>
-              ${(orc.itens || []).map(item => `
-                <tr>
-                  <td class="center">
-                    ${item.imagem_url 
-                      ? `<img src="${item.imagem_url}" alt="${item.descricao}" class="produto-img" />` 
-                      : '<span style="color:#ccc;">-</span>'}
-                  </td>
-                  <td>
-                    <strong>${item.descricao}</strong>
-                    ${item.produto_codigo ? `<br><small style="color:#666;">Cód: ${item.produto_codigo}</small>` : ''}
-                    ${item.personalizado ? `<br><span class="personalizacao">✨ ${item.tipo_personalizacao} (+R$ ${(item.valor_personalizacao || 0).toFixed(2)}/un)</span>` : ''}
-                  </td>
-                  <td class="center">${item.quantidade}</td>
-                  <td class="center">${item.unidade || 'UN'}</td>
-                  <td class="right">R$ ${((item.preco_unitario || 0) + (item.valor_personalizacao || 0)).toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</td>
-                  <td class="right"><strong>R$ ${(item.preco_total || 0).toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</strong></td>
-                </tr>
-              `).join('')}
-            </tbody>
-          </table>
-          
-          <div class="totais">
-            <div class="totais-row">
-              <span>Subtotal:</span>
-              <span>R$ ${(orc.valor_total || 0).toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</span>
-            </div>
-            ${orc.repassar_frete && orc.valor_frete > 0 ? `
-              <div class="totais-row">
-                <span>Frete:</span>
-                <span>R$ ${orc.valor_frete.toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</span>
-              </div>
-            ` : ''}
-            ${orc.repassar_outras_despesas && orc.outras_despesas > 0 ? `
-              <div class="totais-row">
-                <span>Outras Despesas${orc.descricao_outras_despesas ? ` (${orc.descricao_outras_despesas})` : ''}:</span>
-                <span>R$ ${orc.outras_despesas.toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</span>
-              </div>
-            ` : ''}
-            ${orc.desconto > 0 ? `
-              <div class="totais-row">
-                <span>Desconto:</span>
-                <span style="color: #22c55e;">- R$ ${orc.desconto.toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</span>
-              </div>
-            ` : ''}
-            <div class="totais-row final">
-              <span>VALOR TOTAL:</span>
-              <span>R$ ${(orc.valor_final || orc.valor_total || 0).toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</span>
-            </div>
-          </div>
-        </div>
-        
-        ${orc.observacoes ? `
-          <div class="obs">
-            <h4>Observações</h4>
-            <p>${orc.observacoes}</p>
-          </div>
-        ` : ''}
-        
-        <div class="conditions">
-          <h4>Condições Gerais</h4>
-          <ul>
-            <li>Este orçamento é válido por ${orc.validade_dias} dias a partir da data de emissão.</li>
-            <li>Os preços podem sofrer alterações sem aviso prévio após o vencimento.</li>
-            <li>Produto sujeito à disponibilidade de estoque no momento do fechamento do pedido.</li>
-            <li>Imagens meramente ilustrativas.</li>
-          </ul>
-        </div>
-        
-        <div class="footer">
-          <p>XSELL Soluções Corporativas LTDA | Documento gerado em ${new Date().toLocaleString('pt-BR')}</p>
-        </div>
-      </body>
-      </html>
-    `;
-    
-    const pdfWindow = window.open('', '_blank');
-    if (pdfWindow) {
-      pdfWindow.document.write(html);
-      pdfWindow.document.close();
-      toast.success('PDF gerado! Use Ctrl+P para salvar.');
-    } else {
-      toast.error('Bloqueador de pop-up ativo. Permita pop-ups para esta página.');
+  const gerarPDF = async (orc) => {
+    try {
+      const response = await axios.get(`${API}/orcamentos/${orc.id}/pdf`, { ...getAuthHeader(), responseType: 'blob' });
+      const url = window.URL.createObjectURL(new Blob([response.data], { type: 'application/pdf' }));
+      const link = document.createElement('a');
+      link.href = url;
+      link.setAttribute('download', `Orcamento_${orc.numero}.pdf`);
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+      toast.success('PDF gerado!');
+    } catch (error) {
+      toast.error('Erro ao gerar PDF do orçamento');
     }
   };
 
@@ -682,13 +542,13 @@ export default function Orcamentos() {
                       </div>
                     </div>
                     <div className="flex-1">
-                      <Label>Ou selecione</Label>
-                      <Select value={formData.cliente_id} onValueChange={(v) => { setFormData({...formData, cliente_id: v}); setClienteSelecionado(clientes.find(c => c.id === v)); }}>
-                        <SelectTrigger><SelectValue placeholder="Selecione um cliente" /></SelectTrigger>
-                        <SelectContent>
-                          {clientes.map(cli => <SelectItem key={cli.id} value={cli.id}>{cli.codigo} - {cli.nome || cli.razao_social}</SelectItem>)}
-                        </SelectContent>
-                      </Select>
+                      <Label>Ou busque</Label>
+                      <BuscaCadastro
+                        tipo="cliente"
+                        onSelect={selecionarCliente}
+                        placeholder="Nome, código ou CPF/CNPJ"
+                        testId="orcamento-cliente-busca"
+                      />
                     </div>
                   </div>
                   {clienteSelecionado && (
@@ -707,6 +567,15 @@ export default function Orcamentos() {
                   <CardTitle className="text-lg flex items-center gap-2"><Package className="h-5 w-5" />Adicionar Produto</CardTitle>
                 </CardHeader>
                 <CardContent className="space-y-4">
+                  <div>
+                    <Label>Buscar produto cadastrado</Label>
+                    <BuscaCadastro
+                      tipo="produto"
+                      onSelect={selecionarProduto}
+                      placeholder="Descrição ou código (ou preencha os campos abaixo)"
+                      testId="orcamento-produto-busca"
+                    />
+                  </div>
                   <div className="grid grid-cols-6 gap-4">
                     <div className="col-span-1">
                       <Label>Código</Label>
@@ -12,6 +12,7 @@ import { DropdownMenu, DropdownMenuContent, DropdownMenuItem, DropdownMenuTrigge
 import { Plus, Eye, Pencil, Trash2, Printer, X, Search, ChevronDown, CreditCard, Download } from 'lucide-react';
 import { toast } from 'sonner';
 import axios from 'axios';
+import BuscaCadastro from '@/components/BuscaCadastro';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -31,14 +32,15 @@ const STATUS_OPTIONS = [
 
 export default function Pedidos() {
   const [pedidos, setPedidos] = useState([]);
-  const [clientes, setClientes] = useState([]);
-  const [produtos, setProdutos] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [carregandoMais, setCarregandoMais] = useState(false);
   const [vendedores, setVendedores] = useState([]);
   const [dadosPagamento, setDadosPagamento] = useState([]);
   const [loading, setLoading] = useState(true);
   const [open, setOpen] = useState(false);
   const [viewOpen, setViewOpen] = useState(false);
   const [viewingPedido, setViewingPedido] = useState(null);
+  const [viewingCliente, setViewingCliente] = useState(null);
   const [editingPedido, setEditingPedido] = useState(null);
   const [buscandoCliente, setBuscandoCliente] = useState(false);
   
@@ -88,18 +90,36 @@ export default function Pedidos() {
     fetchData();
   }, []);
 
+  const selecionarCliente = (cliente) => {
+    setFormData({
+      ...formData,
+      cliente_id: cliente.id,
+      cliente_nome: `${cliente.nome} - ${cliente.cpf_cnpj || ''}`,
+      codigo_cliente: cliente.codigo || ''
+    });
+  };
+
+  // Clientes e produtos não são baixados inteiros: os seletores usam /search e as telas
+  // que precisam do cadastro completo do cliente buscam só ele
+  const carregarCliente = async (clienteId) => {
+    if (!clienteId) return null;
+    try {
+      const response = await axios.get(`${API}/clientes/${clienteId}`, getAuthHeader());
+      return response.data;
+    } catch (error) {
+      return null;
+    }
+  };
+
   const fetchData = async () => {
     try {
-      const [pedidosRes, clientesRes, produtosRes, vendedoresRes, dadosPagamentoRes] = await Promise.all([
-        axios.get(`${API}/pedidos`, getAuthHeader()),
-        axios.get(`${API}/clientes`, getAuthHeader()),
-        axios.get(`${API}/produtos`, getAuthHeader()),
+      const [pedidosRes, vendedoresRes, dadosPagamentoRes] = await Promise.all([
+        axios.get(`${API}/pedidos`, { ...getAuthHeader(), params: { limit: 50 } }),
         axios.get(`${API}/vendedores`, getAuthHeader()),
         axios.get(`${API}/dados-pagamento`, getAuthHeader())
       ]);
       setPedidos(pedidosRes.data);
-      setClientes(clientesRes.data);
-      setProdutos(produtosRes.data);
+      setNextCursor(pedidosRes.headers['x-next-cursor'] || null);
       setVendedores(vendedoresRes.data.filter(v => v.ativo));
       setDadosPagamento(dadosPagamentoRes.data);
     } catch (error) {
@@ -109,6 +129,23 @@ export default function Pedidos() {
     }
   };
 
+  const carregarMaisPedidos = async () => {
+    if (!nextCursor) return;
+    setCarregandoMais(true);
+    try {
+      const response = await axios.get(`${API}/pedidos`, {
+        ...getAuthHeader(),
+        params: { cursor: nextCursor, limit: 50 }
+      });
+      setPedidos([...pedidos, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Erro ao carregar mais pedidos');
+    } finally {
+      setCarregandoMais(false);
+    }
+  };
+
   const buscarClientePorCodigo = async () => {
     if (!formData.codigo_cliente) {
       toast.error('Digite o código do cliente');
@@ -172,13 +209,12 @@ export default function Pedidos() {
     }
   };
 
-  const handleProdutoChange = (produtoId) => {
-    const produto = produtos.find(p => p.id === produtoId);
+  const handleProdutoChange = (produto) => {
     if (produto) {
       setProdutoEncontrado(produto);
       setNovoItem({
         ...novoItem,
-        produto_id: produtoId,
+        produto_id: produto.id,
         produto_nome: `${produto.codigo} - ${produto.descricao}`,
         preco_compra: produto.preco_compra.toString(),
         preco_venda: produto.preco_venda.toString(),
@@ -193,7 +229,7 @@ export default function Pedidos() {
       return;
     }
 
-    const produto = produtos.find(p => p.id === novoItem.produto_id) || produtoEncontrado;
+    const produto = produtoEncontrado;
     const quantidade = parseFloat(novoItem.quantidade);
     const precoCompra = parseFloat(novoItem.preco_compra);
     const precoVenda = parseFloat(novoItem.preco_venda);
@@ -371,6 +407,7 @@ export default function Pedidos() {
     try {
       const response = await axios.get(`${API}/pedidos/${pedidoId}`, getAuthHeader());
       setViewingPedido(response.data);
+      setViewingCliente(await carregarCliente(response.data.cliente_id));
       setViewOpen(true);
     } catch (error) {
       toast.error('Erro ao carregar detalhes do pedido');
@@ -385,7 +422,7 @@ export default function Pedidos() {
       
       // Encontrar o vendedor pelo nome
       const vendedor = vendedores.find(v => v.nome === pedidoCompleto.vendedor);
-      const cliente = clientes.find(c => c.id === pedidoCompleto.cliente_id);
+      const cliente = await carregarCliente(pedidoCompleto.cliente_id);
       
       setFormData({
         codigo_cliente: cliente?.codigo || '',
@@ -415,9 +452,7 @@ export default function Pedidos() {
   };
 
   // Função auxiliar para gerar o HTML do PDF do Cliente
-  const gerarHtmlCliente = (pedido) => {
-    const cliente = clientes.find(c => c.id === pedido.cliente_id);
-    
+  const gerarHtmlCliente = (pedido, cliente) => {
     let subtotalItens = pedido.itens.reduce((sum, item) => {
       let precoItem = item.preco_venda;
       if (item.personalizado && item.repassar_personalizacao) {
@@ -583,36 +618,35 @@ export default function Pedidos() {
   };
 
   // Função para IMPRIMIR Via Cliente (abre Ctrl+P)
-  const handlePrintCliente = (pedido) => {
+  const handlePrintCliente = async (pedido) => {
     const printWindow = window.open('', '_blank');
     if (!printWindow) {
       toast.error('Não foi possível abrir a janela. Verifique se o bloqueador de pop-ups está desativado.');
       return;
     }
     
-    printWindow.document.write(gerarHtmlCliente(pedido));
+    printWindow.document.write(gerarHtmlCliente(pedido, await carregarCliente(pedido.cliente_id)));
     printWindow.document.close();
     printWindow.focus();
     setTimeout(() => printWindow.print(), 500);
   };
 
   // Função para SALVAR PDF Via Cliente (baixar)
-  const handleSaveCliente = (pedido) => {
+  const handleSaveCliente = async (pedido) => {
     const printWindow = window.open('', '_blank');
     if (!printWindow) {
       toast.error('Não foi possível abrir a janela. Verifique se o bloqueador de pop-ups está desativado.');
       return;
     }
     
-    printWindow.document.write(gerarHtmlCliente(pedido));
+    printWindow.document.write(gerarHtmlCliente(pedido, await carregarCliente(pedido.cliente_id)));
     printWindow.document.close();
     printWindow.focus();
     toast.success('Documento aberto! Use Ctrl+S para salvar ou Ctrl+P para salvar como PDF.');
   };
 
   // Função auxiliar para gerar o HTML da Via Interna
-  const gerarHtmlInterno = (pedido) => {
-    const cliente = clientes.find(c => c.id === pedido.cliente_id);
+  const gerarHtmlInterno = (pedido, cliente) => {
     const despesasDetalhadas = pedido.despesas_detalhadas || [];
     const frete = pedido.frete || 0;
     
@@ -785,28 +819,28 @@ export default function Pedidos() {
   };
 
   // Função para IMPRIMIR Via Interna (abre Ctrl+P)
-  const handlePrintInterno = (pedido) => {
+  const handlePrintInterno = async (pedido) => {
     const printWindow = window.open('', '_blank');
     if (!printWindow) {
       toast.error('Não foi possível abrir a janela. Verifique se o bloqueador de pop-ups está desativado.');
       return;
     }
     
-    printWindow.document.write(gerarHtmlInterno(pedido));
+    printWindow.document.write(gerarHtmlInterno(pedido, await carregarCliente(pedido.cliente_id)));
     printWindow.document.close();
     printWindow.focus();
     setTimeout(() => printWindow.print(), 500);
   };
 
   // Função para SALVAR PDF Via Interna (baixar)
-  const handleSaveInterno = (pedido) => {
+  const handleSaveInterno = async (pedido) => {
     const printWindow = window.open('', '_blank');
     if (!printWindow) {
       toast.error('Não foi possível abrir a janela. Verifique se o bloqueador de pop-ups está desativado.');
       return;
     }
     
-    printWindow.document.write(gerarHtmlInterno(pedido));
+    printWindow.document.write(gerarHtmlInterno(pedido, await carregarCliente(pedido.cliente_id)));
     printWindow.document.close();
     printWindow.focus();
     toast.success('Documento aberto! Use Ctrl+S para salvar ou Ctrl+P para salvar como PDF.');
@@ -928,26 +962,12 @@ export default function Pedidos() {
                       {formData.cliente_nome}
                     </div>
                   ) : (
-                    <Select value={formData.cliente_id} onValueChange={(v) => {
-                      const cliente = clientes.find(c => c.id === v);
-                      setFormData({
-                        ...formData, 
-                        cliente_id: v,
-                        cliente_nome: cliente ? `${cliente.nome} - ${cliente.cnpj}` : '',
-                        codigo_cliente: cliente ? cliente.codigo : ''
-                      });
-                    }}>
-                      <SelectTrigger data-testid="pedido-cliente-select">
-                        <SelectValue placeholder="Ou selecione da lista" />
-                      </SelectTrigger>
-                      <SelectContent>
-                        {clientes.map(cliente => (
-                          <SelectItem key={cliente.id} value={cliente.id}>
-                            {cliente.codigo} - {cliente.nome}
-                          </SelectItem>
-                        ))}
-                      </SelectContent>
-                    </Select>
+                    <BuscaCadastro
+                      tipo="cliente"
+                      onSelect={selecionarCliente}
+                      placeholder="Ou busque por nome, código ou CPF/CNPJ"
+                      testId="pedido-cliente-busca"
+                    />
                   )}
                 </div>
               </div>
@@ -1170,18 +1190,12 @@ export default function Pedidos() {
                           </Button>
                         </div>
                       ) : (
-                        <Select value={novoItem.produto_id} onValueChange={handleProdutoChange}>
-                          <SelectTrigger>
-                            <SelectValue placeholder="Ou selecione da lista" />
-                          </SelectTrigger>
-                          <SelectContent>
-                            {produtos.map(produto => (
-                              <SelectItem key={produto.id} value={produto.id}>
-                                {produto.codigo} - {produto.descricao}
-                              </SelectItem>
-                            ))}
-                          </SelectContent>
-                        </Select>
+                        <BuscaCadastro
+                          tipo="produto"
+                          onSelect={handleProdutoChange}
+                          placeholder="Ou busque por descrição ou código"
+                          testId="pedido-produto-busca"
+                        />
                       )}
                     </div>
                   </div>
@@ -1455,6 +1469,13 @@ export default function Pedidos() {
               </TableBody>
             </Table>
           )}
+          {nextCursor && (
+            <div className="flex justify-center pt-4">
+              <Button variant="outline" onClick={carregarMaisPedidos} disabled={carregandoMais} data-testid="load-more-pedidos-button">
+                {carregandoMais ? 'Carregando...' : 'Carregar mais'}
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
 
@@ -1475,7 +1496,7 @@ export default function Pedidos() {
                 <div className="grid grid-cols-2 gap-3 text-sm">
                   <div><span className="font-medium text-blue-800">Nome:</span> {viewingPedido.cliente_nome}</div>
                   {(() => {
-                    const cliente = clientes.find(c => c.id === viewingPedido.cliente_id);
+                    const cliente = viewingCliente;
                     if (!cliente) return null;
                     return (
                       <>
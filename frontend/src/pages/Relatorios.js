@@ -548,20 +548,32 @@ export default function Relatorios() {
     }
   };
 
-  const handleSavePDF = () => {
+  const handleSavePDF = async () => {
     if (!relatorio) {
       toast.error('Gere um relatório primeiro');
       return;
     }
     
-    const html = gerarRelatorioHTML();
-    const pdfWindow = window.open('', '_blank');
-    if (pdfWindow) {
-      pdfWindow.document.write(html);
-      pdfWindow.document.close();
-      toast.success('PDF aberto em nova aba. Use Ctrl+P ou Cmd+P para salvar como PDF.');
-    } else {
-      toast.error('Não foi possível abrir a janela. Verifique o bloqueador de pop-ups.');
+    try {
+      const params = new URLSearchParams();
+      if (filtros.data_inicio) params.append('data_inicio', filtros.data_inicio);
+      if (filtros.data_fim) params.append('data_fim', filtros.data_fim);
+      if (filtros.segmento && filtros.segmento !== 'todos') params.append('segmento', filtros.segmento);
+      if (filtros.vendedor) params.append('vendedor', filtros.vendedor);
+      if (filtros.cidade) params.append('cidade', filtros.cidade);
+      
+      const response = await axios.get(`${API}/relatorios/geral/pdf?${params.toString()}`, { ...getAuthHeader(), responseType: 'blob' });
+      const url = window.URL.createObjectURL(new Blob([response.data], { type: 'application/pdf' }));
+      const link = document.createElement('a');
+      link.href = url;
+      link.setAttribute('download', `Relatorio_XSELL_${filtros.data_inicio || 'inicio'}_${filtros.data_fim || 'hoje'}.pdf`);
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+      toast.success('PDF gerado!');
+    } catch (error) {
+      toast.error('Erro ao gerar PDF do relatório');
     }
   };
 